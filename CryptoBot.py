@@ -10,28 +10,29 @@ import datetime as dt
 
 from time import sleep
 from config import Config
-from utils import IPC, Processing
+from utils import Processing
 
 StreamPID = None
+TraderPID = None
 
 def main():
 
-    global StreamPID
-
-    # Clean-up before start
-    if IPC.get( IPC.isRunning ):
-        IPC.set( IPC.isRunning, remove=True )
+    global StreamPID, TraderPID
 
     # we first need to start the Stream and wait a little  
     StreamPID = Processing.start( Config.CryptoStream )
     print( f'{str(dt.datetime.now())} CryptoStream started PID:{StreamPID}' )
     sleep(15)
 
+    # CryptoTrader is a long-lived service, we only need to restart it if it died
     while True:
 
-        if not IPC.get( IPC.isRunning ):
-            Processing.start( Config.CryptoTrader, Config.STDOUT )
-        
+        TraderPID = Processing.start( Config.CryptoTrader, Config.STDOUT )
+        print( f'{str(dt.datetime.now())} CryptoTrader started PID:{TraderPID}' )
+
+        # blocks until the trader exits
+        Processing.wait( TraderPID )
+        print( f'{str(dt.datetime.now())} CryptoTrader PID:{TraderPID} died, restarting...' )
         sleep(5)
 
 
@@ -44,6 +45,7 @@ if __name__ == '__main__':
         ##
         print( f'\n\nBot will be stopped.. this may take 5 seconds...')
         Processing.stop( StreamPID )
-        IPC.set( IPC.isRunning, remove=True )
+        if TraderPID is not None:
+            Processing.stop( TraderPID )
         sleep(5)
         sys.exit(0)
@@ -6,42 +6,150 @@
 #
 
 import os
+import sys
 import time
 import ast
-import numpy as np
 import pandas as pd
 import datetime as dt
 
 
 from config import Config
-
-#logfile = Config.Logfile
-logfile = '/home/dave/code/crypto/bot/log/ms_test9-2.log'
+from journal import Journal
 
 clear = lambda: os.system('clear')
 
-def reporting():
-    data = []
-    with open( logfile ) as fd:
-        lines = fd.readlines()
-    for line in lines:
-        data.append( ast.literal_eval( line.rstrip() ) )
-    fd.close()
-
-    df = pd.DataFrame( data )
-    df.ask = df.ask.astype(float)
-    df.ask_qty = df.ask_qty.astype(float)
-    df.bid = df.bid.astype(float)
-    df.bid_qty = df.bid_qty.astype(float)
-    df.profit = df.profit.astype(float)
-    df.total_profit = df.total_profit.astype(float)
-    df.duration = pd.to_timedelta(df.duration)
-    #df = df.set_index('ts')
+
+class LogTail:
+    ''' Follow a growing log file like tail -F, only the lines appended since the last call are read
+
+    Remembers the offset and the inode of the file. If the file was rotated (the path points to a new inode)
+    the rest of the old file is read first, then we continue at the start of the new one.
+    If it was truncated (it is smaller than our offset) we start over and report it, so the caller can reset.
+
+    :param path -> type:str: path to the log file
+    '''
+    def __init__( self, path ):
+        self.path = path
+        self.fd = None
+        self.inode = None
+        self.offset = 0
+        # an incomplete last line, completed by the next read
+        self.partial = b''
+
+    def open( self ):
+        try:
+            self.fd = open( self.path, 'rb' )
+        except FileNotFoundError:
+            return False
+        self.inode = os.fstat( self.fd.fileno() ).st_ino
+        self.offset = 0
+        self.partial = b''
+        return True
+
+    def read( self ):
+        data = self.fd.read()
+        self.offset += len( data )
+        data = self.partial + data
+        end = data.rfind( b'\n' ) + 1
+        self.partial = data[ end: ]
+        return [ line.decode() for line in data[ :end ].splitlines() if line.strip() ]
+
+    def lines( self ):
+        ''' Return the complete lines appended since the last call
+
+        :return Tuple( List of str, bool: True if the file was truncated and is read from the start again )
+        '''
+        if self.fd is None and not self.open():
+            return [], False
+        truncated = False
+        if os.fstat( self.fd.fileno() ).st_size < self.offset:
+            self.fd.seek( 0 )
+            self.offset = 0
+            self.partial = b''
+            truncated = True
+        lines = self.read()
+        try:
+            rotated = os.stat( self.path ).st_ino != self.inode
+        except FileNotFoundError:
+            # rotated away, the new file is not there yet
+            return lines, truncated
+        if rotated:
+            self.fd.close()
+            if self.open():
+                lines += self.read()
+        return lines, truncated
+
+
+class Aggregates:
+    ''' Running totals of the trade log, updated record by record instead of rebuilding a DataFrame
+    '''
+    Columns = [ 'ask', 'ask_qty', 'bid', 'bid_qty', 'profit', 'total_profit', 'ROC', 'RSI', 'ATR', 'OBV' ]
+
+    def __init__( self ):
+        self.trades = 0
+        self.won = 0
+        self.lost = 0
+        self.won_profit = 0.0
+        self.lost_profit = 0.0
+        self.duration = dt.timedelta()
+        self.first = None
+        self.last = None
+        self.skipped = 0
+        # symbol -> { column -> sum }
+        self.symbols = {}
+
+    def update( self, line ):
+        try:
+            record = ast.literal_eval( line.rstrip() )
+        except ( ValueError, SyntaxError ):
+            self.skipped += 1
+            return
+        total_profit = float( record[ 'total_profit' ] )
+        self.trades += 1
+        if record[ 'state' ] == 'WON':
+            self.won += 1
+            self.won_profit += total_profit
+        elif record[ 'state' ] == 'LOST':
+            self.lost += 1
+            self.lost_profit += total_profit
+        duration = pd.to_timedelta( record[ 'duration' ] )
+        self.duration += duration
+        ts = dt.datetime.fromisoformat( record[ 'ts' ] )
+        self.first = ts if self.first is None else self.first
+        self.last = ts
+        totals = self.symbols.setdefault( record[ 'symbol' ], { **dict.fromkeys( self.Columns, 0.0 ), 'duration' : dt.timedelta() } )
+        for column in self.Columns:
+            if column in record:
+                totals[ column ] += float( record[ column ] )
+        totals[ 'duration' ] += duration
+
+    def summary( self ):
+        ''' Same as Journal.summary()
+        '''
+        return { 'trades' : self.trades, 'won' : self.won, 'lost' : self.lost, 'won_profit' : self.won_profit, 'lost_profit' : self.lost_profit,
+            'duration' : self.duration.total_seconds() / self.trades if self.trades else None,
+            'first' : None if self.first is None else self.first.timestamp() * 1000, 'last' : None if self.last is None else self.last.timestamp() * 1000 }
+
+    def by_symbol( self ):
+        return pd.DataFrame.from_dict( self.symbols, orient='index' ).sort_index()
+
+
+def reporting( source, name ):
+    ''' Print the report
+
+    :param source   -> Journal, or Aggregates of a text log, both provide summary() and by_symbol()
+    :param name     -> type:str: path of the source
+    '''
+    a = source.summary()
+    if not a[ 'trades' ]:
+        print( f'Report {name} created at {dt.datetime.now()}\nNo trades yet' )
+        return
+    first = dt.datetime.fromtimestamp( a[ 'first' ] / 1000 )
+    last = dt.datetime.fromtimestamp( a[ 'last' ] / 1000 )
 
     # das ist nur die effektive laufzeit des trading, nicht die gesamtlaufzeit des bots!
-    #runtime=str( dt.datetime.fromisoformat(df.ts.iloc[-1]) - dt.datetime.fromisoformat(df.ts[1]) )
-    runtime=str( dt.datetime.now() - dt.datetime.fromisoformat(df.ts[1]) )
-    rt = ( dt.datetime.fromisoformat(df.ts.iloc[-1]) - dt.datetime.fromisoformat(df.ts[1]) )
+    runtime=str( dt.datetime.now() - first )
+    rt = ( last - first )
 
     rth = rt.seconds//3600
     if rth < 1:
@@ -52,13 +160,13 @@ def reporting():
     SL= Config.StopLoss
     TP = Config.TargetProfit
 
-    trades_total = df.state.count()
-    trades_won = np.sum(df.state == 'WON')
+    trades_total = a[ 'trades' ]
+    trades_won = a[ 'won' ]
     trades_won_rel = round(trades_won/trades_total*100,2)
-    trades_won_profit = round( df[df.state == 'WON'].sum()['total_profit'], 4 )
-    trades_lost = np.sum(df.state == 'LOST')
+    trades_won_profit = round( a[ 'won_profit' ], 4 )
+    trades_lost = a[ 'lost' ]
     trades_lost_rel = round(trades_lost/trades_total*100,2)
-    trades_lost_profit = abs(round( df[df.state == 'LOST'].sum()['total_profit'], 4 ))
+    trades_lost_profit = abs(round( a[ 'lost_profit' ], 4 ))
     turnover = round( trades_won_profit + trades_lost_profit, 4 )
     turnover_rel = round(turnover/invest*100,2)
     profit = round( trades_won_profit - trades_lost_profit, 4 )
@@ -70,10 +178,10 @@ def reporting():
     tpm = trades_total/(rth*60)
     #tph = tpm*60
     tph = tpm*60
-    avg_runtime = df.duration.mean()
+    avg_runtime = dt.timedelta( seconds=a[ 'duration' ] )
 
     #p = P / G
-    print( f'Report {logfile} created at {dt.datetime.now()}' )
+    print( f'Report {name} created at {dt.datetime.now()}' )
     print( f'Bot runtime: {runtime}')
     print( f'Investment:{invest} USDT \nSL:{SL}% \nTP:{TP}%')
     print( f'Trades {trades_total}' )
@@ -85,11 +193,27 @@ def reporting():
     print( f'TpH {tph} \nTpM {tpm}')
     print( f'AVG Duration {avg_runtime}')
     print( f'\nAsset Details\n' )
-    trades = df.groupby('symbol')
-    print( trades.sum() )
-
-
-while True:
-    reporting()
-    time.sleep(3)
-    clear()
+    print( source.by_symbol() )
+
+
+if __name__ == '__main__':
+    # python CryptoStats.py                     -> report of the trade journal Config.Journal
+    # python CryptoStats.py path/to/logfile.log -> report of a text log written by older versions
+    if len( sys.argv ) > 1:
+        logfile = sys.argv[1]
+        source = Aggregates()
+        tail = LogTail( logfile )
+    else:
+        logfile = Config.Journal
+        source = Journal( logfile )
+        tail = None
+    while True:
+        if tail is not None:
+            lines, truncated = tail.lines()
+            if truncated:
+                source = Aggregates()
+            for line in lines:
+                source.update( line )
+        reporting( source, logfile )
+        time.sleep(3)
+        clear()
@@ -5,40 +5,70 @@
 #
 
 import os
+import time
+import signal
 import asyncio
-from utils import Credentials, fetch_NonLeveragedTradePairs, build_Frame
-from binance import Client, AsyncClient, BinanceSocketManager
-from sqlalchemy import create_engine, engine
+from utils import Exchange, ExchangeInfo, RequestScheduler, fetch_NonLeveragedTradePairs, TickWriter, connectDB
+from tickbuffer import TickBuffer
+from archive import Archive
+from metrics import Metrics
+from tradestream import TradeStream
 
 from config import Config
 
-credentials = Credentials( 'key/binance.key' )
-client = Client( credentials.key, credentials.secret )
+# binance, or the local mock exchange if Config.Exchange = 'mock'
+Exchange.configure( Config )
+client = Exchange.client()
+RequestScheduler.get( Config.RequestWeight, Config.RequestRetries, Config.RequestBackoff, Config.RequestBackoffMax )
+ExchangeInfo.get( client, path=Config.MetadataCache, ttl=Config.MetadataTTL )
 
-# Cleanup old data
-if os.path.exists( Config.Database ):
-    os.remove( Config.Database )
+engine = connectDB( Config.Database )
+# keep the history, but move everything except the last hours out of the Database
+archive = Archive( Config.Archive )
+# the only writer of the archive, temp files of a crashed rotation are left over
+archive.clean()
+archive.rotate( engine, keep=Config.ArchiveKeep )
+metrics = Metrics( 'CryptoStream', os.path.join( Config.Metrics, 'CryptoStream.jsonl' ), interval=Config.MetricsInterval )
+writer = TickWriter( engine, size=Config.BatchSize, interval=Config.BatchInterval, metrics=metrics )
 
-engine = create_engine( f'sqlite:///{Config.Database}' )
+# CryptoBot stops us with SIGTERM, turn it into SystemExit so the buffered ticks get flushed
+signal.signal( signal.SIGTERM, lambda signum, frame: exit(0) )
 
 #prepare multistream list
 tp = fetch_NonLeveragedTradePairs( client )
+# recent ticks for CryptoTrader, so it does not need to query the Database
+ticks = TickBuffer( Config.TickBuffer, symbols=tp, capacity=Config.TickBufferSize )
 tp = [ i.lower() + '@trade' for i in tp ]
+# one connection per StreamShard streams, each with its own queue, drained by one writer
+stream = TradeStream( tp, writer, ticks, metrics, shard=Config.StreamShard, size=Config.StreamQueue, timeout=Config.StreamTimeout )
 
 async def main():
-    asyncClient = await AsyncClient.create()
-    bsm = BinanceSocketManager( asyncClient )
-    ms = bsm.multiplex_socket( tp )
-    async with ms as tscm:
-        while True:
-            response = await tscm.recv()
-            if response:
-                frame = build_Frame( response, isMultiStream=True )
-                frame.to_sql( frame.Symbol[0], engine, if_exists='append', index=False )
-
-    await asyncClient.close_connection()
+    asyncClient = await Exchange.async_client()
+    bsm = Exchange.socket_manager( asyncClient )
+    loop = asyncio.get_running_loop()
+    task = asyncio.ensure_future( stream.run( bsm ) )
+    rotation = None
+    rotated = time.monotonic()
+    try:
+        while not task.done():
+            # rotate in a worker thread, the stream must not stall while partitions are compressed
+            if time.monotonic() - rotated >= Config.ArchiveInterval and ( rotation is None or rotation.done() ):
+                rotated = time.monotonic()
+                rotation = loop.run_in_executor( None, archive.rotate, engine, Config.ArchiveKeep )
+            metrics.poll()
+            await asyncio.wait( [ task ], timeout=1 )
+        # the writer failed
+        task.result()
+    finally:
+        task.cancel()
+        await asyncClient.close_connection()
 
 if __name__ == '__main__':
     loop = asyncio.get_event_loop()
-    loop.run_until_complete( main() )
+    try:
+        loop.run_until_complete( main() )
+    finally:
+        stream.close()
+        ticks.flush()
+        metrics.dump()
 
@@ -5,195 +5,355 @@
 #
 #
 
+import os
+import signal
 import asyncio
-from decimal import Decimal, ROUND_DOWN
 import numpy as np
 import pandas as pd
 import datetime as dt
 
-from binance import Client, BinanceSocketManager
-from sqlalchemy import create_engine
-
 from config import Config
-from utils import Credentials, IPC, queryDB, build_Frame, log
-from models import Asset, Order, Trade
-
-credentials = Credentials( 'key/binance.key' )
-client = Client( credentials.key, credentials.secret )
-client.timestamp_offset = -2000 #binance.exceptions.BinanceAPIException: APIError(code=-1021): Timestamp for this request was 1000ms ahead of the server's time.
-engine = create_engine( f'sqlite:///{Config.Database}' )
-
-### Start Bot place order
-if not IPC.get( IPC.isRunning ): 
-
-    # pull all symbols from DB
-    symbols = pd.read_sql( 'SELECT name FROM sqlite_master WHERE type = "table"', engine ).name.to_list()
-
-    # calculate cumulative return for each symbol
-    returns = []
-    for symbol in symbols:
-        prices = queryDB( engine, symbol, 2 ).Price #last 2 minutes
-        cumulative_return = ( prices.pct_change() + 1 ).prod() - 1
-        returns.append( { 'symbol' : symbol, 'cumret' : cumulative_return } )
-
-    # sort descending
-    sorted_returns = sorted(returns, key=lambda d: d['cumret'], reverse=True) 
-
-    # prepare our Asset
-    asset = Asset( client, sorted_returns[0]['symbol'], OHLCV=True, Indicators=True )
-
-    # if the momentum already ends skip to next asset or wait a moment
-    if asset.OHLCV.ROC.iloc[-1] < Config.minROC:
-        print( f'{str(dt.datetime.now())} Opportunity not given, we skip this trade : {asset.symbol} (LvL0)' )
-        # check next Symbol
-        asset = Asset( client, sorted_returns[1]['symbol'], OHLCV=True, Indicators=True )
-        if asset.OHLCV.ROC.iloc[-1] < Config.minROC:
-            print( f'{str(dt.datetime.now())} Opportunity not given, we skip this trade : {asset.symbol} (LvL1)' )
-            # check next Symbol
-            asset = Asset( client, sorted_returns[2]['symbol'], OHLCV=True, Indicators=True )
+from utils import Exchange, IPC, ExchangeInfo, RequestScheduler, connectDB, rank_Momentum
+from models import Asset, Order, Trade, Positions
+from fixedpoint import FixedPoint
+from tickbuffer import TickBuffer
+from journal import Journal
+from metrics import Metrics
+from orderbook import DepthStream
+
+
+class CryptoTrader:
+    ''' Long-lived trading service
+
+    Started once by CryptoBot and kept alive between trades, so imports, the REST client, the websocket session,
+    the Database engine and the tick buffer stay warm. Up to Config.MaxPositions trades are held at once,
+    every trade runs through the states
+
+        SCAN -> ENTER -> MONITOR -> EXIT
+
+    SCAN:       rank all symbols by momentum, evaluate the top Config.TopK concurrently and pick the best one with ROC >= Config.minROC,
+                with Config.Depth candidates whose expected slippage eats too much of Config.TargetProfit are skipped
+    ENTER:      place the buy order
+    MONITOR:    follow the trade stream of every symbol with open positions on its own socket until TakeProfit or StopLoss is hit
+    EXIT:       place the sell order, log and report the trade
+
+    SCAN and ENTER run whenever a position slot is free, MONITOR runs as a separate task per symbol next to them.
+    A failed monitor task is logged and reopened. Open positions are kept in the journal and taken over on start.
+    The IPC.isRunning signal is held while the trader has open positions, so only one trader process is invested at a time,
+    another one waits for the signal before it enters a trade.
+    '''
+    SCAN = 'SCAN'
+    ENTER = 'ENTER'
+    MONITOR = 'MONITOR'
+    EXIT = 'EXIT'
+
+    # the only indicators we read from asset.OHLCV, everything else is skipped
+    Indicators = [ 'ROC', 'RSI', 'ATR', 'OBV' ]
+    # seconds before the socket of a failed monitor task is reopened
+    RECONNECT = 1.0
+
+    def __init__( self ):
+        # binance, or the local mock exchange if Config.Exchange = 'mock'
+        Exchange.configure( Config )
+        self.client = Exchange.client()
+        self.client.timestamp_offset = -2000 #binance.exceptions.BinanceAPIException: APIError(code=-1021): Timestamp for this request was 1000ms ahead of the server's time.
+        self.engine = connectDB( Config.Database )
+        self.journal = Journal( Config.Journal )
+        self.metrics = Metrics( 'CryptoTrader', os.path.join( Config.Metrics, 'CryptoTrader.jsonl' ), interval=Config.MetricsInterval )
+        # every REST call of this process is paced by one scheduler
+        RequestScheduler.get( Config.RequestWeight, Config.RequestRetries, Config.RequestBackoff, Config.RequestBackoffMax )
+        # exchange metadata is loaded once and served from memory
+        ExchangeInfo.get( self.client, path=Config.MetadataCache, ttl=Config.MetadataTTL )
+        self.ticks = None
+        self.positions = Positions( Config.MaxPositions, Config.TargetProfit, Config.StopLoss, Config.BreakEven, step=Config.TrailingStep )
+        # symbol -> task running monitor() of the symbol
+        self.sockets = {}
+        # local order books of the candidates, only with Config.Depth
+        self.depth = None
+        self.state = self.SCAN
+
+
+    async def run( self ):
+        self.asyncClient = asyncClient = await Exchange.async_client()
+        self.bsm = Exchange.socket_manager( asyncClient )
+        if Config.Depth:
+            self.depth = DepthStream( asyncClient, self.bsm, limit=Config.DepthLimit )
+        try:
+            await self.restore()
+            while True:
+                self.metrics.poll()
+
+                if not self.positions.free():
+                    await asyncio.sleep( Config.ScanInterval )
+                    continue
+
+                self.state = self.SCAN
+                asset = await self.scan()
+                if asset is None:
+                    await asyncio.sleep( Config.ScanInterval )
+                    continue
+
+                self.state = self.ENTER
+                if not IPC.acquire( IPC.isRunning ):
+                    # held by us as long as we have open positions, otherwise another trader is invested
+                    print( f'{str(dt.datetime.now())} Another trader is already invested, waiting...' )
+                    await IPC.wait_async( IPC.isRunning )
+                    continue
+                order = self.enter( asset )
+                self.positions.open( asset, order )
+                self.journal.open( order )
+
+                self.state = self.MONITOR
+                self.subscribe()
+        finally:
+            for task in self.sockets.values():
+                task.cancel()
+            if self.depth is not None:
+                self.depth.close()
+            await asyncClient.close_connection()
+            IPC.release( IPC.isRunning )
+            self.metrics.dump()
+
+
+    async def restore( self ):
+        ''' Take over the positions a previous run left open, with the trailing thresholds they had
+        '''
+        rows = self.journal.positions()
+        if not rows:
+            return
+        await ExchangeInfo.get( self.client ).refresh_async( [ row[ 'symbol' ] for row in rows ] )
+        for row in rows:
+            if not self.positions.free():
+                print( f'{str(dt.datetime.now())} No slot left for the open position {row["symbol"]} of {dt.datetime.fromtimestamp( row["opened"] / 1000 )}' )
+                continue
+            asset = Asset( self.client, row[ 'symbol' ], engine=self.engine )
+            # the report of the trade prints the indicators at entry, not the ones of the restart
+            asset.OHLCV = pd.DataFrame( [ [ row[ column ] for column in Journal.Indicators ] ], columns=Journal.Indicators, dtype=float )
+            order = Order( self.client, asset, Order.BUY, None, row[ 'bid' ], order=row[ 'order' ] )
+            order.timestamp = row[ 'opened' ] / 1000
+            order.position = row[ 'id' ]
+            slot = self.positions.open( asset, order )
+            if row[ 'TargetProfit' ] is not None:
+                self.positions.set( slot, row[ 'TargetProfit' ], row[ 'StopLoss' ] )
+                order.trail( 'set', 'TTP', row[ 'TargetProfit' ] )
+                order.trail( 'set', 'TSL', row[ 'StopLoss' ] )
+            print( f'{str(dt.datetime.now())} Restored {asset.symbol} opened {dt.datetime.fromtimestamp( order.timestamp )} at {FixedPoint.format( order.price )}' )
+        self.subscribe()
+
+
+    async def scan( self ):
+        ''' Find the next asset to trade, symbols we already hold are skipped
+
+        The klines of the candidates are loaded concurrently, so the scan takes as long as the slowest candidate
+        instead of the sum of all of them.
+
+        :return Asset | None
+        '''
+        # CryptoStream creates the tick buffer on start, so attach as soon as it shows up and again after it restarted
+        if self.ticks is not None and self.ticks.replaced():
+            self.ticks = None
+        if self.ticks is None and os.path.isfile( Config.TickBuffer ):
+            self.ticks = TickBuffer( Config.TickBuffer )
+
+        held = self.positions.symbols()
+        # rank all symbols by their cumulative return of the last 2 minutes, the tick buffer of CryptoStream is preferred over the DB
+        with self.metrics.time( 'rank' ):
+            ranking = rank_Momentum( self.engine, 2, ticks=self.ticks, top=Config.TopK + len( held ) )
+        ranking = ranking[ ~ranking.index.isin( held ) ].iloc[ :Config.TopK ]
+        if self.depth is not None:
+            # follow the books of the current candidates, the next scan usually ranks the same ones
+            self.depth.watch( ranking.index )
+        # the metadata of the candidates must come from memory, Asset() runs on the event loop
+        await ExchangeInfo.get( self.client ).refresh_async( ranking.index )
+
+        with self.metrics.time( 'candidates' ):
+            assets = await asyncio.gather( *[ self.candidate( symbol ) for symbol in ranking.index ], return_exceptions=True )
+
+        # best momentum first, if the momentum already ends skip to next asset or wait a moment
+        for level, asset in enumerate( assets ):
+            if isinstance( asset, Exception ):
+                print( f'{str(dt.datetime.now())} Could not evaluate {ranking.index[ level ]} (LvL{level}): {asset}' )
+                continue
             if asset.OHLCV.ROC.iloc[-1] < Config.minROC:
-                print( f'{str(dt.datetime.now())} Opportunity not given, we skip this trade : {asset.symbol} (LvL2)' )
-                print( f'{str(dt.datetime.now())} No opportunities we give up and wait a moment...' )
-                quit()
-
-    ### Momentum detected so place order
-    # check again if an instance is already running
-    if not IPC.get( IPC.isRunning ):
-        IPC.set( IPC.isRunning )
-        price = asset.getRecentPrice() # vielleicht sollten wir den letzten preis aus der DB nehmen? -> spart uns ein HTTP query + laufzeit 
-        qty = asset.calculateQTY( Config.Investment, price=price )
-        order = Order( client, asset, Order.BUY, qty, price )
-        ##TODO: implement logging
-    else:
-        ### bot is already running
-        print( f'{str(dt.datetime.now())} Found an opportunity, but we are already invested.' )
-        quit() 
-
-else:
-    ### bot is already running
-    print( f'{str(dt.datetime.now())} We are already invested.' )
-    quit()    
-
-
-
-#################################
-### Monitor the current trade ###
-#################################
-async def main( asset, BuyOrder ):
-    bsm = BinanceSocketManager( client )
-    ts = bsm.trade_socket( asset.symbol )
-    print( f'{str(dt.datetime.now())} Start trading {asset.symbol}' )
-    async with ts as tscm:
-        while True:
-            response = await tscm.recv()
-            if response:
-                # build df from BSM response
-                frame = build_Frame( response )
-                CurrentPrice = frame.Price.iloc[-1] 
-
-                TargetProfit = Decimal( BuyOrder.price ) + ( Decimal( BuyOrder.price ) * Decimal( Config.TargetProfit ) ) / 100
-                StopLoss = Decimal( BuyOrder.price ) + ( Decimal( BuyOrder.price ) * Decimal( -Config.StopLoss ) ) / 100
-                BreakEven = Decimal( BuyOrder.price ) + ( Decimal( BuyOrder.price ) * Decimal( Config.BreakEven ) ) / 100
-
-                # Trailing TakeProfit
-                if BuyOrder.TTP is not None:
-                    TargetProfit = Decimal( BuyOrder.trail( 'get', 'TTP' ) )
-                    StopLoss = Decimal( BuyOrder.trail( 'get', 'TSL' ) )
-
-                if CurrentPrice > TargetProfit:                    
-                    TargetProfit = Decimal( CurrentPrice ) + ( Decimal( CurrentPrice ) * Decimal( .1 ) ) / 100
-             
-                    StopLoss = Decimal( TargetProfit ) + ( Decimal( TargetProfit ) * Decimal( -.1 ) ) / 100
-
-                    BuyOrder.trail( 'set', 'TTP', TargetProfit )
-                    BuyOrder.trail( 'set', 'TSL', StopLoss )
-                    print( f'{str(dt.datetime.now())} TTP set TP:{TargetProfit} SL:{StopLoss}' )
-
-                #print( f'{str(dt.datetime.now())} {asset.symbol} BP:{BuyOrder.price:.4f} CP:{CurrentPrice} TP:{TargetProfit:.4f} SL:{StopLoss:.4f}' )
-
-                # benchmark for TSL!
-                if CurrentPrice < StopLoss or CurrentPrice > TargetProfit:
-       
-                    # This trade is closed, set Signal for a new one immediately
-                    IPC.set( IPC.isRunning, remove=True )
-
-                    # binance.exceptions.BinanceAPIException: APIError(code=-2010): Account has insufficient balance for requested action
-                    # If we buy an asset we pay fee's with the bought asset, therefore we need to deduct the fee amount before we try to sell the position
-                    # If we sell an asset the fee will be calculated (in our case) in USDT                     
-                    
-                    SellQTY = Decimal( BuyOrder.qty - BuyOrder.commission ) # floor???
-
-                    # binance.exceptions.BinanceAPIException: APIError(code=-1013): Filter failure: LOT_SIZE
-                    #order = client.create_order( symbol=symbol, side='SELL', type='MARKET', quantity=sell_qty )
-                    SellOrder = Order( client, asset, Order.SELL, SellQTY, CurrentPrice )
-
-                    Dust = Decimal( BuyOrder.qty - SellOrder.qty )
-                    ProfitPerShare = Decimal( SellOrder.price - BuyOrder.price ).quantize(Decimal('.00000001'), rounding=ROUND_DOWN)
-                    ProfitTotal = Decimal( ProfitPerShare * SellOrder.qty ).quantize(Decimal('.00000001'), rounding=ROUND_DOWN)
-                    ProfitRelative = Decimal( ( SellOrder.price - BuyOrder.price ) / BuyOrder.price ).quantize(Decimal('.00000001'), rounding=ROUND_DOWN)
-
-                    Diff = round(( SellOrder.price - BuyOrder.price ) / BuyOrder.price *100, 2 )
-
-                    #p = P / G
-
-
-                    Duration = str( dt.datetime.now() - dt.datetime.fromtimestamp( BuyOrder.timestamp ) )
-
-                    # create Trade Object
-                    #FinalTrade = Trade()
-
-                    # TODO: implement logging
-                    
-                    state = None
-                    if SellOrder.price > BuyOrder.price:
-                        state = 'WON'
-                    else:
-                        state = 'LOST' 
-                    
-                    ds = { 'ts' : str(dt.datetime.now()), 'state' : state, 'symbol' : asset.symbol, 'duration' : str(Duration), 'ask' : str(BuyOrder.price), 'ask_qty' : str(BuyOrder.qty), 'bid' : str(SellOrder.price), 'bid_qty' : str(SellOrder.qty), 'profit' : str(ProfitPerShare), 'total_profit' : str(ProfitTotal), 'ROC' : asset.OHLCV.ROC.iloc[-1], 'RSI' : asset.OHLCV.RSI.iloc[-1], 'ATR' : asset.OHLCV.ATR.iloc[-1], 'OBV' : asset.OHLCV.OBV.iloc[-1] }
-                    log( Config.Logfile, ds, timestamp=False )
-
-                    print( f'###_Report_###' )
-                    print( f'Symbol: {asset.symbol}' )
-                    print( f'Condition: {state}' )
-                    print( f'Investment: {Config.Investment} USDT' )
-                    print( f'TP: {Config.TargetProfit}% SL: {Config.StopLoss}%')
-                    print( f'Opened: {dt.datetime.fromtimestamp(BuyOrder.timestamp)}' )
-                    print( f'Duration: {Duration}' ) 
-                    print( f'Closed: {dt.datetime.fromtimestamp(SellOrder.timestamp)}' )
-                    print( f'Ask: {BuyOrder.price} ({BuyOrder.qty})' )
-                    print( f'Bid: {SellOrder.price} ({SellOrder.qty})' )
-                    print( f'Dust: {Dust}' )
-                    print( f'PPS: {ProfitPerShare}' )
-                    print( f'Profit: {ProfitTotal}' )
-                    print( f'Relative Profit: {ProfitRelative}' )
-                    print( f'Diff: {Diff}' )
-                    print( f'ROC: {asset.OHLCV.ROC.iloc[-1]}')
-                    print( f'RSI: {asset.OHLCV.RSI.iloc[-1]}')
-                    print( f'ATR: {asset.OHLCV.ATR.iloc[-1]}')
-                    print( f'OBV: {asset.OHLCV.OBV.iloc[-1]}')
-                    print( f'##############' )
-
-                    #Stop & Exit the Loop
-                    loop.stop()
-                    # funktioniert ein break hier??
-                    #RuntimeError: Event loop stopped before Future completed.
-
-    await client.close_connection()                
-
-                    
+                print( f'{str(dt.datetime.now())} Opportunity not given, we skip this trade : {asset.symbol} (LvL{level})' )
+                continue
+            if not self.liquid( asset ):
+                print( f'{str(dt.datetime.now())} Not enough liquidity, we skip this trade : {asset.symbol} (LvL{level})' )
+                continue
+            return asset
+
+        print( f'{str(dt.datetime.now())} No opportunities we give up and wait a moment...' )
+        return None
+
+
+    async def candidate( self, symbol ):
+        ''' Asset with its OHLCV and indicators, the metadata is served from the exchange info cache (refreshed by scan())
+
+        :return Asset
+        '''
+        with self.metrics.time( 'asset' ):
+            asset = Asset( self.client, symbol, engine=self.engine )
+            if self.depth is not None:
+                asset.book = ( await asyncio.gather( asset.fetchOHLCV_async( self.asyncClient ), self.depth.book( symbol ) ) )[1]
+            else:
+                await asset.fetchOHLCV_async( self.asyncClient )
+            asset.applyOHLCVindicators( self.Indicators )
+        return asset
+
+
+    def liquid( self, asset ):
+        ''' False if buying and selling Config.Investment at market is expected to cost more than Config.MaxSlippage of Config.TargetProfit
+
+        Slippage is measured against mid, so half the spread on each side is part of it. Without an order book every asset passes.
+        '''
+        if asset.book is None:
+            return True
+        cost = asset.book.slippage( Config.Investment, 'BUY' ) + asset.book.slippage( Config.Investment, 'SELL' )
+        # NaN: the book is not even deep enough for our order
+        return cost <= Config.TargetProfit * Config.MaxSlippage
+
+
+    def enter( self, asset ):
+        ''' Momentum detected so place order
+
+        :return Order
+        '''
+        with self.metrics.time( 'entry_to_order' ):
+            if asset.book is not None:
+                # the expected fill price of our order, saves the HTTP query as well
+                price = FixedPoint.parse( asset.book.fill( quote=Config.Investment ) )
+            else:
+                price = asset.getRecentPrice() # vielleicht sollten wir den letzten preis aus der DB nehmen? -> spart uns ein HTTP query + laufzeit
+            qty = asset.calculateQTY( Config.Investment, price=price )
+            order = Order( self.client, asset, Order.BUY, qty, price )
+        print( f'{str(dt.datetime.now())} Start trading {asset.symbol}' )
+        return order
+
+
+    def subscribe( self ):
+        ''' Follow the trade stream of every symbol with open positions, one socket per symbol
+
+        A multiplex socket is bound to its streams, reopening it for every opened or closed position would lose the
+        ticks of all the others meanwhile. With a socket per symbol only the socket of that symbol opens or closes.
+        '''
+        symbols = set( self.positions.symbols() )
+        # invested as long as a position is open
+        if symbols:
+            IPC.acquire( IPC.isRunning )
+        else:
+            IPC.release( IPC.isRunning )
+        for symbol in set( self.sockets ) - symbols:
+            task = self.sockets.pop( symbol )
+            if task is not asyncio.current_task():
+                task.cancel()
+        for symbol in symbols - set( self.sockets ):
+            self.sockets[ symbol ] = task = asyncio.create_task( self.monitor( symbol ) )
+            task.add_done_callback( lambda task, symbol=symbol: self.failed( symbol, task ) )
+
+
+    def failed( self, symbol, task ):
+        ''' Reopen the socket of a monitor task which died, a crash must not leave positions unwatched or end the service
+        '''
+        if task.cancelled() or task.exception() is None:
+            return
+        print( f'{str(dt.datetime.now())} Monitor of {symbol} failed ({task.exception()!r}), reconnect in {self.RECONNECT}s', flush=True )
+        if self.sockets.get( symbol ) is task:
+            del self.sockets[ symbol ]
+        asyncio.get_running_loop().call_later( self.RECONNECT, self.subscribe )
+
+
+    async def monitor( self, symbol ):
+        ''' Monitor the open trades of a symbol
+
+        Hot path: only the price field of the raw message is read and the thresholds of all positions
+        of the symbol are checked at once, see Positions. Positions hit by TakeProfit or StopLoss are closed,
+        once the symbol has none left its socket is closed.
+
+        :param symbol -> type:str
+        '''
+        positions = self.positions
+        async with self.bsm.trade_socket( symbol ) as tscm:
+            while True:
+                data = await tscm.recv()
+                if data:
+                    if data.get( 'e' ) == 'error':
+                        # python-binance reports a lost connection as message
+                        raise ConnectionError( f'{data.get( "type" )} {data.get( "m" )}' )
+                    # FixedPoint.parse() inlined, prices of the trade stream always have 8 decimals so dropping the point gives the units
+                    p = data[ 'p' ]
+                    CurrentPrice = int( p.replace( '.', '', 1 ) ) if len( p ) > 8 and p[-9] == '.' else FixedPoint.parse( p )
+
+                    # benchmark for TSL!
+                    exits, trailed = positions.tick( symbol, CurrentPrice )
+
+                    # Trailing TakeProfit moved
+                    for slot in trailed:
+                        BuyOrder = positions.orders[ slot ]
+                        BuyOrder.trail( 'set', 'TTP', positions.TargetProfit[ slot ] )
+                        BuyOrder.trail( 'set', 'TSL', positions.StopLoss[ slot ] )
+                        self.journal.trail( BuyOrder, positions.TargetProfit[ slot ], positions.StopLoss[ slot ] )
+                        print( f'{str(dt.datetime.now())} {symbol} TTP set TP:{FixedPoint.format( positions.TargetProfit[ slot ] )} SL:{FixedPoint.format( positions.StopLoss[ slot ] )}' )
+
+                    if len( exits ):
+                        self.state = self.EXIT
+                        for slot in exits:
+                            self.exit( *positions.close( slot ), CurrentPrice )
+                        self.subscribe()
+                        if symbol not in self.sockets:
+                            return
+
+
+    def exit( self, asset, BuyOrder, CurrentPrice ):
+        ''' Close the trade, log and report it
+        '''
+        with self.metrics.time( 'exit_to_order' ):
+            SellOrder = CryptoTrader.sell( self.client, asset, BuyOrder, CurrentPrice )
+        trade = Trade( asset, BuyOrder, SellOrder )
+        self.journal.add( trade )
+
+        print( f'###_Report_###' )
+        print( f'Symbol: {asset.symbol}' )
+        print( f'Condition: {trade.state}' )
+        print( f'Investment: {Config.Investment} USDT' )
+        print( f'TP: {Config.TargetProfit}% SL: {Config.StopLoss}%')
+        print( f'Opened: {dt.datetime.fromtimestamp(BuyOrder.timestamp)}' )
+        print( f'Duration: {trade.duration}' )
+        print( f'Closed: {dt.datetime.fromtimestamp(SellOrder.timestamp)}' )
+        print( f'Ask: {FixedPoint.format( BuyOrder.price )} ({FixedPoint.format( BuyOrder.qty )})' )
+        print( f'Bid: {FixedPoint.format( SellOrder.price )} ({FixedPoint.format( SellOrder.qty )})' )
+        print( f'Dust: {FixedPoint.format( trade.dust )}' )
+        print( f'PPS: {FixedPoint.format( trade.profit )}' )
+        print( f'Profit: {FixedPoint.format( trade.total_profit )}' )
+        print( f'Relative Profit: {FixedPoint.format( trade.relative_profit )}' )
+        print( f'Diff: {trade.diff}' )
+        print( f'ROC: {asset.OHLCV.ROC.iloc[-1]}')
+        print( f'RSI: {asset.OHLCV.RSI.iloc[-1]}')
+        print( f'ATR: {asset.OHLCV.ATR.iloc[-1]}')
+        print( f'OBV: {asset.OHLCV.OBV.iloc[-1]}')
+        print( f'##############', flush=True )
+
+
+    def sell( client, asset, BuyOrder, CurrentPrice ):
+        ''' Place the sell order of a position
+
+        :return Order
+        '''
+        # binance.exceptions.BinanceAPIException: APIError(code=-2010): Account has insufficient balance for requested action
+        # If we buy an asset we pay fee's with the bought asset, therefore we need to deduct the fee amount before we try to sell the position
+        # If we sell an asset the fee will be calculated (in our case) in USDT
+
+        SellQTY = BuyOrder.qty - BuyOrder.commission # floor??? asset.fixed.qty() would, but below one stepSize nothing is left to sell
+
+        # binance.exceptions.BinanceAPIException: APIError(code=-1013): Filter failure: LOT_SIZE
+        #order = RequestScheduler.get().call( client.create_order, symbol=symbol, side='SELL', type='MARKET', quantity=sell_qty )
+        return Order( client, asset, Order.SELL, SellQTY, CurrentPrice )
+
+
 if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
-    '''
-    Traceback (most recent call last):
-    File "/home/dave/code/crypto/bot/CryptoPro.py", line 173, in <module>
-    loop.run_until_complete( main( asset, order ) )
-    File "/usr/lib/python3.9/asyncio/base_events.py", line 640, in run_until_complete
-    raise RuntimeError('Event loop stopped before Future completed.')
-    RuntimeError: Event loop stopped before Future completed.
-    '''
+    # CryptoBot stops us with SIGTERM
+    signal.signal( signal.SIGTERM, lambda signum, frame: exit(0) )
+    trader = CryptoTrader()
     try:
-        loop.run_until_complete( main( asset, order ) )
-    except RuntimeError as e:
-        if e == 'Event loop stopped before Future completed.':
-            pass    
+        asyncio.run( trader.run() )
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) Dave Beusing <david.beusing@gmail.com>
+#
+#
+
+import os
+import glob
+import time
+import numpy as np
+import pandas as pd
+import datetime as dt
+
+
+class Archive:
+    ''' Columnar archive of the ticks and klines which are rotated out of the Database
+
+    Every closed hour of a symbol becomes one compressed .npz file, partitioned by symbol and date:
+
+        root/ticks/BTCUSDT/2021-11-18/13.npz
+        root/klines/BTCUSDT/2021-11-18/13.npz
+
+    Each column is stored as its own array. Integer columns (time, id) are delta encoded and downcast to the
+    smallest dtype which holds the deltas, which compresses a lot better than the raw values.
+    A column is only decompressed if it is asked for, so load() reads just the columns and partitions it needs.
+    Partitions are written to <HH>.npz.<pid>.tmp and renamed, load() only reads files named exactly <HH>.npz.
+
+    :param root -> type:str: directory of the archive
+    '''
+    # table -> ( primary key without symbol, integer columns, float columns )
+    TABLES = {
+        'ticks' : ( [ 'time', 'id' ], [ 'time', 'id' ], [ 'price' ] ),
+        'klines' : ( [ 'time' ], [ 'time' ], [ 'open', 'high', 'low', 'close', 'volume' ] ),
+    }
+    HOUR = 3600000
+
+    def __init__( self, root ):
+        self.root = root
+
+    def path( self, table, symbol, hour ):
+        ''' Partition file of the hour starting at the given time in ms
+        '''
+        ts = dt.datetime.fromtimestamp( hour / 1000, tz=dt.timezone.utc )
+        return os.path.join( self.root, table, symbol, ts.strftime( '%Y-%m-%d' ), ts.strftime( '%H.npz' ) )
+
+    def encode( values ):
+        ''' First value followed by the deltas, in the smallest integer dtype that fits
+        '''
+        deltas = np.diff( values.astype( np.int64 ), prepend=np.int64( 0 ) )
+        rest = deltas[1:]
+        for dtype in ( np.int8, np.int16, np.int32 ):
+            info = np.iinfo( dtype )
+            if not len( rest ) or ( rest.min() >= info.min and rest.max() <= info.max ):
+                return np.int64( deltas[0] if len( deltas ) else 0 ), rest.astype( dtype )
+        return np.int64( deltas[0] ), rest
+
+    def decode( first, rest, n ):
+        if n == 0:
+            return np.empty( 0, dtype=np.int64 )
+        values = np.empty( n, dtype=np.int64 )
+        values[0] = first
+        np.cumsum( rest, dtype=np.int64, out=values[1:] )
+        values[1:] += first
+        return values
+
+    def write( self, table, symbol, hour, df ):
+        ''' Store one partition, rows which are already archived are merged in
+        '''
+        key, integers, floats = self.TABLES[ table ]
+        path = self.path( table, symbol, hour )
+        if os.path.isfile( path ):
+            df = pd.concat( [ self.read( path, integers + floats ), df ] ).drop_duplicates( subset=key, keep='last' )
+        df = df.sort_values( key )
+        arrays = { 'n' : np.int64( len( df ) ) }
+        for column in integers:
+            arrays[ f'{column}_first' ], arrays[ column ] = Archive.encode( df[ column ].to_numpy() )
+        for column in floats:
+            arrays[ column ] = df[ column ].to_numpy( dtype=np.float64 )
+        os.makedirs( os.path.dirname( path ), exist_ok=True )
+        # write to a temp file and rename, readers never see a half written partition
+        # a file object, numpy would append .npz to a name and the temp file would look like a partition
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open( tmp, 'wb' ) as fd:
+            np.savez_compressed( fd, **arrays )
+        os.replace( tmp, path )
+
+    def clean( self ):
+        ''' Remove temp files a writer left behind when it died, call it before the first rotate()
+
+        Includes the <HH>.npz.<pid>.npz temp files of older versions.
+
+        :return int: number of removed files
+        '''
+        stale = glob.glob( os.path.join( self.root, '*', '*', '*', '*.tmp' ) ) + glob.glob( os.path.join( self.root, '*', '*', '*', '*.npz.*.npz' ) )
+        for path in stale:
+            os.remove( path )
+        return len( stale )
+
+    def read( self, path, columns ):
+        with np.load( path ) as npz:
+            n = int( npz[ 'n' ] )
+            data = {}
+            for column in columns:
+                if f'{column}_first' in npz:
+                    data[ column ] = Archive.decode( npz[ f'{column}_first' ], npz[ column ], n )
+                else:
+                    data[ column ] = npz[ column ]
+        return pd.DataFrame( data )
+
+    def rotate( self, engine, keep=2, now=None ):
+        ''' Move every closed hour older than keep hours from the Database into the archive
+
+        Rows are only deleted after their partition is written, if we crash in between the next
+        rotation writes the partition again and the duplicates are merged away.
+
+        :param engine   -> SQLalchemy Engine Object (see utils.connectDB)
+        :param keep     -> type:float: hours which stay in the Database
+        :param now      -> type:int: (optional) current time in ms
+        :return int: number of archived partitions
+        '''
+        now = int( time.time() * 1000 ) if now is None else now
+        boundary = int( now - keep * self.HOUR )
+        boundary -= boundary % self.HOUR
+        written = 0
+        with engine.connect() as conn:
+            symbols = [ row[0] for row in conn.exec_driver_sql( 'SELECT symbol FROM symbols' ) ]
+        for table, ( key, integers, floats ) in self.TABLES.items():
+            columns = ', '.join( integers + floats )
+            for symbol in symbols:
+                # ( symbol, time ) is the prefix of the primary key, so everything below is an index range scan
+                with engine.connect() as conn:
+                    first = conn.exec_driver_sql( f'SELECT MIN( time ) FROM {table} WHERE symbol = ? AND time < ?', ( symbol, boundary ) ).scalar()
+                if first is None:
+                    continue
+                for hour in range( first - first % self.HOUR, boundary, self.HOUR ):
+                    df = pd.read_sql( f'SELECT {columns} FROM {table} WHERE symbol = ? AND time >= ? AND time < ?', engine, params=( symbol, hour, hour + self.HOUR ) )
+                    if not df.empty:
+                        self.write( table, symbol, hour, df )
+                        written += 1
+                with engine.begin() as conn:
+                    conn.exec_driver_sql( f'DELETE FROM {table} WHERE symbol = ? AND time < ?', ( symbol, boundary ) )
+        return written
+
+    def symbols( self, table='ticks' ):
+        return sorted( os.listdir( os.path.join( self.root, table ) ) ) if os.path.isdir( os.path.join( self.root, table ) ) else []
+
+    def load( self, table='ticks', symbols=None, start=None, end=None, columns=None ):
+        ''' Read archived rows back
+
+        Only the partitions overlapping [ start, end ] and only the requested columns are decompressed.
+
+        :param table    -> type:str: ticks | klines
+        :param symbols  -> type:List: (optional) default all archived symbols
+        :param start    -> type:int: (optional) time in ms
+        :param end      -> type:int: (optional) time in ms, inclusive
+        :param columns  -> type:List: (optional) default all columns of the table
+        :return DataFrame[ 'symbol', *columns ] sorted by symbol and time
+        '''
+        key, integers, floats = self.TABLES[ table ]
+        columns = integers + floats if columns is None else list( columns )
+        # time is needed to cut the range, it is dropped again if it was not asked for
+        read = columns if 'time' in columns or ( start is None and end is None ) else [ 'time' ] + columns
+        lo = None if start is None else start - start % self.HOUR
+        frames = []
+        for symbol in ( self.symbols( table ) if symbols is None else symbols ):
+            for path in sorted( glob.glob( os.path.join( self.root, table, symbol, '*', '[0-2][0-9].npz' ) ) ):
+                date, hour = path.split( os.sep )[-2:]
+                begin = int( dt.datetime.strptime( f'{date} {hour[:2]}', '%Y-%m-%d %H' ).replace( tzinfo=dt.timezone.utc ).timestamp() * 1000 )
+                if ( lo is not None and begin < lo ) or ( end is not None and begin > end ):
+                    continue
+                df = self.read( path, read )
+                if start is not None or end is not None:
+                    mask = np.ones( len( df ), dtype=bool )
+                    if start is not None:
+                        mask &= df.time.to_numpy() >= start
+                    if end is not None:
+                        mask &= df.time.to_numpy() <= end
+                    df = df[ mask ]
+                df.insert( 0, 'symbol', symbol )
+                frames.append( df[ [ 'symbol' ] + columns ] )
+        if not frames:
+            return pd.DataFrame( { column : [] for column in [ 'symbol' ] + columns } )
+        return pd.concat( frames, ignore_index=True )
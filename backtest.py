@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) Dave Beusing <david.beusing@gmail.com>
+#
+#
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import datetime as dt
+
+from binance import Client
+
+from config import Config
+from utils import ExchangeInfo, connectDB, rank_Momentum, fill_Klines, applyIndicators, log
+from models import Asset, Order, Trade, Positions
+from fixedpoint import FixedPoint
+from archive import Archive
+from journal import Journal
+from CryptoTrader import CryptoTrader
+
+
+'''
+Replay the ticks CryptoStream recorded in the Database through the trading logic of CryptoTrader
+
+python backtest.py [--database /path/to/database.sqlite3] [--start "2021-11-18 10:00"] [--end "2021-11-18 12:00"] [--log /path/to/backtest.log] [--journal /path/to/backtest.sqlite3]
+'''
+
+
+class TickData:
+    ''' All recorded ticks in memory, as seen at the simulated time `now`
+
+    The ticks are stored symbol-major: the ticks of symbol i are times[ offsets[i]:offsets[i+1] ], sorted by time.
+    keys = code << 42 | time is sorted as well, so "the first tick of every symbol at or after t" is a single
+    vectorized searchsorted over all symbols. returns() makes it a drop-in for the TickBuffer in rank_Momentum().
+
+    The arrays are only ever read, save() and load() put them into .npy files which can be mapped by any number of processes.
+
+    :param symbols  -> type:List: symbol names, the code of a symbol is its index
+    :param codes    -> ndarray: symbol code per tick, ascending
+    :param times    -> ndarray: event time in ms per tick, ascending per symbol
+    :param prices   -> ndarray: price per tick
+    :param volumes  -> type:Dict: (optional) symbol -> Series of 1m kline volumes indexed by open time in ms
+    :param keys     -> ndarray: (optional) precomputed search keys
+    '''
+    SHIFT = 42
+    ARRAYS = [ 'codes', 'times', 'prices', 'keys' ]
+
+    def __init__( self, symbols, codes, times, prices, volumes=None, keys=None ):
+        self.symbols = list( symbols )
+        self.index = { symbol : i for i, symbol in enumerate( self.symbols ) }
+        self.codes = codes
+        self.times = times
+        self.prices = prices
+        self.keys = ( codes.astype( np.int64 ) << self.SHIFT ) | times if keys is None else keys
+        self.offsets = np.searchsorted( self.codes, np.arange( len( self.symbols ) + 1 ) )
+        self.volumes = volumes or {}
+        self.start = int( self.times.min() ) if len( self.times ) else 0
+        self.end = int( self.times.max() ) if len( self.times ) else 0
+        self.now = self.start
+
+    def query( engine, start=None, end=None, archive=None ):
+        ''' Load the ticks and the kline volumes of the Database
+
+        :param engine   -> SQLalchemy Engine Object
+        :param start    -> type:int: (optional) event time in ms
+        :param end      -> type:int: (optional) event time in ms
+        :param archive  -> Archive: (optional) also read the ticks which were rotated out of the Database
+        :return TickData
+        '''
+        params = { 'start' : 0 if start is None else start, 'end' : 2**62 if end is None else end }
+        # the primary key order is exactly the layout we need
+        ticks = pd.read_sql( 'SELECT symbol, time, id, price FROM ticks WHERE time >= :start AND time <= :end ORDER BY symbol, time, id', engine, params=params )
+        klines = pd.read_sql( 'SELECT symbol, time, volume FROM klines WHERE time >= :start - 3600000 AND time <= :end', engine, params=params )
+        if archive is not None:
+            ticks = pd.concat( [ archive.load( 'ticks', start=start, end=end, columns=[ 'time', 'id', 'price' ] ), ticks ] )
+            ticks = ticks.drop_duplicates( subset=[ 'symbol', 'time', 'id' ] ).sort_values( [ 'symbol', 'time', 'id' ] )
+            klines = pd.concat( [ archive.load( 'klines', start=None if start is None else start - 3600000, end=end, columns=[ 'time', 'volume' ] ), klines ] )
+            klines = klines.drop_duplicates( subset=[ 'symbol', 'time' ], keep='last' )
+        codes, symbols = pd.factorize( ticks.symbol )
+        volumes = { symbol : group.set_index( 'time' ).volume for symbol, group in klines.groupby( 'symbol' ) }
+        return TickData( symbols, codes.astype( np.int64 ), ticks.time.to_numpy( dtype=np.int64 ), ticks.price.to_numpy( dtype=np.float64 ), volumes )
+
+    def save( self, path ):
+        ''' Store the ticks as .npy files within the directory path
+        '''
+        os.makedirs( path, exist_ok=True )
+        for name in self.ARRAYS:
+            np.save( os.path.join( path, f'{name}.npy' ), getattr( self, name ) )
+        volumes = { symbol : [ series.index.tolist(), series.tolist() ] for symbol, series in self.volumes.items() }
+        with open( os.path.join( path, 'meta.json' ), 'w' ) as fd:
+            json.dump( { 'symbols' : self.symbols, 'volumes' : volumes }, fd )
+
+    def load( path, mmap_mode='r' ):
+        ''' Open ticks stored with save(), by default memory mapped and read-only so the pages are shared between processes
+
+        :return TickData
+        '''
+        with open( os.path.join( path, 'meta.json' ), 'r' ) as fd:
+            meta = json.load( fd )
+        arrays = { name : np.load( os.path.join( path, f'{name}.npy' ), mmap_mode=mmap_mode ) for name in TickData.ARRAYS }
+        volumes = { symbol : pd.Series( values, index=index, dtype=float ) for symbol, ( index, values ) in meta[ 'volumes' ].items() }
+        return TickData( meta[ 'symbols' ], volumes=volumes, **arrays )
+
+    def covers( self, code, since ):
+        ''' True if the ticks of a symbol reach back to since, like the history check of queryKlines()
+        '''
+        a, b = self.offsets[ code ], self.offsets[ code + 1 ]
+        return a < b and self.times[ a ] <= since
+
+    def search( self, codes, times, side='left' ):
+        return np.searchsorted( self.keys, ( np.asarray( codes, dtype=np.int64 ) << self.SHIFT ) | np.asarray( times, dtype=np.int64 ), side=side )
+
+    def price( self, codes, at ):
+        ''' Latest price at or before the given time, NaN if there is none
+
+        :param codes    -> ndarray: symbol codes
+        :param at       -> type:int: time in ms
+        '''
+        codes = np.asarray( codes, dtype=np.int64 )
+        idx = self.search( codes, np.full( len( codes ), at ), side='right' ) - 1
+        valid = idx >= self.offsets[ codes ]
+        return np.where( valid, self.prices[ np.where( valid, idx, 0 ) ], np.nan )
+
+    def returns( self, since ):
+        ''' Cumulative return of every symbol from since to now, same as TickBuffer.returns()
+        '''
+        codes = np.arange( len( self.symbols ) )
+        first = self.search( codes, np.full( len( codes ), since ), side='left' )
+        last = self.search( codes, np.full( len( codes ), self.now ), side='right' ) - 1
+        valid = first <= last
+        return np.where( valid, self.prices[ np.where( valid, last, 0 ) ] / self.prices[ np.where( valid, first, 0 ) ] - 1, np.nan )
+
+    def roc( self, codes, window=3 ):
+        ''' ROC in % over 1m closes as of now, same as the last value of ta's ROCIndicator( window ) on the OHLCV of an Asset
+
+        The forming bar closes at the latest price, the bar `window` minutes before closes at the last price before it ended.
+        '''
+        current = self.now - self.now % 60000
+        close = self.price( codes, self.now )
+        prev = self.price( codes, current - ( window - 1 ) * 60000 - 1 )
+        return np.nan_to_num( ( close - prev ) / prev * 100 )
+
+    def window( self, code, start, end ):
+        ''' Positions of the ticks of one symbol within ( start, end ]
+        '''
+        a, b = self.search( [ code, code ], [ start, end ], side='right' )
+        return int( a ), int( b )
+
+    def frame( self, symbol, lookback=60 ):
+        ''' OHLCV of the last lookback minutes as of now, same shape as Asset.OHLCV
+
+        Open, High, Low and Close are built from the ticks, the volume comes from the recorded klines,
+        the one of the forming bar in proportion to the ticks seen so far.
+
+        :return DataFrame['Date','Open','High','Low','Close','Volume'] | None if the recorded ticks do not cover the lookback
+        '''
+        code = self.index[ symbol ]
+        current = self.now - self.now % 60000
+        since = current - ( lookback - 1 ) * 60000
+        b = int( self.search( code, self.now, side='right' ) )
+        # one tick before the window, so minutes without trades can be filled from it
+        a = max( int( self.search( code, since ) ) - 1, int( self.offsets[ code ] ) )
+        if not self.covers( code, since ):
+            return None
+        times, prices = self.times[ a:b ], self.prices[ a:b ]
+        minutes = times - times % 60000
+        df = pd.Series( prices, index=minutes ).groupby( level=0 ).agg( [ 'first', 'max', 'min', 'last' ] )
+        df.columns = [ 'Open', 'High', 'Low', 'Close' ]
+        volume = self.volumes.get( symbol )
+        df[ 'Volume' ] = 0.0 if volume is None else volume.reindex( df.index ).fillna( 0.0 ).to_numpy()
+        if df.index[-1] == current:
+            seen = b - int( self.search( code, current ) )
+            total = int( self.search( code, current + 59999, side='right' ) ) - int( self.search( code, current ) )
+            df.iloc[ -1, df.columns.get_loc( 'Volume' ) ] *= seen / total
+        return fill_Klines( df, since, current )
+
+
+class Backtest:
+    ''' Tick replay of CryptoTrader
+
+    Runs the same states as CryptoTrader on simulated time: every Config.ScanInterval the symbols are ranked
+    with rank_Momentum() while a position slot is free, the best ones are filtered by minROC and entered at the latest price.
+    Open positions are run through the same Positions table, window by window instead of tick by tick,
+    and closed trades produce the same log records.
+
+    The ROC of a candidate is computed straight from the ticks, the full OHLCV with indicators is only built
+    for the assets which are entered, for their log record.
+
+    :param data     -> TickData
+    :param config   -> (optional) object with the Config attributes used by CryptoTrader, default Config
+    :param logfile  -> type:str: (optional) append the log records of the closed trades to this file
+    :param records  -> type:bool: build the log records, without them only the profit of the trades is kept
+    :param journal  -> Journal: (optional) write the closed trades to this trade journal
+    '''
+    def __init__( self, data, config=Config, logfile=None, records=True, journal=None ):
+        self.data = data
+        self.config = config
+        self.logfile = logfile
+        self.journal = journal
+        self.records = records
+        self.positions = Positions( config.MaxPositions, config.TargetProfit, config.StopLoss, config.BreakEven, step=config.TrailingStep )
+        self.assets = {}
+        self.trades = []
+        # total profit per closed trade
+        self.profits = []
+        self.ticks = 0
+        self.span = 0.0
+        self.elapsed = 0.0
+
+    def asset( self, symbol ):
+        # metadata only, OHLCV is set from the recorded ticks
+        if symbol not in self.assets:
+            self.assets[ symbol ] = Asset( None, symbol )
+        return self.assets[ symbol ]
+
+    def scan( self ):
+        ''' Same as CryptoTrader.scan() on the recorded ticks
+
+        :return Asset | None
+        '''
+        data = self.data
+        held = self.positions.symbols()
+        ranking = rank_Momentum( None, 2, ticks=data, top=self.config.TopK + len( held ), now=data.now )
+        ranking = ranking[ ~ranking.index.isin( held ) ].iloc[ :self.config.TopK ]
+        if ranking.empty:
+            return None
+        roc = data.roc( [ data.index[ symbol ] for symbol in ranking.index ] )
+        for symbol, value in zip( ranking.index, roc ):
+            if value >= self.config.minROC:
+                # CryptoTrader would fetch the missing history via REST, we can only skip the asset
+                if not data.covers( data.index[ symbol ], data.now - data.now % 60000 - 59 * 60000 ):
+                    continue
+                asset = self.asset( symbol )
+                if self.records:
+                    asset.OHLCV = data.frame( symbol )
+                    applyIndicators( asset.OHLCV, CryptoTrader.Indicators )
+                return asset
+        return None
+
+    def enter( self, asset ):
+        ''' Same as CryptoTrader.enter() at the latest recorded price
+
+        :return Order
+        '''
+        data = self.data
+        price = FixedPoint.parse( data.price( [ data.index[ asset.symbol ] ], data.now )[0] )
+        qty = asset.calculateQTY( self.config.Investment, price=price )
+        order = Order( None, asset, Order.BUY, qty, price )
+        order.timestamp = data.now / 1000
+        return order
+
+    def exit( self, asset, BuyOrder, CurrentPrice, at ):
+        ''' Same as CryptoTrader.exit() without the report
+        '''
+        SellOrder = CryptoTrader.sell( None, asset, BuyOrder, CurrentPrice )
+        SellOrder.timestamp = at / 1000
+        trade = Trade( asset, BuyOrder, SellOrder, closed=dt.datetime.fromtimestamp( SellOrder.timestamp ) )
+        self.profits.append( FixedPoint.to_float( trade.total_profit ) )
+        if not self.records:
+            return
+        record = trade.record()
+        self.trades.append( record )
+        if self.logfile is not None:
+            log( self.logfile, record, timestamp=False )
+        if self.journal is not None:
+            self.journal.add( trade )
+
+    def monitor( self, start, end ):
+        ''' Run all open positions over the ticks within ( start, end ]
+        '''
+        data = self.data
+        positions = self.positions
+        exits = []
+        for slot in np.flatnonzero( positions.active ):
+            code = data.index[ positions.assets[ slot ].symbol ]
+            a, b = data.window( code, start, end )
+            prices = FixedPoint.array( data.prices[ a:b ] )
+            i = positions.window( slot, prices )
+            if i >= 0:
+                exits.append( ( int( data.times[ a + i ] ), int( prices[ i ] ), slot ) )
+        for at, price, slot in sorted( exits ):
+            asset, order = positions.close( slot )
+            self.exit( asset, order, price, at )
+
+    def run( self, start=None, end=None ):
+        ''' Replay [ start, end ], default all recorded ticks
+
+        :param start    -> type:int: (optional) time in ms
+        :param end      -> type:int: (optional) time in ms
+        :return List of Dict: log records of the closed trades
+        '''
+        data = self.data
+        start = data.start if start is None else start
+        end = data.end if end is None else end
+        step = int( self.config.ScanInterval * 1000 )
+        timer = time.perf_counter()
+        now = start
+        while now <= end:
+            data.now = now
+            # SCAN + ENTER as long as a slot is free, like CryptoTrader.run()
+            while self.positions.free():
+                asset = self.scan()
+                if asset is None:
+                    break
+                self.positions.open( asset, self.enter( asset ) )
+            # MONITOR + EXIT
+            self.monitor( now, now + step )
+            now += step
+        self.elapsed = time.perf_counter() - timer
+        self.ticks = int( np.count_nonzero( ( data.times >= start ) & ( data.times <= end ) ) )
+        self.span = ( end - start ) / 1000
+        return self.trades
+
+    def stats( self ):
+        ''' Summary of the closed trades
+
+        :return Dict: trades, won, winrate in %, profit and the max drawdown of the cumulative profit
+        '''
+        profits = np.asarray( self.profits, dtype=float )
+        equity = np.cumsum( profits )
+        drawdown = float( ( np.maximum.accumulate( np.maximum( equity, 0.0 ) ) - equity ).max() ) if len( equity ) else 0.0
+        won = int( ( profits > 0 ).sum() )
+        return { 'trades' : len( profits ), 'won' : won, 'winrate' : won / len( profits ) * 100 if len( profits ) else 0.0, 'profit' : float( profits.sum() ), 'drawdown' : drawdown }
+
+    def report( self ):
+        stats = self.stats()
+        print( f'###_Backtest_###' )
+        print( f'Trades: {stats["trades"]} Won: {stats["won"]} Lost: {stats["trades"] - stats["won"]}' )
+        print( f'Profit: {stats["profit"]:.8f} Max drawdown: {stats["drawdown"]:.8f}' )
+        print( f'Open positions: {self.positions.size - self.positions.free()}' )
+        print( f'Replayed: {self.ticks} ticks, {dt.timedelta( seconds=self.span )} in {self.elapsed:.2f}s' )
+        print( f'Throughput: {self.ticks / max( self.elapsed, 1e-9 ):.0f} ticks/sec ({self.span / max( self.elapsed, 1e-9 ):.0f}x real time)' )
+        print( f'################', flush=True )
+
+
+def parse_Time( value ):
+    # UTC, same as the event times of the ticks
+    return None if value is None else int( pd.Timestamp( value, tz='UTC' ).value // 1000000 )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description='Replay recorded ticks through the CryptoTrader logic' )
+    parser.add_argument( '--database', default=Config.Database )
+    parser.add_argument( '--start', help='UTC, e.g. "2021-11-18 10:00"' )
+    parser.add_argument( '--end', help='UTC, e.g. "2021-11-18 12:00"' )
+    parser.add_argument( '--log', help='append the log records of the trades to this file' )
+    parser.add_argument( '--journal', help='write the trades to this trade journal' )
+    parser.add_argument( '--archive', action='store_true', help='include the ticks archived in Config.Archive' )
+    args = parser.parse_args()
+
+    # the cached exchange info is good enough for a replay, only fetch it if there is none
+    client = None if os.path.isfile( Config.MetadataCache ) else Client()
+    ExchangeInfo.get( client, path=Config.MetadataCache, ttl=float( 'inf' ) )
+
+    start, end = parse_Time( args.start ), parse_Time( args.end )
+    data = TickData.query( connectDB( args.database ), start, end, archive=Archive( Config.Archive ) if args.archive else None )
+    if not len( data.times ):
+        sys.exit( f'No ticks in {args.database}' )
+    backtest = Backtest( data, logfile=args.log, journal=Journal( args.journal ) if args.journal else None )
+    backtest.run( start, end )
+    backtest.report()
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) Dave Beusing <david.beusing@gmail.com>
+#
+#
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tempfile
+from math import floor
+from types import SimpleNamespace
+from decimal import Decimal, ROUND_DOWN
+
+import numpy as np
+import pandas as pd
+
+from utils import build_Frame, build_OHLCV, applyIndicators, connectDB, queryDB, rank_Momentum, TickWriter
+from models import Order, Positions
+from fixedpoint import FixedPoint
+from tickbuffer import TickBuffer
+from mockexchange import MockExchange, SyntheticTicks
+
+
+'''
+Benchmarks of the hot paths, driven by synthetic ticks and klines
+
+python benchmark.py [--only ingest,ranking] [--quick] [--out results.json] [--compare baseline.json] [--tolerance 0.2]
+
+Every benchmark returns a Dict of metrics. Metrics ending in _per_s and speedup are better when higher, all others
+(_us, _ms) when lower. --out writes the results together with the commit and versions as JSON, --compare reports
+every metric which got worse than in an earlier run by more than the tolerance and exits with 1 if there is any.
+'''
+
+# same values as example_config.py, so we do not depend on a local config.py
+TargetProfit = 0.8
+StopLoss = 1.0
+BreakEven = 0.2
+
+
+def synthetic_Trades( n, price=1.6453, symbol='LRCUSDT', seed=42 ):
+    ''' Random walk of trade stream messages as received from BinanceSocketManager.trade_socket()
+
+    :return List of Dict
+    '''
+    rng = np.random.default_rng( seed )
+    prices = price * np.cumprod( 1 + rng.normal( 0, 0.00002, n ) )
+    start = 1637081506349
+    return [ { 'e' : 'trade', 'E' : start + i + 2, 's' : symbol, 't' : 1148079548 + i, 'p' : f'{p:.8f}', 'q' : '12.00000000', 'b' : 8283146847, 'a' : 8283146313, 'T' : start + i, 'm' : False, 'M' : True } for i, p in enumerate( prices ) ]
+
+
+def timeit( fn, *args, repeat=5 ):
+    ''' Best of n runs in seconds
+    '''
+    best = None
+    for _ in range( repeat ):
+        start = time.perf_counter()
+        fn( *args )
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None or elapsed < best else best
+    return best
+
+
+def synthetic_Stream( n, symbols=300, end=None, span=3600000, seed=42 ):
+    ''' Trade messages of many symbols as received from multiplex_socket(), event times spread over span ms before end
+
+    :return List of Dict, List of symbols
+    '''
+    names = MockExchange.names( symbols, seed )
+    prices = np.exp( np.random.default_rng( seed ).uniform( np.log( 0.01 ), np.log( 50000 ), symbols ) )
+    codes, prices = SyntheticTicks( names, prices, seed=seed ).batch( n )
+    end = int( time.time() * 1000 ) if end is None else end
+    times = np.linspace( end - span, end, n ).astype( np.int64 )
+    ids = np.arange( n )
+    messages = [ { 'stream' : f'{names[ code ].lower()}@trade', 'data' : { 'e' : 'trade', 'E' : t, 's' : names[ code ], 't' : i, 'p' : f'{p:.8f}', 'q' : '1.00000000',
+        'b' : 2 * i, 'a' : 2 * i + 1, 'T' : t - 2, 'm' : False, 'M' : True } } for code, p, t, i in zip( codes.tolist(), prices.tolist(), times.tolist(), ids.tolist() ) ]
+    return messages, names
+
+
+def fill_Database( engine, symbols, n, end=None, span=3600000, seed=42 ):
+    ''' Bulk insert n random walk ticks of the symbols, spread over span ms before end
+    '''
+    rng = np.random.default_rng( seed )
+    end = int( time.time() * 1000 ) if end is None else end
+    with engine.begin() as conn:
+        conn.exec_driver_sql( 'INSERT OR IGNORE INTO symbols ( symbol ) VALUES ( ? )', [ ( symbol, ) for symbol in symbols ] )
+    for chunk in range( 0, n, 100000 ):
+        m = min( 100000, n - chunk )
+        codes = rng.integers( 0, len( symbols ), m )
+        times = rng.integers( end - span, end, m )
+        prices = np.exp( rng.normal( 0, 0.01, m ) )
+        rows = [ ( symbols[ c ], t, chunk + i, p ) for i, ( c, t, p ) in enumerate( zip( codes.tolist(), times.tolist(), prices.tolist() ) ) ]
+        with engine.begin() as conn:
+            conn.exec_driver_sql( 'INSERT OR IGNORE INTO ticks ( symbol, time, id, price ) VALUES ( ?, ?, ?, ? )', rows )
+
+
+def buy_Order( price ):
+    asset = SimpleNamespace( symbol='LRCUSDT', precision=8 )
+    return Order( None, asset, Order.BUY, FixedPoint.parse( '61' ), FixedPoint.parse( price ) )
+
+
+def monitor_legacy( BuyOrder, messages ):
+    ''' The per-tick body of the monitor loop before the hot path rework: DataFrame per tick, Decimal thresholds
+    '''
+    price = Decimal( FixedPoint.format( BuyOrder.price ) )
+    for response in messages:
+        frame = build_Frame( response )
+        CurrentPrice = frame.Price.iloc[-1]
+
+        TargetProfit_ = Decimal( price ) + ( Decimal( price ) * Decimal( TargetProfit ) ) / 100
+        StopLoss_ = Decimal( price ) + ( Decimal( price ) * Decimal( -StopLoss ) ) / 100
+        BreakEven_ = Decimal( price ) + ( Decimal( price ) * Decimal( BreakEven ) ) / 100
+
+        if BuyOrder.TTP is not None:
+            TargetProfit_ = Decimal( BuyOrder.trail( 'get', 'TTP' ) )
+            StopLoss_ = Decimal( BuyOrder.trail( 'get', 'TSL' ) )
+
+        if CurrentPrice > TargetProfit_:
+            TargetProfit_ = Decimal( CurrentPrice ) + ( Decimal( CurrentPrice ) * Decimal( .1 ) ) / 100
+            StopLoss_ = Decimal( TargetProfit_ ) + ( Decimal( TargetProfit_ ) * Decimal( -.1 ) ) / 100
+            BuyOrder.trail( 'set', 'TTP', TargetProfit_ )
+            BuyOrder.trail( 'set', 'TSL', StopLoss_ )
+
+        if CurrentPrice < StopLoss_ or CurrentPrice > TargetProfit_:
+            return CurrentPrice
+
+
+def monitor_positions( BuyOrder, messages, size=10 ):
+    ''' The per-tick body of CryptoTrader.monitor() with a table of open positions, messages as received from multiplex_socket()
+    '''
+    positions = Positions( size, TargetProfit, StopLoss, BreakEven )
+    for _ in range( size ):
+        positions.open( BuyOrder.asset, BuyOrder )
+    for response in messages:
+        data = response[ 'data' ]
+        p = data[ 'p' ]
+        CurrentPrice = int( p.replace( '.', '', 1 ) ) if len( p ) > 8 and p[-9] == '.' else FixedPoint.parse( p )
+        exits, trailed = positions.tick( data[ 's' ], CurrentPrice )
+        if len( exits ):
+            return CurrentPrice
+
+
+def bench_monitor( n=20000 ):
+    ''' Per-tick cost of the position monitor loop, before and after
+
+    hotpath is CryptoTrader.monitor() with one open position, positions10 with a full table of 10.
+    '''
+    messages = synthetic_Trades( n )
+    # the random walk stays between StopLoss and TargetProfit, so every tick is processed
+    price = '1.6453'
+    # the legacy loop is slow, a slice of the stream is enough
+    legacy = timeit( lambda: monitor_legacy( buy_Order( price ), messages[ : n // 20 ] ), repeat=3 ) / ( n // 20 )
+    multiplexed = [ { 'stream' : 'lrcusdt@trade', 'data' : message } for message in messages ]
+    hotpath = timeit( lambda: monitor_positions( buy_Order( price ), multiplexed, size=1 ) ) / n
+    positions = timeit( lambda: monitor_positions( buy_Order( price ), multiplexed ) ) / n
+    return { 'legacy_us_per_tick' : legacy * 1e6, 'hotpath_us_per_tick' : hotpath * 1e6, 'speedup' : legacy / hotpath, 'positions10_us_per_tick' : positions * 1e6 }
+
+
+def bench_fixedpoint( n=100000 ):
+    ''' Price and quantity arithmetic of an order, Decimal as the models used to do it vs FixedPoint integers
+
+    parse: price string of a trade message with FixedPoint.parse(), inline: the same parse inlined as in
+    CryptoTrader.monitor(), check: inlined parse + TakeProfit/StopLoss comparison, pnl: profit of a trade quantized
+    to 1e-8, qty: quantity worth Config.Investment on the stepSize grid.
+    '''
+    texts = [ message[ 'p' ] for message in synthetic_Trades( n ) ]
+    ask, step, amount = '1.64530000', '0.10000000', 100
+    eighth = Decimal( '.00000001' )
+
+    askD, stepD = Decimal( ask ), Decimal( step )
+    TargetProfitD = askD + ( askD * Decimal( TargetProfit ) ) / 100
+    StopLossD = askD + ( askD * Decimal( -StopLoss ) ) / 100
+    def check_Decimal():
+        for text in texts:
+            price = Decimal( text )
+            if price > TargetProfitD or price < StopLossD:
+                pass
+    def pnl_Decimal():
+        for text in texts:
+            ( ( Decimal( text ) - askD ).quantize( eighth, rounding=ROUND_DOWN ) * stepD ).quantize( eighth, rounding=ROUND_DOWN )
+    def qty_Decimal():
+        for text in texts:
+            Decimal( floor( Decimal( amount ) / ( Decimal( text ) * stepD ) ) * stepD )
+
+    fixed = FixedPoint( '0.00010000', step )
+    askI, stepI = FixedPoint.parse( ask ), FixedPoint.parse( step )
+    TargetProfitI = FixedPoint.percent( askI, TargetProfit )
+    StopLossI = FixedPoint.percent( askI, -StopLoss, up=True )
+    parse = FixedPoint.parse
+    def inline_Integer():
+        for text in texts:
+            int( text.replace( '.', '', 1 ) ) if len( text ) > 8 and text[-9] == '.' else parse( text )
+    def check_Integer():
+        for text in texts:
+            price = int( text.replace( '.', '', 1 ) ) if len( text ) > 8 and text[-9] == '.' else parse( text )
+            if price > TargetProfitI or price < StopLossI:
+                pass
+    def pnl_Integer():
+        for text in texts:
+            FixedPoint.mul( parse( text ) - askI, stepI )
+    def qty_Integer():
+        for text in texts:
+            fixed.quantity( amount, parse( text ) )
+
+    result = {}
+    for name, decimal, integer in [ ( 'parse', lambda: [ Decimal( text ) for text in texts ], lambda: [ parse( text ) for text in texts ] ),
+            ( 'inline', lambda: [ Decimal( text ) for text in texts ], inline_Integer ), ( 'check', check_Decimal, check_Integer ), ( 'pnl', pnl_Decimal, pnl_Integer ), ( 'qty', qty_Decimal, qty_Integer ) ]:
+        decimal, integer = timeit( decimal, repeat=3 ) / n, timeit( integer, repeat=3 ) / n
+        result[ f'{name}_decimal_us' ] = decimal * 1e6
+        result[ f'{name}_fixedpoint_us' ] = integer * 1e6
+        result[ f'{name}_speedup' ] = decimal / integer
+    return result
+
+
+def bench_build_Frame( n=5000 ):
+    ''' Websocket message -> DataFrame, as the stream used to be decoded per tick
+    '''
+    messages, _ = synthetic_Stream( n )
+    elapsed = timeit( lambda: [ build_Frame( message, isMultiStream=True ) for message in messages ], repeat=3 )
+    return { 'build_Frame_us' : elapsed / n * 1e6, 'build_Frame_per_s' : n / elapsed }
+
+
+def bench_ingest( n=200000, symbols=300 ):
+    ''' CryptoStream end to end: decode the JSON text, TickWriter into SQLite incl. klines, append to the TickBuffer
+    '''
+    messages, names = synthetic_Stream( n, symbols )
+    texts = [ json.dumps( message ) for message in messages ]
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = TickWriter( connectDB( os.path.join( tmp, 'ingest.sqlite3' ) ), size=500, interval=float( 'inf' ) )
+        ticks = TickBuffer( os.path.join( tmp, 'ticks' ), symbols=names )
+        start = time.perf_counter()
+        for text in texts:
+            response = json.loads( text )
+            data = response[ 'data' ]
+            writer.add( response, isMultiStream=True )
+            ticks.append( data[ 's' ], data[ 'E' ], float( data[ 'p' ] ) )
+        writer.flush()
+        elapsed = time.perf_counter() - start
+    return { 'ingest_us' : elapsed / n * 1e6, 'ingest_per_s' : n / elapsed }
+
+
+def bench_queryDB( sizes=( 100000, 1000000 ), symbols=300, repeat=20 ):
+    ''' Latency of a 2 minute lookback of one symbol while the ticks table grows
+    '''
+    result = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = connectDB( os.path.join( tmp, 'query.sqlite3' ) )
+        names = MockExchange.names( symbols, 42 )
+        now = int( time.time() * 1000 )
+        filled = 0
+        for size in sizes:
+            fill_Database( engine, names, size - filled, end=now, seed=size )
+            filled = size
+            latencies = []
+            for i in range( repeat ):
+                start = time.perf_counter()
+                queryDB( engine, names[ i % symbols ], 2 )
+                latencies.append( time.perf_counter() - start )
+            result[ f'queryDB_{size}_ms' ] = float( np.median( latencies ) * 1e3 )
+    return result
+
+
+def bench_indicators( n=200 ):
+    ''' applyIndicators on the 60 bar 1m frame of a candidate, all indicators
+    '''
+    exchange = MockExchange( 50, seed=42 )
+    frames = [ build_OHLCV( exchange.get_klines( symbol, '1m', limit=60 ) ) for symbol in exchange.symbols ]
+    frames = [ frames[ i % len( frames ) ] for i in range( n ) ]
+    elapsed = timeit( lambda: [ applyIndicators( frame.copy() ) for frame in frames ], repeat=3 )
+    return { 'applyIndicators_60_us' : elapsed / n * 1e6 }
+
+
+def bench_ranking( universes=( 100, 500, 1000 ), per_symbol=200, repeat=10 ):
+    ''' The ranking of CryptoTrader.scan() over 100/500/1000 symbols, from the Database and from the TickBuffer
+    '''
+    result = {}
+    now = int( time.time() * 1000 )
+    for symbols in universes:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = connectDB( os.path.join( tmp, 'rank.sqlite3' ) )
+            names = MockExchange.names( symbols, 42 )
+            # five minutes of ticks, the ranking looks at the last two
+            fill_Database( engine, names, symbols * per_symbol, end=now, span=300000, seed=symbols )
+            ticks = TickBuffer( os.path.join( tmp, 'ticks' ), symbols=names )
+            df = pd.read_sql( 'SELECT symbol, time, price FROM ticks ORDER BY time', engine )
+            for symbol, t, price in df.itertuples( index=False ):
+                ticks.append( symbol, t, price )
+            for name, source in [ ( 'db', None ), ( 'buffer', ticks ) ]:
+                rank_Momentum( engine, 2, ticks=source, top=3, now=now )
+                elapsed = timeit( lambda: rank_Momentum( engine, 2, ticks=source, top=3, now=now ), repeat=repeat )
+                result[ f'ranking_{symbols}_{name}_ms' ] = elapsed * 1e3
+    return result
+
+
+Benchmarks = {
+    'monitor' : ( bench_monitor, {} ),
+    'fixedpoint' : ( bench_fixedpoint, { 'n' : 20000 } ),
+    'build_Frame' : ( bench_build_Frame, {} ),
+    'ingest' : ( bench_ingest, { 'n' : 20000 } ),
+    'queryDB' : ( bench_queryDB, { 'sizes' : ( 10000, 100000 ) } ),
+    'indicators' : ( bench_indicators, { 'n' : 50 } ),
+    'ranking' : ( bench_ranking, { 'per_symbol' : 50 } ),
+}
+
+
+def environment():
+    ''' What the results were measured on
+    '''
+    try:
+        commit = subprocess.run( [ 'git', 'rev-parse', '--short', 'HEAD' ], capture_output=True, text=True, cwd=os.path.dirname( os.path.abspath( __file__ ) ) ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return { 'timestamp' : time.time(), 'commit' : commit, 'python' : platform.python_version(), 'numpy' : np.__version__, 'pandas' : pd.__version__,
+        'platform' : platform.platform(), 'cpus' : os.cpu_count() }
+
+
+def higher_is_better( metric ):
+    return metric.endswith( '_per_s' ) or metric.endswith( 'speedup' )
+
+
+def compare( baseline, results, tolerance=0.2 ):
+    ''' Metrics which got worse than in baseline by more than tolerance
+
+    :param baseline -> type:Dict: results of an earlier run
+    :param results  -> type:Dict: bench -> metric -> value
+    :return List of ( bench, metric, before, after, change )
+    '''
+    regressions = []
+    for bench, metrics in results.items():
+        for metric, after in metrics.items():
+            before = baseline.get( bench, {} ).get( metric )
+            if not before:
+                continue
+            change = after / before - 1
+            worse = -change if higher_is_better( metric ) else change
+            if worse > tolerance:
+                regressions.append( ( bench, metric, before, after, change ) )
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description='Benchmarks of the hot paths' )
+    parser.add_argument( '--only', help=f'comma separated subset of {",".join( Benchmarks )}' )
+    parser.add_argument( '--quick', action='store_true', help='small sizes, for a smoke test' )
+    parser.add_argument( '--out', help='write the results as JSON' )
+    parser.add_argument( '--compare', help='JSON results of an earlier run' )
+    parser.add_argument( '--tolerance', type=float, default=0.2, help='relative change which counts as regression' )
+    args = parser.parse_args()
+
+    names = args.only.split( ',' ) if args.only else list( Benchmarks )
+    results = {}
+    for name in names:
+        fn, quick = Benchmarks[ name ]
+        results[ name ] = fn( **( quick if args.quick else {} ) )
+        print( name, ' '.join( f'{k}={v:.3f}' for k, v in results[ name ].items() ), flush=True )
+
+    if args.out:
+        with open( args.out, 'w' ) as fd:
+            json.dump( { **environment(), 'quick' : args.quick, 'results' : results }, fd, indent=2 )
+
+    if args.compare:
+        with open( args.compare, 'r' ) as fd:
+            baseline = json.load( fd )
+        regressions = compare( baseline[ 'results' ], results, args.tolerance )
+        print( f'###_Compare_### {args.compare} ({baseline.get( "commit" )})' )
+        for bench, metric, before, after, change in regressions:
+            print( f'{bench:<12}{metric:<32}{before:>12.3f} -> {after:>12.3f} ({change:+.1%})' )
+        print( f'{len( regressions )} regression(s) above {args.tolerance:.0%}', flush=True )
+        sys.exit( 1 if regressions else 0 )
@@ -13,10 +13,63 @@ class Config:
     TargetProfit = 0.8
     StopLoss = 1.0 # We need to have fee's in mind 0.1% each direction so 0.2 total for trade
     BreakEven = 0.2 # At least we need the fee's to be paid
+    # Once TargetProfit is exceeded TakeProfit and StopLoss trail the price by this step in %
+    TrailingStep = 0.1
     # Indicator settings
     minROC = 1
+    # Number of the best ranked symbols CryptoTrader evaluates concurrently on every scan
+    TopK = 3
+    # Follow the order books (DepthLimit levels) of the candidates and skip the ones where buying and selling Investment
+    # at market is expected to cost more than MaxSlippage of TargetProfit
+    Depth = False
+    DepthLimit = 100
+    MaxSlippage = 0.5
+    # Seconds CryptoTrader waits before the next scan if no opportunity was found
+    ScanInterval = 1.0
+    # number of positions held at once, each one is worth Investment
+    MaxPositions = 1
     Logfile = '/path/to/logfile.log'
+    # Trade journal, one row per closed trade
+    Journal = '/path/to/journal.sqlite3'
     Database = '/path/to/database.sqlite3'
+    # Closed hours older than ArchiveKeep hours are moved from the Database to the archive every ArchiveInterval seconds
+    Archive = '/path/to/archive'
+    ArchiveKeep = 2
+    ArchiveInterval = 3600
+    # CryptoStream flushes buffered ticks to the Database after BatchSize ticks or BatchInterval seconds
+    BatchSize = 500
+    BatchInterval = 1.0
+    # The trade streams are split over connections of StreamShard streams (Binance allows 1024), each one queues up to
+    # StreamQueue messages for the writer and reconnects after StreamTimeout seconds without a message
+    StreamShard = 200
+    StreamQueue = 10000
+    StreamTimeout = 60
+    # Ring buffer of the most recent ticks per symbol shared by CryptoStream and CryptoTrader, tmpfs recommended
+    TickBuffer = '/dev/shm/CryptoTrader.ticks'
+    TickBufferSize = 4096
+    # Local cache of the exchange info (symbols, filters), refreshed after MetadataTTL seconds
+    MetadataCache = '/path/to/exchangeinfo.json'
+    MetadataTTL = 3600
+    # REST calls are paced below RequestWeight per minute, transient errors are retried RequestRetries times
+    # with a jittered backoff starting at RequestBackoff seconds, doubled per attempt up to RequestBackoffMax
+    RequestWeight = 1200
+    RequestRetries = 5
+    RequestBackoff = 0.5
+    RequestBackoffMax = 10.0
+    # binance | mock: run against the local mock exchange of mockexchange.py, give it its own Database, MetadataCache and TickBuffer
+    Exchange = 'binance'
+    # mock exchange: number of synthetic symbols, trade messages per second, seconds per REST call,
+    # MockTicks replays the ticks saved with TickData.save() in this directory instead of synthetic ones
+    MockSymbols = 300
+    MockRate = 1000
+    MockLatency = 0.0
+    MockTicks = None
+    MockSeed = 1
+    # share of trade messages after which a mock websocket connection drops, to exercise reconnects
+    MockDrops = 0.0
+    # Latency histograms of CryptoStream and CryptoTrader are appended to <Metrics>/<process>.jsonl every MetricsInterval seconds
+    Metrics = '/path/to/metrics'
+    MetricsInterval = 60
     CryptoTrader = '/path/to/CryptoTrader.py'
     CryptoStream = '/path/to/CryptoStream.py'
     STDOUT = 'path/to/name.stdout'
\ No newline at end of file
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) Dave Beusing <david.beusing@gmail.com>
+#
+#
+
+import numpy as np
+
+from decimal import Decimal, ROUND_DOWN
+
+
+class FixedPoint:
+    ''' Prices and quantities as integers of 1e-8, the precision every value on Binance has
+
+    Values from the API (strings) are parsed exactly, without going through float or Decimal, and only turned
+    back into strings or floats at the boundary (orders, journal, log). In between comparisons and P&L are
+    plain integer operations. Products are exact as well, Python integers do not overflow.
+
+    An instance holds tickSize and stepSize of one symbol in units, so rounding to the PRICE_FILTER and
+    LOT_SIZE grid is one integer division:
+
+        fp = FixedPoint( '0.00010000', '1.00000000' )
+        price = fp.price( '1.64537' )              # 164530000 -> 1.6453
+        qty = fp.quantity( 100, price )            # 60.0 in units, floored to stepSize
+        FixedPoint.format( qty )                   # '60.00000000'
+
+    :param tickSize -> type:str: PRICE_FILTER tickSize
+    :param stepSize -> type:str: LOT_SIZE stepSize
+    '''
+    DECIMALS = 8
+    SCALE = 10 ** DECIMALS
+
+    def __init__( self, tickSize, stepSize ):
+        # a step of 0 (e.g. MARKET_LOT_SIZE) means no restriction beyond the 8 decimals
+        self.tick = FixedPoint.parse( tickSize ) or 1
+        self.step = FixedPoint.parse( stepSize ) or 1
+
+    def parse( value ):
+        ''' '1.64530000' | 1.6453 | Decimal -> 164530000
+
+        Strings and Decimals are exact, more than 8 decimals are cut off. Floats are rounded to the nearest unit.
+        An int already is a value in units everywhere else (price(), qty(), ...), so it is rejected here rather
+        than read as whole units: parse( '5' ) or parse( 5.0 ) for five, or use the int as it is.
+        '''
+        if value.__class__ is str and len( value ) > 8 and value[ -9 ] == '.':
+            # the API sends every value with exactly 8 decimals, dropping the point gives the units
+            return int( value.replace( '.', '', 1 ) )
+        if isinstance( value, ( int, np.integer ) ):
+            raise TypeError( f'{value!r} is ambiguous, ints are units, parse() takes str, float or Decimal' )
+        if isinstance( value, ( float, np.floating ) ):
+            return int( round( value * FixedPoint.SCALE ) )
+        if isinstance( value, Decimal ):
+            # str() of a Decimal may be in exponent notation
+            return int( value.scaleb( FixedPoint.DECIMALS ).to_integral_value( rounding=ROUND_DOWN ) )
+        text = str( value )
+        sign = -1 if text.startswith( '-' ) else 1
+        whole, _, fraction = text.lstrip( '+-' ).partition( '.' )
+        return sign * ( int( whole or '0' ) * FixedPoint.SCALE + int( ( fraction + '0' * FixedPoint.DECIMALS )[ :FixedPoint.DECIMALS ] ) )
+
+    def format( units ):
+        ''' 164530000 -> '1.64530000', the format of the API
+        '''
+        units = int( units )
+        sign = '-' if units < 0 else ''
+        whole, fraction = divmod( abs( units ), FixedPoint.SCALE )
+        return f'{sign}{whole}.{fraction:0{FixedPoint.DECIMALS}d}'
+
+    def to_float( units ):
+        return int( units ) / FixedPoint.SCALE
+
+    def array( values ):
+        ''' float prices -> int64 units, e.g. recorded ticks
+        '''
+        return np.round( np.asarray( values, dtype=np.float64 ) * FixedPoint.SCALE ).astype( np.int64 )
+
+    def div( a, b ):
+        ''' Integer division rounded toward zero like Decimal ROUND_DOWN, floor division would round losses away from zero
+        '''
+        q = abs( a ) // abs( b )
+        return q if ( a < 0 ) == ( b < 0 ) else -q
+
+    def mul( a, b ):
+        ''' Product of two values in units, rounded toward zero
+        '''
+        return FixedPoint.div( int( a ) * int( b ), FixedPoint.SCALE )
+
+    def ratio( a, b ):
+        ''' a / b in units, rounded toward zero
+        '''
+        return FixedPoint.div( int( a ) * FixedPoint.SCALE, int( b ) )
+
+    def percent( units, pct, up=False ):
+        ''' units + pct %, rounded down or up to a unit
+
+        pct comes from the config as float, it is taken with 6 decimals which is far more than any threshold needs.
+        '''
+        num = int( units ) * ( 100000000 + int( round( pct * 1000000 ) ) )
+        return -( -num // 100000000 ) if up else num // 100000000
+
+    def price( self, value, up=False ):
+        ''' Price in units on the tick grid, rounded down or up
+
+        :param value -> type:int: units | type:str|float: as given by the API, see parse()
+        '''
+        units = int( value ) if isinstance( value, ( int, np.integer ) ) else FixedPoint.parse( value )
+        return -( -units // self.tick ) * self.tick if up else units // self.tick * self.tick
+
+    def qty( self, value ):
+        ''' Quantity in units floored to the step grid, LOT_SIZE rejects everything else
+
+        :param value -> type:int: units | type:str|float: as given by the API, see parse()
+        '''
+        units = int( value ) if isinstance( value, ( int, np.integer ) ) else FixedPoint.parse( value )
+        return units // self.step * self.step
+
+    def quantity( self, amount, price ):
+        ''' Quantity worth amount of the quote asset at price (units), floored to the step grid
+
+        :param amount   -> type:float|int|str: whole units of the quote asset e.g. Config.Investment, not units of 1e-8
+        :param price    -> type:int: units
+        '''
+        if amount.__class__ is int:
+            amount *= FixedPoint.SCALE
+        else:
+            amount = FixedPoint.parse( amount if isinstance( amount, str ) else float( amount ) )
+        # floor( floor( a / price ) / step ) == floor( a / ( price * step ) ), one division instead of two
+        return amount * FixedPoint.SCALE // ( int( price ) * self.step ) * self.step
+
+    def notional( self, price, qty ):
+        ''' price * qty in units of the quote asset
+        '''
+        return FixedPoint.mul( price, qty )
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) Dave Beusing <david.beusing@gmail.com>
+#
+#
+
+from collections import deque
+from math import sqrt, nan
+
+
+'''
+Streaming counterparts of the indicators in utils.applyIndicators()
+
+Every building block keeps just enough state to produce its next value in constant time.
+peek( x ) returns the value the indicator would have if x was the next input without changing the state,
+push( x ) commits x. This way the still forming bar can be evaluated on every tick and is committed once it closes.
+
+The parameters and the warm-up behaviour follow the ta library with fillna=True, so the values match
+applyIndicators() within floating point tolerance.
+'''
+
+
+class EMA:
+    ''' Exponential moving average, same as pandas ewm( alpha, adjust=False )
+
+    :param alpha -> type:float: smoothing factor, 2 / ( span + 1 ) or 1 / window for Wilder's smoothing
+    '''
+    def __init__( self, alpha ):
+        self.alpha = alpha
+        self.value = None
+
+    def peek( self, x ):
+        if self.value is None:
+            return x
+        return self.value + self.alpha * ( x - self.value )
+
+    def push( self, x ):
+        self.value = self.peek( x )
+        return self.value
+
+
+class SMA:
+    ''' Simple moving average and standard deviation (ddof=0) over a fixed window
+
+    Running sums are taken relative to the first value ever seen, which keeps the variance
+    numerically stable for high priced symbols.
+
+    :param window -> type:int
+    '''
+    def __init__( self, window ):
+        self.window = window
+        self.values = deque()
+        self.shift = None
+        self.sum = 0.0
+        self.sumsq = 0.0
+
+    def _sums( self, x ):
+        shift = x if self.shift is None else self.shift
+        d = x - shift
+        s = self.sum + d
+        q = self.sumsq + d * d
+        n = len( self.values ) + 1
+        if n > self.window:
+            old = self.values[0] - shift
+            s -= old
+            q -= old * old
+            n -= 1
+        return shift, s, q, n
+
+    def peek( self, x ):
+        shift, s, q, n = self._sums( x )
+        return shift + s / n
+
+    def peek_std( self, x ):
+        shift, s, q, n = self._sums( x )
+        mean = s / n
+        return shift + mean, sqrt( max( q / n - mean * mean, 0.0 ) )
+
+    def push( self, x ):
+        self.shift, self.sum, self.sumsq, n = self._sums( x )
+        self.values.append( x )
+        if len( self.values ) > self.window:
+            self.values.popleft()
+        return self.shift + self.sum / n
+
+
+class ROC:
+    ''' Rate of change in % over the last n periods, 0 until n periods are available
+    '''
+    def __init__( self, window ):
+        self.window = window
+        self.values = deque( maxlen=window )
+        self.value = 0.0
+
+    def peek( self, x ):
+        if len( self.values ) < self.window or self.values[0] == 0:
+            return self.value
+        return ( x - self.values[0] ) / self.values[0] * 100
+
+    def push( self, x ):
+        self.value = self.peek( x )
+        self.values.append( x )
+        return self.value
+
+
+class ATR:
+    ''' Average true range with Wilder's smoothing, 0 until the first window is complete
+    '''
+    def __init__( self, window ):
+        self.window = window
+        self.n = 0
+        self.sum = 0.0
+        self.value = 0.0
+
+    def peek( self, high, low, prev_close ):
+        if prev_close is None:
+            tr = high - low
+        else:
+            tr = max( high - low, abs( high - prev_close ), abs( low - prev_close ) )
+        if self.n < self.window - 1:
+            return 0.0, tr
+        if self.n == self.window - 1:
+            return ( self.sum + tr ) / self.window, tr
+        return ( self.value * ( self.window - 1 ) + tr ) / self.window, tr
+
+    def push( self, high, low, prev_close ):
+        self.value, tr = self.peek( high, low, prev_close )
+        if self.n < self.window - 1:
+            self.sum += tr
+        self.n += 1
+        return self.value
+
+
+class PSAR:
+    ''' Parabolic stop and reverse, same algorithm as ta.trend.PSARIndicator
+
+    The whole state is a tuple, step() is a pure function of it.
+    Before the first up (down) trend PSAR_up (PSAR_down) is NaN, ta back-fills it from the future.
+    '''
+    def __init__( self, step=0.02, max_step=0.2 ):
+        self.step_ = step
+        self.max_step = max_step
+        # n, up, af, up_trend_high, down_trend_low, psar, high1, low1, high2, low2, up value, down value, prev up, prev down
+        self.state = ( 0, True, step, nan, nan, nan, nan, nan, nan, nan, nan, nan, False, False )
+
+    def step( self, high, low, close ):
+        n, up, af, uth, dtl, psar, h1, l1, h2, l2, upv, downv, wasup, wasdown = self.state
+        if n < 2:
+            if n == 0:
+                uth, dtl = high, low
+            return ( n + 1, up, af, uth, dtl, close, high, low, h1, l1, upv, downv, False, False )
+        reversal = False
+        if up:
+            psar = psar + af * ( uth - psar )
+            if low < psar:
+                reversal = True
+                psar = uth
+                dtl = low
+                af = self.step_
+            else:
+                if high > uth:
+                    uth = high
+                    af = min( af + self.step_, self.max_step )
+                if l2 < psar:
+                    psar = l2
+                elif l1 < psar:
+                    psar = l1
+        else:
+            psar = psar - af * ( psar - dtl )
+            if high > psar:
+                reversal = True
+                psar = dtl
+                uth = high
+                af = self.step_
+            else:
+                if low < dtl:
+                    dtl = low
+                    af = min( af + self.step_, self.max_step )
+                if h2 > psar:
+                    psar = h2
+                elif h1 > psar:
+                    psar = h1
+        up = up != reversal
+        if up:
+            upv = psar
+        else:
+            downv = psar
+        return ( n + 1, up, af, uth, dtl, psar, high, low, h1, l1, upv, downv, up, not up )
+
+    def values( self, state, prev ):
+        n, up, af, uth, dtl, psar, h1, l1, h2, l2, upv, downv, isup, isdown = state
+        wasup, wasdown = prev[12], prev[13]
+        return psar, downv, int( isdown and not wasdown ), upv, int( isup and not wasup )
+
+    def peek( self, high, low, close ):
+        return self.values( self.step( high, low, close ), self.state )
+
+    def push( self, high, low, close ):
+        prev, self.state = self.state, self.step( high, low, close )
+        return self.values( self.state, prev )
+
+
+class IndicatorEngine:
+    ''' Stateful, incremental version of utils.applyIndicators() for one symbol
+
+    Every indicator is updated in O(1) per bar, so the current values are available right away
+    instead of recomputing the whole OHLCV history on every call.
+
+    Feed it either closed 1m bars with update(), or raw trades with tick() which aggregates them into
+    1m bars on its own. The still forming bar is evaluated without being committed, so values are
+    always up to date and match applyIndicators() run over a frame whose last row is the forming bar.
+
+    :param symbol -> type:str: (optional) name of the symbol, informational only
+    '''
+    SMA = [ 7, 25, 60, 12, 26, 50, 200 ]
+
+    def __init__( self, symbol=None ):
+        self.symbol = symbol
+        self.rsi_up = EMA( 1 / 14 )
+        self.rsi_down = EMA( 1 / 14 )
+        self.macd_fast = EMA( 2 / ( 12 + 1 ) )
+        self.macd_slow = EMA( 2 / ( 26 + 1 ) )
+        self.macd_sign = EMA( 2 / ( 9 + 1 ) )
+        self.sma = { w : SMA( w ) for w in self.SMA }
+        self.bb = SMA( 20 )
+        self.psar = PSAR( step=0.02, max_step=2 )
+        self.atr = ATR( 14 )
+        self.obv = 0.0
+        self.roc = ROC( 3 )
+        self.close = None
+        # forming bar [ time, open, high, low, close, volume ]
+        self.bar = None
+        self.values = {}
+
+    def update( self, open, high, low, close, volume, closed=True ):
+        ''' Apply one bar
+
+        :param closed -> type:bool: False if the bar is still forming, its values are calculated but not committed
+        :return Dict: current indicator values, keyed like the columns of applyIndicators()
+        '''
+        prev = self.close
+        v = self.values
+        fn = 'push' if closed else 'peek'
+
+        diff = 0.0 if prev is None else close - prev
+        up = getattr( self.rsi_up, fn )( diff if diff > 0 else 0.0 )
+        down = getattr( self.rsi_down, fn )( -diff if diff < 0 else 0.0 )
+        v[ 'RSI' ] = 100.0 if down == 0 else 100 - ( 100 / ( 1 + up / down ) )
+
+        macd = getattr( self.macd_fast, fn )( close ) - getattr( self.macd_slow, fn )( close )
+        signal = getattr( self.macd_sign, fn )( macd )
+        v[ 'MACD' ] = macd
+        v[ 'MACD_Diff' ] = macd - signal
+        v[ 'MACD_Signal' ] = signal
+
+        for window, sma in self.sma.items():
+            v[ f'SMA{window}' ] = getattr( sma, fn )( close )
+
+        psar = getattr( self.psar, fn )( high, low, close )
+        v[ 'PSAR' ], v[ 'PSAR_down' ], v[ 'PSAR_down_ind' ], v[ 'PSAR_up' ], v[ 'PSAR_up_ind' ] = psar
+
+        mavg, mstd = self.bb.peek_std( close )
+        if closed:
+            self.bb.push( close )
+        v[ 'bb_avg' ] = mavg
+        v[ 'bb_high' ] = mavg + 2 * mstd
+        v[ 'bb_low' ] = mavg - 2 * mstd
+
+        if closed:
+            v[ 'ATR' ] = self.atr.push( high, low, prev )
+        else:
+            v[ 'ATR' ] = self.atr.peek( high, low, prev )[0]
+
+        obv = self.obv + ( -volume if prev is not None and close < prev else volume )
+        v[ 'OBV' ] = obv
+
+        v[ 'ROC' ] = getattr( self.roc, fn )( close )
+
+        if closed:
+            self.obv = obv
+            self.close = close
+        return v
+
+    def tick( self, time, price, qty=0.0 ):
+        ''' Apply one trade, trades are aggregated into 1m bars
+
+        :param time     -> type:int: trade time in ms
+        :param price    -> type:float
+        :param qty      -> type:float: traded quantity
+        :return Dict: current indicator values
+        '''
+        minute = time - time % 60000
+        bar = self.bar
+        if bar is not None and minute > bar[0]:
+            self.update( *bar[1:], closed=True )
+            bar = None
+        if bar is None:
+            bar = self.bar = [ minute, price, price, price, price, qty ]
+        else:
+            if price > bar[2]:
+                bar[2] = price
+            if price < bar[3]:
+                bar[3] = price
+            bar[4] = price
+            bar[5] += qty
+        return self.update( *bar[1:], closed=False )
+
+    def load( self, df ):
+        ''' Warm up from an OHLCV DataFrame as returned by fetch_OHLCV()
+
+        All rows but the last are committed, the last one is treated as the forming bar.
+
+        :param df -> DataFrame[ 'Open','High','Low','Close','Volume' ] with a DatetimeIndex
+        :return Dict: current indicator values
+        '''
+        rows = list( df[ [ 'Open', 'High', 'Low', 'Close', 'Volume' ] ].itertuples( index=True, name=None ) )
+        for row in rows[:-1]:
+            self.update( *row[1:], closed=True )
+        if rows:
+            minute = int( rows[-1][0].value // 1000000 )
+            self.bar = [ minute, *rows[-1][1:] ]
+            self.update( *self.bar[1:], closed=False )
+        return self.values
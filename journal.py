@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) Dave Beusing <david.beusing@gmail.com>
+#
+#
+
+import json
+import numpy as np
+import pandas as pd
+
+from sqlalchemy import create_engine, event
+
+from fixedpoint import FixedPoint
+
+
+class Journal:
+    ''' Trade journal, one typed row per closed trade in a SQLite Database
+
+    Replaces the dict repr lines of the text log: prices and quantities are REAL, timestamps are UTC epoch ms,
+    the duration is in seconds. time, symbol and state are indexed, so reports filter and aggregate in SQL.
+    The Database runs in WAL mode, CryptoStats and reporting can read while CryptoTrader writes.
+
+    Open positions are kept in a second table until their trade is written, so a restarted CryptoTrader takes them
+    over instead of leaving them unwatched: the buy order response, the price we expected, the trailing thresholds and
+    the indicators at entry, which the report of the trade prints.
+
+    :param path -> type:str: path to sqlite3 file
+    '''
+    Indicators = [ 'ROC', 'RSI', 'ATR', 'OBV' ]
+    Columns = [ 'ts', 'opened', 'state', 'symbol', 'duration', 'ask', 'ask_qty', 'bid', 'bid_qty', 'profit', 'total_profit', *Indicators ]
+
+    def __init__( self, path ):
+        self.engine = create_engine( f'sqlite:///{path}', connect_args={ 'timeout' : 30 } )
+
+        @event.listens_for( self.engine, 'connect' )
+        def pragma( dbapi_connection, connection_record ):
+            cursor = dbapi_connection.cursor()
+            cursor.execute( 'PRAGMA journal_mode=WAL' )
+            cursor.close()
+
+        with self.engine.begin() as conn:
+            # ts: closed, opened: UTC epoch ms | duration: seconds
+            conn.exec_driver_sql( '''CREATE TABLE IF NOT EXISTS trades (
+                id INTEGER PRIMARY KEY,
+                ts INTEGER NOT NULL,
+                opened INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                duration REAL NOT NULL,
+                ask REAL NOT NULL,
+                ask_qty REAL NOT NULL,
+                bid REAL NOT NULL,
+                bid_qty REAL NOT NULL,
+                profit REAL NOT NULL,
+                total_profit REAL NOT NULL,
+                ROC REAL,
+                RSI REAL,
+                ATR REAL,
+                OBV REAL
+            )''' )
+            conn.exec_driver_sql( 'CREATE INDEX IF NOT EXISTS trades_ts ON trades ( ts )' )
+            conn.exec_driver_sql( 'CREATE INDEX IF NOT EXISTS trades_symbol ON trades ( symbol, ts )' )
+            conn.exec_driver_sql( 'CREATE INDEX IF NOT EXISTS trades_state ON trades ( state, ts )' )
+            # opened: UTC epoch ms | bid, TargetProfit, StopLoss: units of 1e-8 | response: JSON of the buy order
+            conn.exec_driver_sql( '''CREATE TABLE IF NOT EXISTS positions (
+                id INTEGER PRIMARY KEY,
+                opened INTEGER NOT NULL,
+                symbol TEXT NOT NULL,
+                bid INTEGER NOT NULL,
+                TargetProfit INTEGER,
+                StopLoss INTEGER,
+                response TEXT NOT NULL,
+                ROC REAL,
+                RSI REAL,
+                ATR REAL,
+                OBV REAL
+            )''' )
+            # positions tables of older versions lack the indicators
+            existing = { row[1] for row in conn.exec_driver_sql( 'PRAGMA table_info( positions )' ) }
+            for column in self.Indicators:
+                if column not in existing:
+                    conn.exec_driver_sql( f'ALTER TABLE positions ADD COLUMN {column} REAL' )
+
+    def indicators( asset ):
+        ''' Last value of each indicator of an asset, None if it was not applied
+        '''
+        OHLCV = asset.OHLCV
+        return [ None if OHLCV is None or column not in OHLCV else float( OHLCV[ column ].iloc[-1] ) for column in Journal.Indicators ]
+
+    def row( trade ):
+        ''' Journal row of a models.Trade
+        '''
+        return ( int( trade.closed.timestamp() * 1000 ), int( trade.ask.timestamp * 1000 ), trade.state, trade.asset.symbol, trade.duration.total_seconds(),
+            *( FixedPoint.to_float( value ) for value in ( trade.ask.price, trade.ask.qty, trade.bid.price, trade.bid.qty, trade.profit, trade.total_profit ) ), *Journal.indicators( trade.asset ) )
+
+    def add( self, *trades ):
+        ''' Write closed trades, their open positions are removed within the same transaction
+
+        :param trades -> models.Trade
+        '''
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql( f'INSERT INTO trades ( {", ".join( self.Columns )} ) VALUES ( {", ".join( "?" * len( self.Columns ) )} )', [ Journal.row( trade ) for trade in trades ] )
+            positions = [ ( trade.ask.position, ) for trade in trades if trade.ask.position is not None ]
+            if positions:
+                conn.exec_driver_sql( 'DELETE FROM positions WHERE id = ?', positions )
+
+    def open( self, order ):
+        ''' Keep an open position until its trade is written with add()
+
+        :param order -> models.Order: the buy order
+        :return int: id of the position, also set as order.position
+        '''
+        with self.engine.begin() as conn:
+            order.position = conn.exec_driver_sql( f'INSERT INTO positions ( opened, symbol, bid, response, {", ".join( self.Indicators )} ) VALUES ( ?, ?, ?, ?, ?, ?, ?, ? )',
+                ( int( order.timestamp * 1000 ), order.symbol, int( order.bid ), json.dumps( order.order ), *Journal.indicators( order.asset ) ) ).lastrowid
+        return order.position
+
+    def trail( self, order, TargetProfit, StopLoss ):
+        ''' Keep the thresholds of a position whose trailing stop moved
+        '''
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql( 'UPDATE positions SET TargetProfit = ?, StopLoss = ? WHERE id = ?', ( int( TargetProfit ), int( StopLoss ), order.position ) )
+
+    def positions( self ):
+        ''' Positions left open, oldest first
+
+        :return List( Dict ): id, opened, symbol, bid, TargetProfit, StopLoss (None if it never trailed), order (the buy order response),
+            ROC, RSI, ATR, OBV at entry (None if unknown)
+        '''
+        with self.engine.connect() as conn:
+            rows = conn.exec_driver_sql( f'SELECT id, opened, symbol, bid, TargetProfit, StopLoss, response, {", ".join( self.Indicators )} FROM positions ORDER BY id' ).mappings().all()
+        return [ { **{ key : value for key, value in row.items() if key != 'response' }, 'order' : json.loads( row[ 'response' ] ) } for row in rows ]
+
+    def where( start=None, end=None, symbol=None, since_id=None ):
+        clauses, params = [], {}
+        for clause, key, value in [ ( 'ts >= :start', 'start', start ), ( 'ts <= :end', 'end', end ), ( 'symbol = :symbol', 'symbol', symbol ), ( 'id > :since_id', 'since_id', since_id ) ]:
+            if value is not None:
+                clauses.append( clause )
+                params[ key ] = value
+        return ( f'WHERE {" AND ".join( clauses )}' if clauses else '' ), params
+
+    def trades( self, start=None, end=None, symbol=None, since_id=None, columns=None ):
+        ''' Read trades as typed columns
+
+        :param start    -> type:int: (optional) closed at or after, UTC epoch ms
+        :param end      -> type:int: (optional) closed at or before, UTC epoch ms
+        :param symbol   -> type:str: (optional)
+        :param since_id -> type:int: (optional) only trades written after the one with this id
+        :param columns  -> type:List: (optional) default all columns
+        :return DataFrame indexed by id, ts and opened as datetime64, duration as timedelta64
+        '''
+        columns = self.Columns if columns is None else list( columns )
+        where, params = Journal.where( start, end, symbol, since_id )
+        df = pd.read_sql( f'SELECT id, {", ".join( columns )} FROM trades {where} ORDER BY id', self.engine, params=params, index_col='id' )
+        for column in [ 'ts', 'opened' ]:
+            if column in df:
+                df[ column ] = pd.to_datetime( df[ column ].astype( np.int64 ), unit='ms' )
+        if 'duration' in df:
+            df[ 'duration' ] = pd.to_timedelta( df[ 'duration' ], unit='s' )
+        return df
+
+    def summary( self, start=None, end=None ):
+        ''' Totals of all trades in one query
+
+        :return Dict: trades, won, lost, won_profit, lost_profit, duration (mean, seconds), first and last ts, last id
+        '''
+        where, params = Journal.where( start, end )
+        querystr = f'''SELECT COUNT(*) AS trades,
+            COALESCE( SUM( state = 'WON' ), 0 ) AS won,
+            COALESCE( SUM( state = 'LOST' ), 0 ) AS lost,
+            COALESCE( SUM( CASE WHEN state = 'WON' THEN total_profit END ), 0.0 ) AS won_profit,
+            COALESCE( SUM( CASE WHEN state = 'LOST' THEN total_profit END ), 0.0 ) AS lost_profit,
+            AVG( duration ) AS duration,
+            MIN( ts ) AS first,
+            MAX( ts ) AS last,
+            MAX( id ) AS id
+            FROM trades {where}'''
+        with self.engine.connect() as conn:
+            return dict( conn.exec_driver_sql( querystr, params ).mappings().one() ) if params else dict( conn.exec_driver_sql( querystr ).mappings().one() )
+
+    def by_symbol( self, start=None, end=None ):
+        ''' Totals per symbol
+
+        :return DataFrame indexed by symbol
+        '''
+        where, params = Journal.where( start, end )
+        querystr = f'''SELECT symbol, COUNT(*) AS trades, SUM( state = 'WON' ) AS won, SUM( state = 'LOST' ) AS lost,
+            SUM( total_profit ) AS total_profit, SUM( ask_qty * ask ) AS turnover, AVG( duration ) AS duration
+            FROM trades {where} GROUP BY symbol ORDER BY symbol'''
+        return pd.read_sql( querystr, self.engine, params=params, index_col='symbol' )
+
+    def by_hour( self, start=None, end=None ):
+        ''' Totals per hour the trades were closed in
+
+        :return DataFrame indexed by the start of the hour
+        '''
+        where, params = Journal.where( start, end )
+        querystr = f'''SELECT ts - ts % 3600000 AS hour, COUNT(*) AS trades, SUM( state = 'WON' ) AS won, SUM( state = 'LOST' ) AS lost,
+            SUM( total_profit ) AS total_profit FROM trades {where} GROUP BY hour ORDER BY hour'''
+        df = pd.read_sql( querystr, self.engine, params=params )
+        df.hour = pd.to_datetime( df.hour, unit='ms' )
+        return df.set_index( 'hour' )
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) Dave Beusing <david.beusing@gmail.com>
+#
+#
+
+import os
+import sys
+import json
+import time
+
+
+class Histogram:
+    ''' HDR-style latency histogram of integer values (we record microseconds)
+
+    Values below 2^bits are counted exactly, above that every power of two is split into 2^(bits-1) linear buckets,
+    so every value is stored with a relative error below 2^-(bits-1) (~1.6% with the default 7 bits)
+    and recording a value is a few integer operations, without any allocation.
+
+    :param bits -> type:int: precision, 2^bits exact buckets at the bottom
+    '''
+    def __init__( self, bits=7 ):
+        self.bits = bits
+        self.half = 1 << ( bits - 1 )
+        self.counts = [ 0 ] * ( ( 64 - bits + 2 ) * self.half )
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def index( self, value ):
+        shift = value.bit_length() - self.bits
+        if shift <= 0:
+            return value
+        return shift * self.half + ( value >> shift )
+
+    def lowest( self, index ):
+        ''' Smallest value which falls into the bucket
+        '''
+        if index < 2 * self.half:
+            return index
+        shift = index // self.half - 1
+        return ( index - shift * self.half ) << shift
+
+    def record( self, value ):
+        value = int( value ) if value > 0 else 0
+        self.counts[ self.index( value ) ] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile( self, q ):
+        ''' Value at or below which q % of the samples are, reported as the upper end of its bucket
+        '''
+        if not self.count:
+            return 0
+        rank = max( 1, int( q / 100 * self.count + 0.5 ) )
+        seen = 0
+        for index, n in enumerate( self.counts ):
+            seen += n
+            if seen >= rank:
+                return min( self.lowest( index + 1 ) - 1, self.max )
+        return self.max
+
+    def stats( self ):
+        return { 'count' : self.count, 'mean' : self.total / self.count if self.count else 0, 'p50' : self.percentile( 50 ),
+            'p90' : self.percentile( 90 ), 'p99' : self.percentile( 99 ), 'p999' : self.percentile( 99.9 ), 'max' : self.max }
+
+
+class Timer:
+    ''' Context manager which records the time spent within it, see Metrics.time()
+    '''
+    __slots__ = ( 'histogram', 'start' )
+
+    def __init__( self, histogram ):
+        self.histogram = histogram
+
+    def __enter__( self ):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__( self, *exc ):
+        self.histogram.record( ( time.perf_counter_ns() - self.start ) // 1000 )
+
+
+class Metrics:
+    ''' Latency histograms per stage of one process, dumped periodically
+
+    Every interval the percentiles of all stages are appended as one JSON line to path and the histograms start over,
+    so the file is a time series of the latency per interval. All values are in microseconds.
+    Counters (reconnects, gaps, ...) are dumped and reset the same way, their value is the count within the interval.
+
+        metrics = Metrics( 'CryptoStream', '/path/to/metrics/CryptoStream.jsonl', interval=60 )
+        metrics.record( 'receive_to_commit', us )
+        with metrics.time( 'scan' ):
+            ...
+        metrics.count( 'reconnects' )
+        metrics.poll()
+
+    :param name     -> type:str: name of the process
+    :param path     -> type:str: (optional) file the stats are appended to, without it nothing is written
+    :param interval -> type:float: seconds between two dumps
+    '''
+    def __init__( self, name, path=None, interval=60 ):
+        self.name = name
+        self.path = path
+        self.interval = interval
+        self.histograms = {}
+        self.counters = {}
+        self.last = time.monotonic()
+
+    def histogram( self, stage ):
+        ''' The histogram of a stage, hot paths should fetch it once and call record() on it directly
+        '''
+        histogram = self.histograms.get( stage )
+        if histogram is None:
+            histogram = self.histograms[ stage ] = Histogram()
+        return histogram
+
+    def record( self, stage, value ):
+        self.histogram( stage ).record( value )
+
+    def time( self, stage ):
+        return Timer( self.histogram( stage ) )
+
+    def count( self, counter, n=1 ):
+        self.counters[ counter ] = self.counters.get( counter, 0 ) + n
+
+    def stats( self ):
+        return { stage : histogram.stats() for stage, histogram in self.histograms.items() if histogram.count }
+
+    def poll( self ):
+        ''' Dump if the interval has passed
+        '''
+        if time.monotonic() - self.last >= self.interval:
+            self.dump()
+
+    def dump( self ):
+        ''' Append the stats of the current interval and reset the histograms
+        '''
+        self.last = time.monotonic()
+        stats = self.stats()
+        for histogram in self.histograms.values():
+            histogram.__init__( histogram.bits )
+        counters, self.counters = self.counters, {}
+        if self.path is None or not ( stats or counters ):
+            return stats
+        os.makedirs( os.path.dirname( self.path ) or '.', exist_ok=True )
+        with open( self.path, 'a' ) as fd:
+            fd.write( json.dumps( { 'ts' : time.time(), 'process' : self.name, 'interval' : self.interval, 'stages' : stats, 'counters' : counters } ) + '\n' )
+        return stats
+
+
+def report( path ):
+    ''' Print the latest dump of a metrics file
+    '''
+    with open( path, 'r' ) as fd:
+        lines = fd.readlines()
+    if not lines:
+        return
+    record = json.loads( lines[-1] )
+    print( f'{record["process"]} {time.strftime( "%Y-%m-%d %H:%M:%S", time.localtime( record["ts"] ) )} last {record["interval"]}s, values in us' )
+    print( f'{"stage":<24}{"count":>10}{"p50":>10}{"p90":>10}{"p99":>10}{"p999":>10}{"max":>12}' )
+    for stage, s in record[ 'stages' ].items():
+        print( f'{stage:<24}{s["count"]:>10}{s["p50"]:>10}{s["p90"]:>10}{s["p99"]:>10}{s["p999"]:>10}{s["max"]:>12}' )
+    for counter, n in record.get( 'counters', {} ).items():
+        print( f'{counter:<24}{n:>10}' )
+
+
+if __name__ == '__main__':
+    # python metrics.py /path/to/metrics/CryptoStream.jsonl
+    for path in sys.argv[1:]:
+        report( path )
@@ -0,0 +1,603 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) Dave Beusing <david.beusing@gmail.com>
+#
+#
+
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import itertools
+import collections
+from types import SimpleNamespace
+
+import numpy as np
+
+from binance.helpers import date_to_milliseconds, interval_to_milliseconds
+from binance.exceptions import BinanceAPIException
+
+from tradestream import TradeStream
+
+
+'''
+Local stand-in for the Binance REST and websocket API, so CryptoStream and CryptoTrader run without network and credentials
+
+Set Exchange = 'mock' in the config (see utils.Exchange), every process then builds its own MockExchange with the same seed,
+so all of them see the same symbols and exchange info. Give the mock its own Database, MetadataCache and TickBuffer.
+
+python mockexchange.py [--rate 20000] [--seconds 30] [--symbols 300] [--ticks /path/to/ticks]
+
+load tests the ingestion of CryptoStream (decode, TickWriter, TickBuffer) at the given message rate.
+'''
+
+
+class SyntheticTicks:
+    ''' Random walk trades, a few symbols trade a lot and most of them rarely, like on the real exchange
+
+    :param symbols      -> type:List: symbol names
+    :param prices       -> ndarray: start price per symbol
+    :param volatility   -> type:float: standard deviation of the log return per trade
+    :param seed         -> type:int: (optional)
+    '''
+    def __init__( self, symbols, prices, volatility=0.0005, seed=None ):
+        self.symbols = list( symbols )
+        self.last = np.array( prices, dtype=np.float64 )
+        self.volatility = volatility
+        self.rng = np.random.default_rng( seed )
+        # zipf like activity, shuffled so the busy symbols are not always the first ones
+        activity = 1 / np.arange( 1, len( self.symbols ) + 1 )
+        self.rng.shuffle( activity )
+        self.activity = activity / activity.sum()
+
+    def batch( self, n ):
+        ''' The next n trades
+
+        :return ( codes, prices ) ndarrays
+        '''
+        codes = self.rng.choice( len( self.symbols ), size=n, p=self.activity )
+        returns = self.rng.normal( 0, self.volatility, n )
+        # every symbol walks on from its last price: cumulative returns within each symbol, in trade order
+        order = np.argsort( codes, kind='stable' )
+        grouped = codes[ order ]
+        cum = np.cumsum( returns[ order ] )
+        first = np.r_[ True, grouped[1:] != grouped[:-1] ]
+        starts = np.maximum.accumulate( np.where( first, np.arange( n ), 0 ) )
+        cum -= ( cum - returns[ order ] )[ starts ]
+        prices = np.empty( n )
+        prices[ order ] = self.last[ grouped ] * np.exp( cum )
+        last = np.r_[ grouped[1:] != grouped[:-1], True ]
+        self.last[ grouped[ last ] ] = prices[ order ][ last ]
+        return codes, prices
+
+
+class RecordedTicks:
+    ''' Replays recorded ticks in the order they happened, over and over
+
+    :param data -> backtest.TickData: e.g. TickData.load( path ) of ticks saved by the optimizer or TickData.save()
+    '''
+    def __init__( self, data ):
+        self.symbols = list( data.symbols )
+        order = np.argsort( np.asarray( data.times ), kind='stable' )
+        self.codes = np.asarray( data.codes )[ order ]
+        self.prices = np.asarray( data.prices )[ order ]
+        self.position = 0
+        self.last = np.zeros( len( self.symbols ) )
+        # start prices, so the REST endpoints know every symbol before it traded
+        self.last[ self.codes[ ::-1 ] ] = self.prices[ ::-1 ]
+
+    def batch( self, n ):
+        idx = ( self.position + np.arange( n ) ) % len( self.codes )
+        self.position = ( self.position + n ) % len( self.codes )
+        codes, prices = self.codes[ idx ], self.prices[ idx ]
+        self.last[ codes ] = prices
+        return codes, prices
+
+
+class MockExchange:
+    ''' The state of the exchange: symbols, prices, the trade stream, balances and orders
+
+    Trades are produced on a fixed schedule of rate messages per second. Each one is stamped with the time it was due,
+    not the time it was generated, so a consumer which falls behind shows up in shard<n>_lag like on the real stream.
+    Requests are charged their weight like on Binance, above 1200 per minute they fail with 429 and Retry-After.
+
+    :param symbols      -> type:int: number of synthetic symbols, ignored if source is given
+    :param rate         -> type:float: trade messages per second over all symbols
+    :param source       -> SyntheticTicks | RecordedTicks: (optional) default synthetic ticks
+    :param latency      -> type:float: seconds every REST call takes
+    :param errors       -> type:float: share of REST calls which fail with a transient 503
+    :param drops        -> type:float: share of trade messages after which a random websocket connection drops
+    :param balance      -> type:float: USDT of the account
+    :param seed         -> type:int: same seed, same symbols and start prices
+    '''
+    QUOTE = 'USDT'
+    FEE = 0.001
+    LIMIT = 1200
+    # the most trades produced at once, a consumer far behind catches up in steps of this
+    BURST = 10000
+
+    def from_Config( config ):
+        ''' Build from the Mock* settings of the config
+        '''
+        source = None
+        if getattr( config, 'MockTicks', None ):
+            from backtest import TickData
+            source = RecordedTicks( TickData.load( config.MockTicks ) )
+        return MockExchange( getattr( config, 'MockSymbols', 300 ), getattr( config, 'MockRate', 1000 ), source=source,
+            latency=getattr( config, 'MockLatency', 0.0 ), drops=getattr( config, 'MockDrops', 0.0 ), seed=getattr( config, 'MockSeed', 1 ) )
+
+    def __init__( self, symbols=300, rate=1000, source=None, latency=0.0, errors=0.0, drops=0.0, balance=1000.0, seed=1 ):
+        self.rng = random.Random( seed )
+        if source is None:
+            names = MockExchange.names( symbols, seed )
+            prices = np.exp( np.random.default_rng( seed ).uniform( np.log( 0.01 ), np.log( 50000 ), len( names ) ) )
+            source = SyntheticTicks( names, prices, seed=seed )
+        self.source = source
+        self.symbols = source.symbols
+        self.index = { symbol : i for i, symbol in enumerate( self.symbols ) }
+        self.rate = rate
+        self.latency = latency
+        self.errors = errors
+        self.drops = drops
+        # exchange filters derived from the price, 5 significant digits and 1 USDT worth of lot size
+        self.tickSize = np.array( [ MockExchange.step( price / 1e4 ) for price in source.last ] )
+        self.stepSize = np.array( [ MockExchange.step( 1 / price ) for price in source.last ] )
+        self.ids = np.zeros( len( self.symbols ), dtype=np.int64 )
+        self.info = None
+        self.balances = collections.defaultdict( float, { self.QUOTE : balance } )
+        self.orders = {}
+        self.order_id = itertools.count( 1 )
+        self.weights = collections.deque()
+        self.used = 0
+        self.sockets = []
+        self.epoch = time.time()
+        self.start = time.monotonic()
+        self.sent = 0
+
+    def names( n, seed ):
+        ''' n distinct symbol names like XKQUSDT, none of them looks like a leveraged token
+        '''
+        rng = random.Random( seed )
+        names = set()
+        while len( names ) < n:
+            base = ''.join( rng.choice( 'ABCDEFGHIJKLMNOPQRSTUVWXYZ' ) for _ in range( rng.randint( 3, 5 ) ) )
+            if all( excluded not in base for excluded in [ 'UP', 'DOWN', 'BEAR', 'BULL' ] ):
+                names.add( base + MockExchange.QUOTE )
+        return sorted( names )
+
+    def step( value ):
+        ''' Largest power of ten at or below value, within the 8 decimals of the exchange
+        '''
+        return 10.0 ** max( -8, int( np.floor( np.log10( value ) ) ) )
+
+    def price( self, symbol ):
+        return float( self.source.last[ self.index[ symbol ] ] )
+
+    def client( self ):
+        return MockClient( self )
+
+    def async_client( self ):
+        return MockAsyncClient( self )
+
+    def socket_manager( self, client ):
+        return MockSocketManager( self )
+
+    ''' Trade stream '''
+
+    def advance( self ):
+        ''' Produce all trades which are due by now and hand them to the open sockets
+        '''
+        due = min( int( ( time.monotonic() - self.start ) * self.rate ) - self.sent, self.BURST )
+        if due <= 0:
+            return 0
+        codes, prices = self.source.batch( due )
+        # event time is when the trade was due, the trade happened a few ms earlier
+        times = ( self.epoch + ( self.sent + np.arange( due ) ) / self.rate ) * 1000
+        self.sent += due
+        sockets = [ ( socket.queue, socket.codes, socket.multiplex ) for socket in self.sockets ]
+        symbols, ticks, steps, ids = self.symbols, self.tickSize, self.stepSize, self.ids
+        for code, price, event in zip( codes.tolist(), prices.tolist(), times.astype( np.int64 ).tolist() ):
+            ids[ code ] += 1
+            tick = ticks[ code ]
+            symbol = symbols[ code ]
+            data = ( f'{{"e":"trade","E":{event},"s":"{symbol}","t":{ids[ code ]},"p":"{round( price / tick ) * tick:.8f}",'
+                f'"q":"{max( 1, round( self.rng.expovariate( 1 / 50 ) / price / steps[ code ] ) ) * steps[ code ]:.8f}","b":{2 * ids[ code ]},"a":{2 * ids[ code ] + 1},'
+                f'"T":{event - self.rng.randint( 0, 5 )},"m":{"true" if self.rng.random() < 0.5 else "false"},"M":true}}' )
+            for queue, subscribed, multiplex in sockets:
+                if subscribed is None or code in subscribed:
+                    queue.append( f'{{"stream":"{symbol.lower()}@trade","data":{data}}}' if multiplex else data )
+        if self.drops and self.sockets and self.rng.random() < due * self.drops:
+            self.drop()
+        return due
+
+    def drop( self, socket=None ):
+        ''' Close a websocket connection, default a random one, the trades until it is reopened are lost
+        '''
+        socket = self.rng.choice( self.sockets ) if socket is None else socket
+        socket.closed = True
+        socket.queue.clear()
+        self.sockets.remove( socket )
+
+    def wait( self ):
+        ''' Seconds until the next trade is due
+        '''
+        return max( 0.0, ( self.sent + 1 ) / self.rate - ( time.monotonic() - self.start ) )
+
+    ''' REST '''
+
+    def charge( self, name, weight ):
+        ''' Account the weight of a request, fail like Binance does above the limit or at random
+        '''
+        now = time.monotonic()
+        while self.weights and self.weights[0][0] <= now - 60:
+            self.used -= self.weights.popleft()[1]
+        if self.used + weight > self.LIMIT:
+            retry = int( self.weights[0][0] + 60 - now ) + 1
+            raise MockExchange.error( 429, -1003, f'Too much request weight used; current limit is {self.LIMIT} request weight per 1 MINUTE.', { 'Retry-After' : str( retry ) } )
+        self.weights.append( ( now, weight ) )
+        self.used += weight
+        if self.errors and self.rng.random() < self.errors:
+            raise MockExchange.error( 503, -1001, 'Internal error; unable to process your request. Please try again.' )
+
+    def error( status, code, message, headers=None ):
+        text = json.dumps( { 'code' : code, 'msg' : message } )
+        return BinanceAPIException( SimpleNamespace( status_code=status, text=text, headers=headers or {} ), status, text )
+
+    def request( self, name, *args, **kwargs ):
+        from utils import RequestScheduler
+        self.charge( name, RequestScheduler.WEIGHTS.get( name, 1 ) )
+        return getattr( self, name )( *args, **kwargs )
+
+    def headers( self ):
+        return { 'x-mbx-used-weight-1m' : str( self.used ) }
+
+    def symbol_info( self, symbol ):
+        i = self.index[ symbol ]
+        return {
+            'symbol' : symbol, 'status' : 'TRADING', 'baseAsset' : symbol[ :-len( self.QUOTE ) ], 'baseAssetPrecision' : 8,
+            'quoteAsset' : self.QUOTE, 'quotePrecision' : 8, 'quoteAssetPrecision' : 8, 'baseCommissionPrecision' : 8, 'quoteCommissionPrecision' : 8,
+            'orderTypes' : [ 'LIMIT', 'LIMIT_MAKER', 'MARKET' ], 'icebergAllowed' : True, 'ocoAllowed' : True, 'quoteOrderQtyMarketAllowed' : True,
+            'isSpotTradingAllowed' : True, 'isMarginTradingAllowed' : False,
+            'filters' : [
+                { 'filterType' : 'PRICE_FILTER', 'minPrice' : f'{self.tickSize[i]:.8f}', 'maxPrice' : '1000000.00000000', 'tickSize' : f'{self.tickSize[i]:.8f}' },
+                { 'filterType' : 'LOT_SIZE', 'minQty' : f'{self.stepSize[i]:.8f}', 'maxQty' : '9000000.00000000', 'stepSize' : f'{self.stepSize[i]:.8f}' },
+                { 'filterType' : 'MIN_NOTIONAL', 'minNotional' : '10.00000000', 'applyToMarket' : True, 'avgPriceMins' : 5 },
+                { 'filterType' : 'MARKET_LOT_SIZE', 'minQty' : '0.00000000', 'maxQty' : '1000000.00000000', 'stepSize' : '0.00000000' },
+            ],
+            'permissions' : [ 'SPOT' ],
+        }
+
+    def get_exchange_info( self ):
+        if self.info is None:
+            self.info = { 'timezone' : 'UTC', 'serverTime' : int( time.time() * 1000 ),
+                'rateLimits' : [ { 'rateLimitType' : 'REQUEST_WEIGHT', 'interval' : 'MINUTE', 'intervalNum' : 1, 'limit' : self.LIMIT } ],
+                'exchangeFilters' : [], 'symbols' : [ self.symbol_info( symbol ) for symbol in self.symbols ] }
+        return self.info
+
+    def get_symbol_info( self, symbol ):
+        return self.symbol_info( symbol ) if symbol in self.index else None
+
+    def get_server_time( self ):
+        return { 'serverTime' : int( time.time() * 1000 ) }
+
+    def get_symbol_ticker( self, symbol=None ):
+        if symbol is None:
+            return [ { 'symbol' : s, 'price' : f'{self.price( s ):.8f}' } for s in self.symbols ]
+        if symbol not in self.index:
+            raise MockExchange.error( 400, -1121, 'Invalid symbol.' )
+        return { 'symbol' : symbol, 'price' : f'{self.price( symbol ):.8f}' }
+
+    def get_klines( self, symbol, interval, limit=500, startTime=None, endTime=None ):
+        ''' Random walk candles which end at the current price, so indicators have something to work with
+        '''
+        if symbol not in self.index:
+            raise MockExchange.error( 400, -1121, 'Invalid symbol.' )
+        step = interval_to_milliseconds( interval )
+        now = int( time.time() * 1000 )
+        end = min( now if endTime is None else endTime, now )
+        last = end - end % step
+        first = last - ( limit - 1 ) * step if startTime is None else max( startTime + ( -startTime ) % step, last - ( limit - 1 ) * step )
+        opens = np.arange( first, last + 1, step, dtype=np.int64 )
+        n = len( opens )
+        if n == 0:
+            return []
+        rng = np.random.default_rng( [ self.index[ symbol ], int( first // step ) ] )
+        volatility = self.source.volatility * 20 if hasattr( self.source, 'volatility' ) else 0.01
+        # walk back from the current price
+        closes = self.price( symbol ) * np.exp( -np.r_[ np.cumsum( rng.normal( 0, volatility, n - 1 )[ ::-1 ] )[ ::-1 ], 0 ] )
+        opens_ = np.r_[ closes[0] * np.exp( rng.normal( 0, volatility ) ), closes[ :-1 ] ]
+        highs = np.maximum( opens_, closes ) * np.exp( np.abs( rng.normal( 0, volatility / 2, n ) ) )
+        lows = np.minimum( opens_, closes ) * np.exp( -np.abs( rng.normal( 0, volatility / 2, n ) ) )
+        volumes = rng.exponential( 5000, n ) / closes
+        trades = rng.integers( 10, 1000, n )
+        return [ [ int( t ), f'{o:.8f}', f'{h:.8f}', f'{l:.8f}', f'{c:.8f}', f'{v:.8f}', int( t + step - 1 ), f'{v * c:.8f}', int( k ), f'{v / 2:.8f}', f'{v * c / 2:.8f}', '0' ]
+            for t, o, h, l, c, v, k in zip( opens, opens_, highs, lows, closes, volumes, trades ) ]
+
+    def get_historical_klines( self, symbol, interval, start_str=None, end_str=None, limit=1000, **params ):
+        start = start_str if start_str is None or isinstance( start_str, int ) else date_to_milliseconds( start_str )
+        end = end_str if end_str is None or isinstance( end_str, int ) else date_to_milliseconds( end_str )
+        return self.get_klines( symbol, interval, limit=limit, startTime=start, endTime=end )
+
+    def get_order_book( self, symbol, limit=100 ):
+        ''' Levels one tick apart around the current price, the quantity grows with the distance
+        '''
+        if symbol not in self.index:
+            raise MockExchange.error( 400, -1121, 'Invalid symbol.' )
+        i = self.index[ symbol ]
+        tick, price = self.tickSize[ i ], self.price( symbol )
+        bid = np.floor( price / tick ) * tick
+        rng = np.random.default_rng( [ i, self.sent ] )
+        levels = np.arange( limit )
+        qty = rng.exponential( 200, limit ) * ( 1 + levels / 10 ) / price
+        return { 'lastUpdateId' : int( self.ids[ i ] ),
+            'bids' : [ [ f'{bid - l * tick:.8f}', f'{q:.8f}' ] for l, q in zip( levels, qty ) if bid - l * tick > 0 ],
+            'asks' : [ [ f'{bid + ( l + 1 ) * tick:.8f}', f'{q:.8f}' ] for l, q in zip( levels, qty[ ::-1 ] ) ] }
+
+    def get_account( self ):
+        return { 'makerCommission' : 10, 'takerCommission' : 10, 'canTrade' : True, 'accountType' : 'SPOT', 'updateTime' : int( time.time() * 1000 ),
+            'balances' : [ { 'asset' : asset, 'free' : f'{free:.8f}', 'locked' : '0.00000000' } for asset, free in self.balances.items() ], 'permissions' : [ 'SPOT' ] }
+
+    def get_asset_balance( self, asset ):
+        return { 'asset' : asset, 'free' : f'{self.balances[ asset ]:.8f}', 'locked' : '0.00000000' }
+
+    def create_order( self, symbol, side, type='MARKET', quantity=None, quoteOrderQty=None, **params ):
+        ''' MARKET orders fill at once at the current price, the commission is paid in the asset we receive
+        '''
+        if symbol not in self.index:
+            raise MockExchange.error( 400, -1121, 'Invalid symbol.' )
+        if type != 'MARKET':
+            raise MockExchange.error( 400, -1116, 'Invalid orderType.' )
+        i = self.index[ symbol ]
+        base, price, step = symbol[ :-len( self.QUOTE ) ], self.price( symbol ), self.stepSize[ i ]
+        qty = float( quantity ) if quantity is not None else float( quoteOrderQty ) / price
+        qty = np.floor( qty / step + 1e-9 ) * step
+        if qty < step:
+            raise MockExchange.error( 400, -1013, 'Filter failure: LOT_SIZE' )
+        quote = qty * price
+        if side == 'BUY':
+            if self.balances[ self.QUOTE ] < quote:
+                raise MockExchange.error( 400, -2010, 'Account has insufficient balance for requested action.' )
+            commission, commissionAsset = qty * self.FEE, base
+            self.balances[ self.QUOTE ] -= quote
+            self.balances[ base ] += qty - commission
+        else:
+            if self.balances[ base ] < qty - 1e-12:
+                raise MockExchange.error( 400, -2010, 'Account has insufficient balance for requested action.' )
+            commission, commissionAsset = quote * self.FEE, self.QUOTE
+            self.balances[ base ] -= qty
+            self.balances[ self.QUOTE ] += quote - commission
+        self.ids[ i ] += 1
+        order = { 'symbol' : symbol, 'orderId' : next( self.order_id ), 'orderListId' : -1, 'clientOrderId' : params.get( 'newClientOrderId', f'mock{len( self.orders )}' ),
+            'transactTime' : int( time.time() * 1000 ), 'price' : '0.00000000', 'origQty' : f'{qty:.8f}', 'executedQty' : f'{qty:.8f}',
+            'cummulativeQuoteQty' : f'{quote:.8f}', 'status' : 'FILLED', 'timeInForce' : 'GTC', 'type' : type, 'side' : side,
+            'fills' : [ { 'price' : f'{price:.8f}', 'qty' : f'{qty:.8f}', 'commission' : f'{commission:.8f}', 'commissionAsset' : commissionAsset, 'tradeId' : int( self.ids[ i ] ) } ] }
+        self.orders[ order[ 'orderId' ] ] = order
+        return order
+
+    def get_order( self, symbol, orderId=None, **params ):
+        if orderId not in self.orders:
+            raise MockExchange.error( 400, -2013, 'Order does not exist.' )
+        return self.orders[ orderId ]
+
+
+class MockClient:
+    ''' Drop-in for binance.Client, the endpoints we use are served by a MockExchange
+    '''
+    def __init__( self, exchange ):
+        self.exchange = exchange
+        self.response = None
+        self.timestamp_offset = 0
+
+    def request( self, name, *args, **kwargs ):
+        if self.exchange.latency:
+            time.sleep( self.exchange.latency )
+        try:
+            return self.exchange.request( name, *args, **kwargs )
+        finally:
+            self.response = SimpleNamespace( headers=self.exchange.headers() )
+
+    def get_exchange_info( self ):
+        return self.request( 'get_exchange_info' )
+
+    def get_symbol_info( self, symbol ):
+        return self.request( 'get_symbol_info', symbol )
+
+    def get_server_time( self ):
+        return self.request( 'get_server_time' )
+
+    def get_symbol_ticker( self, **params ):
+        return self.request( 'get_symbol_ticker', **params )
+
+    def get_klines( self, **params ):
+        return self.request( 'get_klines', **params )
+
+    def get_historical_klines( self, symbol, interval, start_str=None, end_str=None, limit=1000, **params ):
+        return self.request( 'get_historical_klines', symbol, interval, start_str, end_str, limit )
+
+    def get_order_book( self, **params ):
+        return self.request( 'get_order_book', **params )
+
+    def get_account( self, **params ):
+        return self.request( 'get_account' )
+
+    def get_asset_balance( self, asset, **params ):
+        return self.request( 'get_asset_balance', asset )
+
+    def create_order( self, **params ):
+        return self.request( 'create_order', **params )
+
+    def get_order( self, **params ):
+        return self.request( 'get_order', **params )
+
+
+class MockAsyncClient:
+    ''' Drop-in for binance.AsyncClient
+    '''
+    def __init__( self, exchange ):
+        self.exchange = exchange
+        self.response = None
+        self.timestamp_offset = 0
+
+    async def create( exchange ):
+        return MockAsyncClient( exchange )
+
+    async def request( self, name, *args, **kwargs ):
+        if self.exchange.latency:
+            await asyncio.sleep( self.exchange.latency )
+        try:
+            return self.exchange.request( name, *args, **kwargs )
+        finally:
+            self.response = SimpleNamespace( headers=self.exchange.headers() )
+
+    async def get_exchange_info( self ):
+        return await self.request( 'get_exchange_info' )
+
+    async def get_symbol_info( self, symbol ):
+        return await self.request( 'get_symbol_info', symbol )
+
+    async def get_server_time( self ):
+        return await self.request( 'get_server_time' )
+
+    async def get_symbol_ticker( self, **params ):
+        return await self.request( 'get_symbol_ticker', **params )
+
+    async def get_klines( self, **params ):
+        return await self.request( 'get_klines', **params )
+
+    async def get_historical_klines( self, symbol, interval, start_str=None, end_str=None, limit=1000, **params ):
+        return await self.request( 'get_historical_klines', symbol, interval, start_str, end_str, limit )
+
+    async def get_order_book( self, **params ):
+        return await self.request( 'get_order_book', **params )
+
+    async def get_account( self, **params ):
+        return await self.request( 'get_account' )
+
+    async def get_asset_balance( self, asset, **params ):
+        return await self.request( 'get_asset_balance', asset )
+
+    async def create_order( self, **params ):
+        return await self.request( 'create_order', **params )
+
+    async def get_order( self, **params ):
+        return await self.request( 'get_order', **params )
+
+    async def close_connection( self ):
+        pass
+
+
+class MockSocket:
+    ''' Trade stream of some or all symbols, used like the sockets of binance.BinanceSocketManager
+
+        async with bsm.multiplex_socket( [ 'btcusdt@trade' ] ) as socket:
+            msg = await socket.recv()
+
+    Messages are queued as JSON text and decoded in recv(), like the real client does.
+    '''
+    def __init__( self, exchange, streams, multiplex=True ):
+        self.exchange = exchange
+        self.multiplex = multiplex
+        symbols = { stream.split( '@' )[0].upper() for stream in streams if stream.endswith( '@trade' ) }
+        # the stream of all symbols skips the lookup per message
+        self.codes = None if symbols >= set( exchange.symbols ) else { exchange.index[ symbol ] for symbol in symbols if symbol in exchange.index }
+        self.queue = collections.deque()
+        self.closed = False
+
+    async def __aenter__( self ):
+        self.exchange.sockets.append( self )
+        return self
+
+    async def __aexit__( self, *exc ):
+        if not self.closed:
+            self.exchange.sockets.remove( self )
+
+    async def recv( self ):
+        while not self.queue:
+            if self.closed:
+                # what python-binance hands out once the connection is gone
+                return { 'e' : 'error', 'type' : 'BinanceWebsocketClosed', 'm' : 'Connection closed. Reconnecting...' }
+            if not self.exchange.advance():
+                await asyncio.sleep( self.exchange.wait() )
+        return json.loads( self.queue.popleft() )
+
+
+class MockSocketManager:
+    ''' Drop-in for binance.BinanceSocketManager
+    '''
+    def __init__( self, exchange ):
+        self.exchange = exchange
+
+    def multiplex_socket( self, streams ):
+        return MockSocket( self.exchange, streams, multiplex=True )
+
+    def trade_socket( self, symbol ):
+        return MockSocket( self.exchange, [ f'{symbol.lower()}@trade' ], multiplex=False )
+
+    def depth_socket( self, symbol, depth=None, interval=None ):
+        # the mock has no depth events, the books come from get_order_book() snapshots only
+        return MockSocket( self.exchange, [ f'{symbol.lower()}@depth' ], multiplex=False )
+
+
+async def loadtest( exchange, seconds, writer, ticks=None, metrics=None, shard=200, size=10000 ):
+    ''' Drive the ingestion of CryptoStream (tradestream.TradeStream) with the trade stream of exchange for seconds
+
+    :return Dict: messages produced and consumed, the backlog left, the achieved rate and the stats per shard
+    '''
+    bsm = exchange.socket_manager( None )
+    streams = [ symbol.lower() + '@trade' for symbol in exchange.symbols ]
+    stream = TradeStream( streams, writer, ticks, metrics, shard=shard, size=size )
+    start = time.monotonic()
+    task = asyncio.ensure_future( stream.run( bsm ) )
+    await asyncio.wait( [ task ], timeout=seconds )
+    task.cancel()
+    elapsed = time.monotonic() - start
+    shards = stream.stats()
+    queued = sum( shard[ 'queue' ] for shard in shards )
+    consumed = sum( shard[ 'received' ] for shard in shards ) - queued
+    backlog = queued + sum( len( socket.queue ) for socket in exchange.sockets ) + max( 0, int( ( time.monotonic() - exchange.start ) * exchange.rate ) - exchange.sent )
+    stream.close()
+    return { 'rate' : exchange.rate, 'seconds' : elapsed, 'produced' : exchange.sent, 'consumed' : consumed, 'backlog' : backlog, 'throughput' : consumed / elapsed, 'shards' : shards }
+
+
+if __name__ == '__main__':
+    from utils import TickWriter, connectDB
+    from tickbuffer import TickBuffer
+    from metrics import Metrics
+
+    parser = argparse.ArgumentParser( description='Load test the ingestion of CryptoStream against the mock exchange' )
+    parser.add_argument( '--rate', type=float, default=10000, help='trade messages per second' )
+    parser.add_argument( '--seconds', type=float, default=30 )
+    parser.add_argument( '--symbols', type=int, default=300 )
+    parser.add_argument( '--ticks', help='replay the ticks saved with TickData.save() in this directory instead of synthetic ones' )
+    parser.add_argument( '--database', default='/tmp/CryptoTrader.loadtest.sqlite3' )
+    parser.add_argument( '--buffer', default='/dev/shm/CryptoTrader.loadtest.ticks' )
+    parser.add_argument( '--batch', type=int, default=500 )
+    parser.add_argument( '--shard', type=int, default=200, help='streams per connection' )
+    parser.add_argument( '--drops', type=float, default=0.0, help='share of trade messages after which a connection drops' )
+    args = parser.parse_args()
+
+    source = None
+    if args.ticks:
+        from backtest import TickData
+        source = RecordedTicks( TickData.load( args.ticks ) )
+    exchange = MockExchange( args.symbols, args.rate, source=source, drops=args.drops )
+    for path in [ args.database, args.buffer ]:
+        if os.path.isfile( path ):
+            os.remove( path )
+    metrics = Metrics( 'loadtest' )
+    writer = TickWriter( connectDB( args.database ), size=args.batch, metrics=metrics )
+    ticks = TickBuffer( args.buffer, symbols=exchange.symbols )
+    result = asyncio.run( loadtest( exchange, args.seconds, writer, ticks, metrics, shard=args.shard ) )
+
+    print( f'###_Loadtest_###' )
+    print( f'Rate: {result["rate"]:.0f}/s Produced: {result["produced"]} Consumed: {result["consumed"]} Backlog: {result["backlog"]}' )
+    print( f'Throughput: {result["throughput"]:.0f}/s over {result["seconds"]:.1f}s' )
+    # latencies in us, queue depths in messages
+    for stage, s in metrics.stats().items():
+        print( f'{stage:<24} p50 {s["p50"]:>10} p99 {s["p99"]:>10} max {s["max"]:>10}' )
+    for i, s in enumerate( result[ 'shards' ] ):
+        print( f'shard{i:<19} streams {s["streams"]} received {s["received"]} gaps {s["gaps"]} missed {s["missed"]} duplicates {s["duplicates"]} reconnects {s["reconnects"]}' )
+    print( f'##############', flush=True )
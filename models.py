@@ -5,12 +5,11 @@
 #
 #
 
-from math import floor
-
 from binance import Client
-from decimal import Decimal, ROUND_DOWN
 
-from utils import fetch_OHLCV, applyIndicators
+from fixedpoint import FixedPoint
+from utils import ExchangeInfo, RequestScheduler, fetch_OHLCV, fetch_OHLCV_async, queryKlines, applyIndicators
+from indicators import IndicatorEngine
 
 import numpy as np
 import pandas as pd
@@ -19,54 +18,95 @@ import datetime as dt
 
 class Asset:
 
-    def __init__( self, client, symbol, OHLCV=None, Indicators=None ):
+    def __init__( self, client, symbol, OHLCV=None, Indicators=None, engine=None ):
         
         self.binance = client
         self.symbol = symbol
         self.OHLCV = None
+        # Database of CryptoStream, klines are loaded from there if available
+        self.engine = engine
+        # orderbook.OrderBook, only set if CryptoTrader follows the depth of the symbol
+        self.book = None
 
         self.fetchMetadata()
 
         if OHLCV is not None:
             self.fetchOHLCV()
 
+        # Indicators: True for all of them or a List of indicator names, see utils.Indicators
         if OHLCV and Indicators is not None:    
-            self.applyOHLCVindicators()
+            self.applyOHLCVindicators( None if Indicators is True else Indicators )
 
 
     def fetchOHLCV(self):
+        # klines built locally by CryptoStream, REST is only the fallback if the local history is missing
+        if self.engine is not None:
+            self.OHLCV = queryKlines( self.engine, self.symbol, 60 )
+            if self.OHLCV is not None:
+                return
         self.OHLCV = fetch_OHLCV( self.binance, self.symbol, interval='1m', start_date='60 minutes ago UTC' )
 
 
-    def applyOHLCVindicators(self):
-        applyIndicators( self.OHLCV )
+    async def fetchOHLCV_async( self, client ):
+        ''' Same as fetchOHLCV(), the REST fallback runs on the given binance.AsyncClient
+        '''
+        if self.engine is not None:
+            self.OHLCV = queryKlines( self.engine, self.symbol, 60 )
+            if self.OHLCV is not None:
+                return
+        self.OHLCV = await fetch_OHLCV_async( client, self.symbol, interval='1m', start_date='60 minutes ago UTC' )
+
+
+    def applyOHLCVindicators( self, indicators=None ):
+        applyIndicators( self.OHLCV, indicators )
+
+
+    def streamIndicators( self ):
+        ''' Return an IndicatorEngine warmed up with our OHLCV, feed it with tick() to keep the indicators current
+        '''
+        if self.OHLCV is None:
+            self.fetchOHLCV()
+        engine = IndicatorEngine( self.symbol )
+        engine.load( self.OHLCV )
+        return engine
 
 
     def calculateQTY( self, amount, price=None ):
+        ''' Quantity worth amount of the quote asset, floored to the LOT_SIZE stepSize
+
+        :param amount   -> type:float: e.g. Config.Investment
+        :param price    -> type:int: (optional) in units, see fixedpoint.FixedPoint, default the recent price
+        :return int: quantity in units
+        '''
         if not price:
-            price = price
-        else:
             price = self.getRecentPrice()
-        return Decimal( floor( Decimal(amount) / ( Decimal( price ) * self.minQTY ) ) *  self.minQTY  )
+        return self.fixed.quantity( amount, price )
 
 
     def getRecentPrice( self ):
-        #TODO catch Exceptions
-        return Decimal( self.binance.get_symbol_ticker( symbol=self.symbol )['price'] )
+        ''' :return int: last price in units
+        '''
+        return FixedPoint.parse( RequestScheduler.get().call( self.binance.get_symbol_ticker, symbol=self.symbol )['price'] )
 
 
     def fetchMetadata( self ):
         #TODO catch Exceptions
-        data = self.binance.get_symbol_info( self.symbol )
+        # served from the local exchange info cache, no HTTP round trip per Asset
+        info = ExchangeInfo.get( self.binance )
+        data = info.symbol( self.symbol )
+        lotsize = info.filter( self.symbol, 'LOT_SIZE' )
         self.base = data['baseAsset']
         self.precision = int( data['baseAssetPrecision'] )
         self.quote = data['quoteAsset']
         self.quotePrecision = int( data['quoteAssetPrecision'] )
         self.isSpot = data['isSpotTradingAllowed']
         self.isMargin = data['isMarginTradingAllowed']
-        self.minQTY = Decimal( data['filters'][2]['minQty'] )
-        self.maxQTY = Decimal( data['filters'][2]['maxQty'] )
-        self.step = Decimal( data['filters'][2]['stepSize'] )
+        # prices and quantities are integers of 1e-8, see fixedpoint.FixedPoint
+        self.fixed = FixedPoint( info.filter( self.symbol, 'PRICE_FILTER' )['tickSize'], lotsize['stepSize'] )
+        self.minQTY = FixedPoint.parse( lotsize['minQty'] )
+        self.maxQTY = FixedPoint.parse( lotsize['maxQty'] )
+        self.step = self.fixed.step
+        self.tick = self.fixed.tick
         '''
         {'symbol': 'LRCUSDT',
         'status': 'TRADING',
@@ -119,14 +159,23 @@ class Order:
     BUY = 'BUY'
     SELL = 'SELL'
 
-    def __init__( self, client, asset, side, quantity, price ):
+    ''' A MARKET order, prices and quantities are integers of 1e-8, see fixedpoint.FixedPoint
+
+    :param client   -> binance.Client
+    :param asset    -> Asset
+    :param side     -> type:str: Order.BUY | Order.SELL
+    :param quantity -> type:int: in units, on the stepSize grid
+    :param price    -> type:int: in units, the price we expect
+    :param order    -> type:dict: (optional) response of an order placed before, e.g. of a restored position, nothing is placed
+    '''
+    def __init__( self, client, asset, side, quantity, price, order=None ):
         self.binance = client
         self.asset = asset
         self.symbol = asset.symbol
         self.side = side
         self.qty = quantity
-        self.bid = Decimal(price)
-        #self.order = client.create_order( symbol=self.symbol, side=self.side, type='MARKET', quantity=self.qty )
+        self.bid = price
+        #self.order = RequestScheduler.get().call( client.create_order, symbol=self.symbol, side=self.side, type='MARKET', quantity=FixedPoint.format( self.qty ) )
         #self.order = {'symbol': 'LRCUSDT', 'orderId': 366051943, 'orderListId': -1, 'clientOrderId': 'W96WjbdkTqPgB0yGAd5jtS', 'transactTime': 1635869565122, 'price': '0.00000000', 'origQty': '61.00000000', 'executedQty': '61.00000000', 'cummulativeQuoteQty': '100.36770000', 'status': 'FILLED', 'timeInForce': 'GTC', 'type': 'MARKET', 'side': 'BUY', 'fills': [{'price': '1.64530000', 'qty': '39.00000000', 'commission': '0.03900000', 'commissionAsset': 'LRC', 'tradeId': 23543885}, {'price': '1.64550000', 'qty': '22.00000000', 'commission': '0.02200000', 'commissionAsset': 'LRC', 'tradeId': 23543886}]}
         '''
         {'symbol': 'LRCUSDT', 'orderId': 366051943, 'orderListId': -1, 'clientOrderId': 'W96WjbdkTqPgB0yGAd5jtS', 'transactTime': 1635869565122, 
@@ -135,20 +184,17 @@ class Order:
             {'price': '1.64530000', 'qty': '39.00000000', 'commission': '0.03900000', 'commissionAsset': 'LRC', 'tradeId': 23543885}, 
             {'price': '1.64550000', 'qty': '22.00000000', 'commission': '0.02200000', 'commissionAsset': 'LRC', 'tradeId': 23543886}]}
         '''
-        self.order = self.pseudoOrder( self.side, self.symbol, self.qty, self.bid, self.asset.precision )
-
-        order_prices = []
-        order_fees = []
-        for val in self.order['fills']:
-            order_prices.append( Decimal( val['price'] ) )
-            order_fees.append( Decimal( val['commission']) )
-
-        self.price = Decimal( max( order_prices) ).quantize(Decimal('.00000001'), rounding=ROUND_DOWN)
-        self.qty = Decimal( self.order['executedQty'] )
-        self.commission = Decimal( np.sum( order_fees ) )
-        self.slippage = Decimal( self.price - self.bid )
+        self.order = self.pseudoOrder( self.side, self.symbol, self.qty, self.bid, self.asset.precision ) if order is None else order
+
+        fills = self.order['fills']
+        self.price = max( FixedPoint.parse( val['price'] ) for val in fills )
+        self.qty = FixedPoint.parse( self.order['executedQty'] )
+        self.commission = sum( FixedPoint.parse( val['commission'] ) for val in fills )
+        self.slippage = self.price - self.bid
         self.id = self.order['orderId']
         self.timestamp = dt.datetime.now().timestamp()
+        # id of the open position in the journal, see Journal.open()
+        self.position = None
 
         self.TP = None
         self.TTP = None
@@ -177,13 +223,16 @@ class Order:
     def pseudoOrder( self, side, symbol, qty, price, precision ):
 
         #'origQty': '12.30000000' '0.00020000' '0.01210000'
-        origQTY = qty
-        quoteQTY = Decimal( qty*price )
-        halfedQTY = Decimal( origQTY/2 )
-        batch1QTY = Decimal( halfedQTY + (halfedQTY/2) )
-        batch1Fee = Decimal( round( ( batch1QTY / 100 ) * Decimal(0.1), precision ) )
-        batch2QTY = Decimal( halfedQTY/2 )
-        batch2Fee = Decimal( round( ( batch2QTY / 100 ) * Decimal(0.1), precision ) )
+        # filled in two batches of 3/4 and 1/4, 0.1% commission each, as strings like the API returns them
+        batch1QTY = qty * 3 // 4
+        batch2QTY = qty - batch1QTY
+        origQTY = FixedPoint.format( qty )
+        quoteQTY = FixedPoint.format( FixedPoint.mul( qty, price ) )
+        price = FixedPoint.format( price )
+        batch1Fee = FixedPoint.format( batch1QTY // 1000 )
+        batch2Fee = FixedPoint.format( batch2QTY // 1000 )
+        batch1QTY = FixedPoint.format( batch1QTY )
+        batch2QTY = FixedPoint.format( batch2QTY )
 
         order = {
             'symbol': symbol, 
@@ -226,9 +275,188 @@ class Order:
 
 
 
+class Positions:
+    ''' Array-backed table of open positions, up to size at once
+
+    The thresholds of all positions live in NumPy arrays and a tick is checked against every position of its symbol
+    in one vectorized step. Once the price exceeds TakeProfit the thresholds trail: TakeProfit = price + step%,
+    StopLoss = TakeProfit - step%. Therefore exceeding TakeProfit never closes a position by itself, only falling
+    below StopLoss does.
+
+    Prices and thresholds are integers of 1e-8 (see fixedpoint.FixedPoint) so a tick compares exactly what the
+    exchange sent. TakeProfit and BreakEven are rounded down, StopLoss up, i.e. never in favour of the position.
+
+    A symbol usually has a single position. Its thresholds are mirrored as plain Python ints, so the tick of such
+    a symbol is two int comparisons without any NumPy temporaries. Thresholds set from outside go through set().
+
+    :param size         -> type:int: max number of open positions
+    :param TargetProfit -> type:float: in %
+    :param StopLoss     -> type:float: in %
+    :param BreakEven    -> type:float: in %
+    :param step         -> type:float: trailing step in %
+    '''
+    def __init__( self, size, TargetProfit, StopLoss, BreakEven, step=0.1 ):
+        self.size = size
+        self.pct = ( TargetProfit, StopLoss, BreakEven )
+        self.step = step
+        self.active = np.zeros( size, dtype=bool )
+        self.price = np.zeros( size, dtype=np.int64 )
+        self.TargetProfit = np.zeros( size, dtype=np.int64 )
+        self.StopLoss = np.zeros( size, dtype=np.int64 )
+        self.BreakEven = np.zeros( size, dtype=np.int64 )
+        self.assets = [ None ] * size
+        self.orders = [ None ] * size
+        # symbol -> slots of its open positions
+        self.slots = {}
+        # symbol -> [ slot, TargetProfit, StopLoss ] of symbols with exactly one position, the scalar path of tick()
+        self.single = {}
+
+    def free( self ):
+        return self.size - int( self.active.sum() )
+
+    def symbols( self ):
+        return list( self.slots )
+
+    def open( self, asset, order ):
+        ''' Add a position
+
+        :return int: slot of the position
+        '''
+        slot = int( np.flatnonzero( ~self.active )[0] )
+        price = int( order.price )
+        TargetProfit, StopLoss, BreakEven = self.pct
+        self.active[ slot ] = True
+        self.price[ slot ] = price
+        self.TargetProfit[ slot ] = FixedPoint.percent( price, TargetProfit )
+        self.StopLoss[ slot ] = FixedPoint.percent( price, -StopLoss, up=True )
+        self.BreakEven[ slot ] = FixedPoint.percent( price, BreakEven )
+        self.assets[ slot ] = asset
+        self.orders[ slot ] = order
+        self.slots[ asset.symbol ] = np.append( self.slots.get( asset.symbol, np.empty( 0, dtype=np.int64 ) ), slot )
+        self.mirror( asset.symbol )
+        return slot
+
+    def close( self, slot ):
+        ''' Remove a position
+
+        :return Tuple( Asset, Order )
+        '''
+        asset, order = self.assets[ slot ], self.orders[ slot ]
+        self.active[ slot ] = False
+        self.assets[ slot ] = self.orders[ slot ] = None
+        slots = self.slots[ asset.symbol ]
+        slots = slots[ slots != slot ]
+        if len( slots ):
+            self.slots[ asset.symbol ] = slots
+        else:
+            del self.slots[ asset.symbol ]
+        self.mirror( asset.symbol )
+        return asset, order
+
+    def mirror( self, symbol ):
+        ''' Keep the scalar thresholds of a symbol with a single position in line with the arrays
+        '''
+        slots = self.slots.get( symbol )
+        if slots is not None and len( slots ) == 1:
+            slot = int( slots[0] )
+            self.single[ symbol ] = [ slot, int( self.TargetProfit[ slot ] ), int( self.StopLoss[ slot ] ) ]
+        else:
+            self.single.pop( symbol, None )
+
+    def set( self, slot, TargetProfit, StopLoss ):
+        ''' Set the thresholds of a position, e.g. restored ones
+        '''
+        self.TargetProfit[ slot ], self.StopLoss[ slot ] = TargetProfit, StopLoss
+        self.mirror( self.assets[ slot ].symbol )
+
+    def tick( self, symbol, price ):
+        ''' Check a tick against all positions of its symbol
+
+        :param symbol   -> type:str
+        :param price    -> type:int: in units
+        :return Tuple( slots to close, slots whose trailing stop moved ), ndarrays or tuples
+        '''
+        single = self.single.get( symbol )
+        if single is not None:
+            slot, TargetProfit, StopLoss = single
+            if price > TargetProfit:
+                TargetProfit = FixedPoint.percent( price, self.step )
+                StopLoss = FixedPoint.percent( TargetProfit, -self.step, up=True )
+                single[1], single[2] = self.TargetProfit[ slot ], self.StopLoss[ slot ] = TargetProfit, StopLoss
+                return (), ( slot, )
+            if price < StopLoss:
+                return ( slot, ), ()
+            return (), ()
+        slots = self.slots.get( symbol )
+        if slots is None:
+            return (), ()
+        trail = price > self.TargetProfit[ slots ]
+        if trail.any():
+            trailed = slots[ trail ]
+            # all trailed positions move to the same thresholds, computed once on Python ints
+            TargetProfit = FixedPoint.percent( price, self.step )
+            self.TargetProfit[ trailed ] = TargetProfit
+            self.StopLoss[ trailed ] = FixedPoint.percent( TargetProfit, -self.step, up=True )
+        else:
+            trailed = ()
+        return slots[ ~trail & ( price < self.StopLoss[ slots ] ) ], trailed
+
+    def window( self, slot, prices ):
+        ''' Run one position over a window of prices of its symbol, the vectorized counterpart of tick()
+
+        Every step finds the next price which either moves the trailing stop or hits StopLoss in one pass,
+        so the cost grows with the number of trailing moves instead of the number of ticks.
+
+        :param slot     -> type:int
+        :param prices   -> ndarray: consecutive prices of the symbol as int64 units, see FixedPoint.array()
+        :return int: index of the price which closes the position, -1 if it stays open
+        '''
+        TargetProfit, StopLoss = int( self.TargetProfit[ slot ] ), int( self.StopLoss[ slot ] )
+        i = 0
+        while i < len( prices ):
+            rest = prices[ i: ]
+            hit = ( rest > TargetProfit ) | ( rest < StopLoss )
+            j = int( hit.argmax() )
+            if not hit[ j ]:
+                break
+            price = rest[ j ]
+            if price <= TargetProfit:
+                self.set( slot, TargetProfit, StopLoss )
+                return i + j
+            TargetProfit = FixedPoint.percent( price, self.step )
+            StopLoss = FixedPoint.percent( TargetProfit, -self.step, up=True )
+            i += j + 1
+        self.set( slot, TargetProfit, StopLoss )
+        return -1
+
+
 class Trade:
-    #https://www.investopedia.com/terms/b/bid-and-ask.asp
-    def __init__( self, ask, bid ):
+    ''' A closed trade, the buy and the sell Order of one position
+
+    Amounts are integers of 1e-8 like those of the orders, relative_profit as well (0.01 = 1000000).
 
-        self.ask = ask.price
-        self.bid = bid.price
\ No newline at end of file
+    :param asset    -> Asset: with the OHLCV indicators the position was entered on
+    :param ask      -> Order: buy order
+    :param bid      -> Order: sell order
+    :param closed   -> datetime: (optional) time the trade was closed, default now
+    '''
+    #https://www.investopedia.com/terms/b/bid-and-ask.asp
+    def __init__( self, asset, ask, bid, closed=None ):
+        self.asset = asset
+        self.ask = ask
+        self.bid = bid
+        self.closed = dt.datetime.now() if closed is None else closed
+        self.duration = self.closed - dt.datetime.fromtimestamp( ask.timestamp )
+        self.dust = ask.qty - bid.qty
+        self.profit = bid.price - ask.price
+        self.total_profit = FixedPoint.mul( self.profit, bid.qty )
+        self.relative_profit = FixedPoint.ratio( self.profit, ask.price )
+        self.diff = round( self.profit / ask.price * 100, 2 )
+        self.state = 'WON' if bid.price > ask.price else 'LOST'
+
+
+    def record( self ):
+        ''' The log record of this trade, see utils.log()
+        '''
+        OHLCV = self.asset.OHLCV
+        return { 'ts' : str(self.closed), 'state' : self.state, 'symbol' : self.asset.symbol, 'duration' : str(self.duration), 'ask' : FixedPoint.format(self.ask.price), 'ask_qty' : FixedPoint.format(self.ask.qty), 'bid' : FixedPoint.format(self.bid.price), 'bid_qty' : FixedPoint.format(self.bid.qty), 'profit' : FixedPoint.format(self.profit), 'total_profit' : FixedPoint.format(self.total_profit), 'ROC' : float(OHLCV.ROC.iloc[-1]), 'RSI' : float(OHLCV.RSI.iloc[-1]), 'ATR' : float(OHLCV.ATR.iloc[-1]), 'OBV' : float(OHLCV.OBV.iloc[-1]) }
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) Dave Beusing <david.beusing@gmail.com>
+#
+#
+
+import os
+import time
+import argparse
+import multiprocessing
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from binance import Client
+
+from config import Config
+from utils import ExchangeInfo, connectDB
+from archive import Archive
+from backtest import TickData, Backtest, parse_Time
+
+
+'''
+Sweep the trading parameters over recorded ticks, every combination is one backtest
+
+python optimizer.py --TargetProfit 0.4:1.6:0.2 --StopLoss 0.5,1.0,1.5 --minROC 0.5:2:0.5 [--samples 1000] [--processes 8] [--out sweep.csv]
+
+A parameter is either a comma separated list or start:stop:step (stop included), parameters which are not given keep their Config value.
+'''
+
+# the parameters which can be swept
+Parameters = [ 'TargetProfit', 'StopLoss', 'BreakEven', 'minROC', 'TrailingStep' ]
+
+# set by init() in every worker process
+data = None
+
+
+def parse_Values( value ):
+    ''' "0.5,1.0" -> [ 0.5, 1.0 ] | "0.4:1.0:0.2" -> [ 0.4, 0.6, 0.8, 1.0 ]
+    '''
+    if ':' in value:
+        start, stop, step = ( float( v ) for v in value.split( ':' ) )
+        return [ round( v, 10 ) for v in np.arange( start, stop + step / 2, step ) ]
+    return [ float( v ) for v in value.split( ',' ) ]
+
+
+def combinations( grid, samples=None, seed=None ):
+    ''' The full grid of parameter combinations or a random sample of it
+
+    :param grid     -> type:Dict: parameter -> List of values
+    :param samples  -> type:int: (optional) number of combinations drawn without replacement
+    :return List of Dict
+    '''
+    names = list( grid )
+    sizes = [ len( grid[ name ] ) for name in names ]
+    total = int( np.prod( sizes ) )
+    if samples is None or samples >= total:
+        picks = range( total )
+    else:
+        # draw flat indices, so the grid never has to be materialized
+        picks = np.random.default_rng( seed ).choice( total, size=samples, replace=False )
+    result = []
+    for flat in picks:
+        idx = np.unravel_index( int( flat ), sizes )
+        result.append( { name : grid[ name ][ i ] for name, i in zip( names, idx ) } )
+    return result
+
+
+def init( path, metadata ):
+    ''' Worker initializer: map the shared ticks and the exchange info once per process
+    '''
+    global data
+    data = TickData.load( path )
+    ExchangeInfo.get( None, path=metadata, ttl=float( 'inf' ) )
+
+
+def evaluate( params ):
+    ''' Run one backtest with the given parameters
+
+    :return Dict: the parameters and Backtest.stats()
+    '''
+    config = SimpleNamespace( **{ key : getattr( Config, key ) for key in dir( Config ) if not key.startswith( '_' ) } )
+    for key, value in params.items():
+        setattr( config, key, value )
+    backtest = Backtest( data, config, records=False )
+    backtest.run()
+    return { **params, **backtest.stats(), 'elapsed' : backtest.elapsed }
+
+
+def sweep( path, combos, processes=None, metadata=None ):
+    ''' Evaluate all combinations on a process pool
+
+    The ticks are mapped read-only by every worker, so memory does not grow with the number of processes
+    and there is nothing to synchronize. Combinations are handed out one at a time, a slow one never holds back a batch.
+
+    :param path     -> type:str: directory of ticks stored with TickData.save()
+    :param combos   -> type:List: parameter Dicts
+    :return DataFrame: one row per combination
+    '''
+    results = []
+    with multiprocessing.Pool( processes, initializer=init, initargs=( path, metadata ) ) as pool:
+        for i, result in enumerate( pool.imap_unordered( evaluate, combos, chunksize=1 ), 1 ):
+            results.append( result )
+            print( f'\r{i}/{len( combos )}', end='', flush=True )
+    print()
+    return pd.DataFrame( results )
+
+
+def rank( df, by='profit' ):
+    ''' Best combinations first: by profit, win rate or drawdown, the others break ties
+    '''
+    keys = { 'profit' : ( 'profit', False ), 'winrate' : ( 'winrate', False ), 'drawdown' : ( 'drawdown', True ) }
+    order = [ by ] + [ key for key in keys if key != by ]
+    return df.sort_values( [ keys[ key ][0] for key in order ], ascending=[ keys[ key ][1] for key in order ] ).reset_index( drop=True )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description='Parameter sweep over recorded ticks' )
+    for name in Parameters:
+        parser.add_argument( f'--{name}', type=parse_Values, help=f'default {getattr( Config, name )}' )
+    parser.add_argument( '--samples', type=int, help='evaluate a random sample of the grid' )
+    parser.add_argument( '--seed', type=int )
+    parser.add_argument( '--processes', type=int, default=os.cpu_count() )
+    parser.add_argument( '--database', default=Config.Database )
+    parser.add_argument( '--start', help='UTC, e.g. "2021-11-18 10:00"' )
+    parser.add_argument( '--end', help='UTC, e.g. "2021-11-18 12:00"' )
+    parser.add_argument( '--archive', action='store_true', help='include the ticks archived in Config.Archive' )
+    parser.add_argument( '--cache', default='/dev/shm/CryptoTrader.sweep', help='directory the ticks are shared through' )
+    parser.add_argument( '--rank', choices=[ 'profit', 'winrate', 'drawdown' ], default='profit' )
+    parser.add_argument( '--top', type=int, default=20 )
+    parser.add_argument( '--out', help='write all results to this CSV file' )
+    args = parser.parse_args()
+
+    grid = { name : getattr( args, name ) or [ getattr( Config, name ) ] for name in Parameters }
+    combos = combinations( grid, args.samples, args.seed )
+
+    # fetch the exchange info once, the workers only read the cache file
+    ExchangeInfo.get( None if os.path.isfile( Config.MetadataCache ) else Client(), path=Config.MetadataCache, ttl=float( 'inf' ) )
+
+    # load the ticks once and share them through .npy files
+    archive = Archive( Config.Archive ) if args.archive else None
+    TickData.query( connectDB( args.database ), parse_Time( args.start ), parse_Time( args.end ), archive=archive ).save( args.cache )
+
+    start = time.perf_counter()
+    df = rank( sweep( args.cache, combos, args.processes, Config.MetadataCache ), args.rank )
+    elapsed = time.perf_counter() - start
+
+    print( f'###_Sweep_###' )
+    print( f'Combinations: {len( combos )} Processes: {args.processes} Elapsed: {elapsed:.1f}s ({len( combos ) / elapsed:.2f}/s)' )
+    with pd.option_context( 'display.width', 200, 'display.max_columns', None ):
+        print( df.head( args.top ).to_string() )
+    print( f'##############', flush=True )
+    if args.out:
+        df.to_csv( args.out, index=False )
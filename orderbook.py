@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) Dave Beusing <david.beusing@gmail.com>
+#
+#
+
+import time
+import asyncio
+import collections
+
+import datetime as dt
+
+import numpy as np
+
+from utils import RequestScheduler
+
+
+class BookSide:
+    ''' Price levels of one side of the book as two parallel NumPy arrays, best level first
+
+    Levels are kept sorted by key = sign * price (asks ascending, bids descending price), so both sides
+    are searched and merged the same way. At most size levels are kept, the far end is cut off.
+
+    :param sign -> type:int: 1 for asks, -1 for bids
+    :param size -> type:int: maximum number of levels
+    '''
+    def __init__( self, sign, size=1000 ):
+        self.sign = sign
+        self.size = size
+        self.keys = np.empty( 0 )
+        self.qty = np.empty( 0 )
+
+    def prices( self ):
+        return self.keys * self.sign
+
+    def levels( levels ):
+        ''' [ [ '1.6453', '39.0' ], ... ] -> prices, quantities as float arrays
+        '''
+        if not len( levels ):
+            return np.empty( 0 ), np.empty( 0 )
+        levels = np.asarray( levels, dtype=np.float64 )
+        return levels[ :, 0 ], levels[ :, 1 ]
+
+    def set( self, levels ):
+        prices, qty = BookSide.levels( levels )
+        keep = qty > 0
+        keys = prices[ keep ] * self.sign
+        order = np.argsort( keys )[ :self.size ]
+        self.keys, self.qty = keys[ order ], qty[ keep ][ order ]
+
+    def apply( self, levels ):
+        ''' Apply the absolute quantities of a diff update, a quantity of 0 removes the level
+        '''
+        prices, qty = BookSide.levels( levels )
+        if not len( prices ):
+            return
+        keys = prices * self.sign
+        idx = np.searchsorted( self.keys, keys )
+        found = idx < len( self.keys )
+        found[ found ] = self.keys[ idx[ found ] ] == keys[ found ]
+        self.qty[ idx[ found ] ] = qty[ found ]
+        new = ~found & ( qty > 0 )
+        if new.any():
+            # np.insert places every new level before the existing one it was searched against, new levels
+            # which land between the same two existing ones must be in key order themselves
+            order = np.argsort( keys[ new ] )
+            self.keys = np.insert( self.keys, idx[ new ][ order ], keys[ new ][ order ] )
+            self.qty = np.insert( self.qty, idx[ new ][ order ], qty[ new ][ order ] )
+        if ( qty == 0 ).any() or len( self.keys ) > self.size:
+            keep = self.qty > 0
+            self.keys, self.qty = self.keys[ keep ][ :self.size ], self.qty[ keep ][ :self.size ]
+
+    def best( self ):
+        return self.keys[0] * self.sign if len( self.keys ) else np.nan
+
+    def fill( self, qty=None, quote=None ):
+        ''' Average price of a market order which takes qty base asset or quote worth of quote asset from this side
+
+        :return float: average fill price, NaN if the known depth is not enough
+        '''
+        if not len( self.keys ):
+            return np.nan
+        prices = self.prices()
+        if qty is None:
+            notional = np.cumsum( prices * self.qty )
+            i = np.searchsorted( notional, quote )
+            if i >= len( notional ):
+                return np.nan
+            # the last level is only partially taken
+            filled = ( self.qty[ :i ].sum() if i else 0.0 ) + ( quote - ( notional[ i - 1 ] if i else 0.0 ) ) / prices[i]
+            return quote / filled
+        cumulative = np.cumsum( self.qty )
+        i = np.searchsorted( cumulative, qty )
+        if i >= len( cumulative ):
+            return np.nan
+        cost = ( prices[ :i ] * self.qty[ :i ] ).sum() + prices[i] * ( qty - ( cumulative[ i - 1 ] if i else 0.0 ) )
+        return cost / qty
+
+    def depth( self, limit ):
+        ''' Quantity available up to limit price
+        '''
+        return self.qty[ :np.searchsorted( self.keys, limit * self.sign, side='right' ) ].sum()
+
+
+class OrderBook:
+    ''' Local L2 order book of one symbol, kept in sync with the diff depth stream
+
+    https://binance-docs.github.io/apidocs/spot/en/#how-to-manage-a-local-order-book-correctly
+
+    The book starts from a REST snapshot, then every diff update is applied in order. An update which is older than
+    the book is dropped, one which leaves a gap in the update ids marks the book as out of sync, it needs a new snapshot.
+
+        book = OrderBook( 'BTCUSDT' )
+        book.snapshot( client.get_order_book( symbol='BTCUSDT', limit=100 ) )
+        book.update( event )            # False -> resync
+        book.fill( quote=100, side='BUY' )
+        book.slippage( 100, 'BUY' )     # % worse than mid
+
+    :param symbol   -> type:str
+    :param size     -> type:int: maximum number of levels per side
+    '''
+    def __init__( self, symbol, size=1000 ):
+        self.symbol = symbol
+        self.asks = BookSide( 1, size )
+        self.bids = BookSide( -1, size )
+        self.id = None
+        self.time = None
+
+    def synced( self ):
+        return self.id is not None
+
+    def snapshot( self, data ):
+        ''' Reset the book to a REST snapshot ( client.get_order_book() )
+        '''
+        self.bids.set( data[ 'bids' ] )
+        self.asks.set( data[ 'asks' ] )
+        self.id = data[ 'lastUpdateId' ]
+
+    def update( self, event ):
+        ''' Apply a diff depth event ( <symbol>@depth@100ms )
+
+        :return bool: False if the event does not continue the book, which then needs a new snapshot
+        '''
+        if self.id is None:
+            return False
+        if event[ 'u' ] <= self.id:
+            # already part of the snapshot
+            return True
+        if event[ 'U' ] > self.id + 1:
+            self.id = None
+            return False
+        self.bids.apply( event[ 'b' ] )
+        self.asks.apply( event[ 'a' ] )
+        self.id = event[ 'u' ]
+        self.time = event.get( 'E' )
+        return True
+
+    def spread( self ):
+        ''' Best ask - best bid and the same relative to mid in %
+        '''
+        bid, ask = self.bids.best(), self.asks.best()
+        return ask - bid, ( ask - bid ) / ( ( ask + bid ) / 2 ) * 100
+
+    def mid( self ):
+        return ( self.bids.best() + self.asks.best() ) / 2
+
+    def fill( self, qty=None, quote=None, side='BUY' ):
+        ''' Expected average price of a market order, a BUY takes the asks, a SELL the bids
+
+        :param qty      -> type:float: quantity of the base asset
+        :param quote    -> type:float: or amount of the quote asset e.g. Config.Investment
+        :return float: NaN if the book is not deep enough
+        '''
+        return ( self.asks if side == 'BUY' else self.bids ).fill( qty, quote )
+
+    def slippage( self, quote, side='BUY' ):
+        ''' How much worse than mid a market order of quote amount fills, in %, NaN if the book is not deep enough
+        '''
+        price, mid = self.fill( quote=quote, side=side ), self.mid()
+        return ( price / mid - 1 ) * 100 if side == 'BUY' else ( 1 - price / mid ) * 100
+
+
+class DepthStream:
+    ''' Local order books of the watched symbols, fed by one diff depth socket per symbol
+
+    Events which arrive before a symbol has its snapshot are buffered and replayed once the snapshot is in,
+    a gap in the update ids triggers a new snapshot. book() returns a synced book, if the symbol is not watched
+    (yet) it is built from a REST snapshot only.
+
+    With a socket per symbol watch() only opens and closes the sockets of the symbols which changed, the books
+    of the others keep streaming. A failed or outdated snapshot is retried with backoff per symbol, until then
+    the events of the symbol are only buffered.
+
+    :param client   -> binance.AsyncClient
+    :param bsm      -> binance.BinanceSocketManager
+    :param limit    -> type:int: levels of the REST snapshot 5 | 10 | 20 | 50 | 100 | 500 | 1000 | 5000
+    :param interval -> type:int: update speed of the stream in ms, 100 | 1000
+    '''
+    # request weight of a snapshot by limit
+    WEIGHTS = { 100 : 5, 500 : 25, 1000 : 50, 5000 : 250 }
+    # events buffered per symbol while its snapshot is loading
+    PENDING = 1000
+    # snapshot and reconnect backoff in seconds, doubled per failed attempt up to CAP
+    BACKOFF = 1.0
+    CAP = 60.0
+
+    def __init__( self, client, bsm, limit=100, interval=100 ):
+        self.client = client
+        self.bsm = bsm
+        self.limit = limit
+        self.interval = interval
+        self.books = {}
+        self.pending = {}
+        self.loading = {}
+        # symbol -> failed snapshots in a row, time.monotonic() of the next attempt
+        self.failures = {}
+        self.retry = {}
+        # symbol -> socket task
+        self.tasks = {}
+        self.symbols = set()
+
+    def weight( self ):
+        return next( ( weight for limit, weight in sorted( self.WEIGHTS.items() ) if self.limit <= limit ), 250 )
+
+    def watch( self, symbols ):
+        ''' Keep the books of these symbols current, the others are dropped
+        '''
+        symbols = set( symbols )
+        for symbol in self.symbols - symbols:
+            self.tasks.pop( symbol ).cancel()
+            for state in ( self.books, self.pending, self.failures, self.retry ):
+                state.pop( symbol, None )
+        for symbol in symbols - self.symbols:
+            self.pending.setdefault( symbol, collections.deque( maxlen=self.PENDING ) )
+            self.tasks[ symbol ] = asyncio.create_task( self.run( symbol ) )
+        self.symbols = symbols
+
+    def close( self ):
+        self.watch( () )
+
+    async def run( self, symbol ):
+        ''' Receive the diff depth events of a symbol until cancelled, reconnect whenever the connection is lost
+        '''
+        attempt = 0
+        while True:
+            try:
+                async with self.bsm.depth_socket( symbol, interval=self.interval ) as socket:
+                    while True:
+                        event = await socket.recv()
+                        if event.get( 'e' ) == 'error':
+                            # python-binance reports a lost connection as message
+                            raise ConnectionError( f'{event.get( "type" )} {event.get( "m" )}' )
+                        attempt = 0
+                        self.apply( event )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                wait = min( self.CAP, self.BACKOFF * 2 ** attempt )
+                attempt += 1
+                print( f'{str(dt.datetime.now())} {symbol} depth stream lost ({e!r}), reconnect in {wait:.2f}s', flush=True )
+                await asyncio.sleep( wait )
+
+    def apply( self, event ):
+        symbol = event[ 's' ]
+        book = self.books.get( symbol )
+        if book is not None and book.update( event ):
+            return
+        # no snapshot yet or a gap, keep the events until the next snapshot is in
+        self.pending.setdefault( symbol, collections.deque( maxlen=self.PENDING ) ).append( event )
+        if symbol not in self.loading and time.monotonic() >= self.retry.get( symbol, 0 ):
+            self.loading[ symbol ] = asyncio.ensure_future( self.resync( symbol ) )
+
+    def backoff( self, symbol, reason ):
+        failures = self.failures.get( symbol, 0 )
+        wait = min( self.CAP, self.BACKOFF * 2 ** failures )
+        self.failures[ symbol ] = failures + 1
+        self.retry[ symbol ] = time.monotonic() + wait
+        print( f'{str(dt.datetime.now())} {symbol} order book {reason}, next snapshot in {wait:.2f}s', flush=True )
+
+    async def resync( self, symbol ):
+        ''' Load a snapshot and replay the events which arrived meanwhile
+
+        Never raises, a failure is logged and backs off the next snapshot of the symbol.
+
+        :return OrderBook: None if the snapshot failed
+        '''
+        try:
+            try:
+                data = await RequestScheduler.get().call_async( self.client.get_order_book, symbol=symbol, limit=self.limit, weight=self.weight() )
+            except Exception as e:
+                self.backoff( symbol, f'snapshot failed ({e!r})' )
+                return None
+            book = self.books.get( symbol ) or OrderBook( symbol )
+            book.snapshot( data )
+            pending = self.pending.get( symbol, () )
+            while pending:
+                if not book.update( pending.popleft() ):
+                    # the snapshot is older than the buffered events, the next event after the backoff triggers another one
+                    self.backoff( symbol, 'snapshot is behind the stream' )
+                    break
+            else:
+                self.failures.pop( symbol, None )
+                self.retry.pop( symbol, None )
+            if symbol in self.symbols:
+                self.books[ symbol ] = book
+            return book
+        finally:
+            del self.loading[ symbol ]
+
+    async def book( self, symbol ):
+        ''' Synced order book of the symbol
+
+        :return OrderBook
+        '''
+        book = self.books.get( symbol )
+        if book is not None and book.synced():
+            return book
+        if symbol not in self.loading:
+            self.loading[ symbol ] = asyncio.ensure_future( self.resync( symbol ) )
+        book = await asyncio.shield( self.loading[ symbol ] )
+        if book is None:
+            raise LookupError( f'no order book of {symbol}' )
+        return book
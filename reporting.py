@@ -7,32 +7,16 @@
 
 import os
 import time
-import ast
 import numpy as np
 import pandas as pd
 import datetime as dt
 
 
 from config import Config
+from journal import Journal
 
-#logfile = Config.Logfile
-logfile = '/home/dave/code/crypto/bot/log/ms_test9-2.log'
-
-
-data = []
-with open( logfile ) as fd:
-    lines = fd.readlines()
-for line in lines:
-    data.append( ast.literal_eval( line.rstrip() ) )
-fd.close()
-df = pd.DataFrame( data )
-df.ask = df.ask.astype(float)
-df.ask_qty = df.ask_qty.astype(float)
-df.bid = df.bid.astype(float)
-df.bid_qty = df.bid_qty.astype(float)
-df.profit = df.profit.astype(float)
-df.total_profit = df.total_profit.astype(float)
-df.duration = pd.to_timedelta(df.duration)
+# typed columns straight from the trade journal, ts is UTC
+df = Journal( Config.Journal ).trades()
 
 # set index to timestamp
 df = df.set_index('ts')
@@ -41,8 +25,7 @@ df = df.set_index('ts')
 #df.state = (df.state == 'WON').astype(int)
 
 # change state to +1/-1 values
-df.loc[df.state == 'WON', 'state'] = 1
-df.loc[df.state == 'LOST', 'state'] = -1
+df.state = np.where(df.state == 'WON', 1, -1)
 
 
 
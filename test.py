@@ -6,13 +6,13 @@
 #
 
 import datetime as dt
-from binance import Client
-from utils import Credentials, applyIndicators, fetch_OHLCV
+from config import Config
+from utils import Exchange, applyIndicators, fetch_OHLCV
 
 from models import Asset
 
-credentials = Credentials( 'key/binance.key' )
-client = Client( credentials.key, credentials.secret )
+Exchange.configure( Config )
+client = Exchange.client()
 client.timestamp_offset = -2000 #binance.exceptions.BinanceAPIException: APIError(code=-1021): Timestamp for this request was 1000ms ahead of the server's time.
 
 #asset = Asset( client, 'LRCUSDT' )
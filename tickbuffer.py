@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) Dave Beusing <david.beusing@gmail.com>
+#
+#
+
+import os
+import time
+import numpy as np
+
+
+class TickBuffer:
+    ''' Fixed-size ring buffer of the most recent ticks per symbol, backed by a mmap'd file
+
+    CryptoStream creates the buffer and appends every tick, CryptoTrader (or any other process) attaches
+    to the same file and reads recent windows as zero-copy NumPy views, without touching the Database.
+    Put the file on a tmpfs (e.g. /dev/shm) to keep it purely in memory.
+
+    Every tick is written twice, at pos and pos + capacity, so the latest `capacity` ticks are always
+    a contiguous slice and a window never needs to be stitched together.
+
+    Layout: header[ magic, nsymbols, capacity ] | symbols | counts[nsymbols] | time[nsymbols, 2*capacity] | price[nsymbols, 2*capacity]
+
+    Readers get views into live memory, if a window must stay stable take a copy.
+    The buffer should hold a lot more ticks than the largest lookback which is read from it.
+
+    A new buffer is built under a temporary name and renamed into place, so a restarted CryptoStream never
+    truncates the file a reader has mapped. The reader keeps the old file until it sees replaced() and attaches again.
+
+    :param path     -> type:str: path to the buffer file
+    :param symbols  -> type:List: create a new buffer for these symbols, if None attach to an existing one
+    :param capacity -> type:int: number of ticks kept per symbol
+    '''
+    MAGIC = 0x5449434B # TICK
+    HEADER = np.dtype( [ ( 'magic', '<i8' ), ( 'nsymbols', '<i8' ), ( 'capacity', '<i8' ) ] )
+    SYMBOL = np.dtype( 'S20' )
+
+    def __init__( self, path, symbols=None, capacity=4096 ):
+        self.path = path
+        if symbols is not None:
+            self.create( [ s.upper() for s in symbols ], capacity )
+        self.attach( writable=symbols is not None )
+
+    def create( self, symbols, capacity ):
+        size = self.HEADER.itemsize + len( symbols ) * self.SYMBOL.itemsize + len( symbols ) * 8 + 2 * len( symbols ) * 2 * capacity * 8
+        path = f'{self.path}.{os.getpid()}'
+        with open( path, 'w+b' ) as fd:
+            fd.truncate( size )
+        header = np.memmap( path, dtype=self.HEADER, mode='r+', shape=(1,) )
+        header[0] = ( self.MAGIC, len( symbols ), capacity )
+        names = np.memmap( path, dtype=self.SYMBOL, mode='r+', offset=self.HEADER.itemsize, shape=( len( symbols ), ) )
+        names[:] = [ s.encode() for s in symbols ]
+        header.flush()
+        names.flush()
+        # atomic, readers see either the old or the complete new buffer
+        os.replace( path, self.path )
+
+    def attach( self, writable=False ):
+        mode = 'r+' if writable else 'r'
+        # taken before mapping, if the file is replaced in between replaced() is True and the reader attaches again
+        self.inode = os.stat( self.path ).st_ino
+        header = np.memmap( self.path, dtype=self.HEADER, mode='r', shape=(1,) )[0]
+        if header[ 'magic' ] != self.MAGIC:
+            raise ValueError( f'{self.path} is not a TickBuffer' )
+        n = int( header[ 'nsymbols' ] )
+        self.capacity = int( header[ 'capacity' ] )
+        offset = self.HEADER.itemsize
+        self.symbols = [ s.decode() for s in np.memmap( self.path, dtype=self.SYMBOL, mode='r', offset=offset, shape=( n, ) ) ]
+        self.index = { symbol : i for i, symbol in enumerate( self.symbols ) }
+        offset += n * self.SYMBOL.itemsize
+        self.counts = np.memmap( self.path, dtype='<i8', mode=mode, offset=offset, shape=( n, ) )
+        offset += n * 8
+        self.time = np.memmap( self.path, dtype='<i8', mode=mode, offset=offset, shape=( n, 2 * self.capacity ) )
+        offset += n * 2 * self.capacity * 8
+        self.price = np.memmap( self.path, dtype='<f8', mode=mode, offset=offset, shape=( n, 2 * self.capacity ) )
+
+    def replaced( self ):
+        ''' True if the file was replaced (or removed) since attach(), e.g. by a restarted CryptoStream
+        '''
+        try:
+            return os.stat( self.path ).st_ino != self.inode
+        except FileNotFoundError:
+            return True
+
+    def append( self, symbol, time, price ):
+        ''' Append one tick, unknown symbols are ignored
+
+        :param symbol   -> type:str: e.g. BTCUSDT
+        :param time     -> type:int: event time in ms
+        :param price    -> type:float
+        '''
+        i = self.index.get( symbol )
+        if i is None:
+            return
+        n = self.counts[i]
+        pos = n % self.capacity
+        self.time[ i, pos ] = self.time[ i, pos + self.capacity ] = time
+        self.price[ i, pos ] = self.price[ i, pos + self.capacity ] = price
+        # publish the tick only after the data is in place
+        self.counts[i] = n + 1
+
+    def window( self, symbol, since=None ):
+        ''' Return the ticks of one symbol as zero-copy views
+
+        :param symbol   -> type:str: e.g. BTCUSDT
+        :param since    -> type:int: (optional) event time in ms, only ticks at or after it are returned
+        :return Tuple( time ndarray, price ndarray )
+        '''
+        i = self.index[ symbol ]
+        n = int( self.counts[i] )
+        k = min( n, self.capacity )
+        end = ( n - 1 ) % self.capacity + self.capacity + 1
+        times = self.time[ i, end - k:end ]
+        prices = self.price[ i, end - k:end ]
+        if since is not None:
+            start = int( np.searchsorted( times, since, side='left' ) )
+            times, prices = times[start:], prices[start:]
+        return times, prices
+
+    def lookback( self, symbol, minutes ):
+        ''' Same as window() for the last n minutes, the counterpart of queryDB()
+        '''
+        return self.window( symbol, since=int( time.time() * 1000 ) - minutes * 60 * 1000 )
+
+    def returns( self, since ):
+        ''' Cumulative return of every symbol since the given time, in one vectorized pass
+
+        ( pct_change() + 1 ).prod() - 1 telescopes to last / first - 1, so only the first tick
+        at or after `since` and the latest tick of each symbol are needed. The first one is found
+        with a binary search which runs over all symbols at once.
+
+        :param since    -> type:int: event time in ms
+        :return ndarray: cumulative return per symbol, aligned with self.symbols, NaN if there are no ticks
+        '''
+        rows = np.arange( len( self.symbols ) )
+        n = np.asarray( self.counts, dtype=np.int64 )
+        end = ( n - 1 ) % self.capacity + self.capacity + 1
+        lo = end - np.minimum( n, self.capacity )
+        hi = end.copy()
+        while True:
+            active = lo < hi
+            if not active.any():
+                break
+            mid = ( lo + hi ) // 2
+            before = active & ( self.time[ rows, np.where( active, mid, 0 ) ] < since )
+            lo = np.where( before, mid + 1, lo )
+            hi = np.where( active & ~before, mid, hi )
+        valid = lo < end
+        first = self.price[ rows, np.where( valid, lo, 0 ) ]
+        last = self.price[ rows, np.where( valid, end - 1, 0 ) ]
+        return np.where( valid, last / np.where( valid, first, 1.0 ) - 1, np.nan )
+
+    def flush( self ):
+        if self.counts.flags.writeable:
+            self.counts.flush()
+            self.time.flush()
+            self.price.flush()
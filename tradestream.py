@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) Dave Beusing <david.beusing@gmail.com>
+#
+#
+
+import time
+import random
+import asyncio
+import concurrent.futures
+
+import datetime as dt
+
+from metrics import Metrics
+
+
+class Shard:
+    ''' One websocket connection carrying a slice of the trade streams
+
+    Received messages go into a bounded queue and nothing else happens on the connection, so recv() keeps up even
+    while the writer is busy. If the queue is full put() waits, the messages pile up on this connection only.
+    A connection which fails, reports an error or stays silent for timeout seconds is reopened with full jitter backoff.
+
+    Trade ids are consecutive per symbol, the last one of every symbol is kept across reconnects: a jump is a gap
+    (trades we missed, e.g. while reconnecting), a repeated id is a duplicate and dropped.
+
+    :param index    -> type:int: number of the shard, the metrics are named shard<index>_...
+    :param streams  -> type:List: <symbol>@trade streams of this connection
+    :param size     -> type:int: capacity of the queue in messages
+    :param timeout  -> type:float: seconds without a message after which the connection is considered stalled
+    :param metrics  -> Metrics
+    '''
+    # reconnect backoff in seconds, doubled per failed attempt up to CAP
+    BACKOFF = 1.0
+    CAP = 60.0
+
+    def __init__( self, index, streams, size=10000, timeout=60, metrics=None ):
+        self.index = index
+        self.name = f'shard{index}'
+        self.streams = streams
+        self.queue = asyncio.Queue( maxsize=size )
+        self.timeout = timeout
+        self.metrics = Metrics( 'TradeStream' ) if metrics is None else metrics
+        # symbol -> last trade id
+        self.ids = {}
+        self.connected = False
+        # perf_counter_ns() of the last message
+        self.last = 0
+        self.received = 0
+        self.gaps = 0
+        self.missed = 0
+        self.duplicates = 0
+        self.reconnects = 0
+        # clock of the exchange -> our receive time, includes the clock offset between both
+        self.lag = self.metrics.histogram( f'{self.name}_lag' )
+        self.depth = self.metrics.histogram( f'{self.name}_queue_depth' )
+        self.trade_to_receive = self.metrics.histogram( 'trade_to_receive' )
+
+    async def run( self, bsm, ready ):
+        ''' Receive until cancelled, reconnect whenever the connection is lost
+
+        :param bsm      -> binance.BinanceSocketManager
+        :param ready    -> asyncio.Event: set whenever a message was queued
+        '''
+        attempt = 0
+        while True:
+            try:
+                async with bsm.multiplex_socket( self.streams ) as socket:
+                    self.connected = True
+                    self.last = connected = time.perf_counter_ns()
+                    # a watchdog instead of wait_for() per message, which would cost a task per message
+                    receiver = asyncio.ensure_future( self.receive( socket, ready ) )
+                    try:
+                        while not receiver.done():
+                            await asyncio.wait( [ receiver ], timeout=1 )
+                            if time.perf_counter_ns() - self.last > self.timeout * 1e9:
+                                raise TimeoutError( f'no message in {self.timeout}s' )
+                            if self.last > connected:
+                                # messages arrive, the next failure starts the backoff over
+                                attempt = 0
+                        receiver.result()
+                    finally:
+                        receiver.cancel()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.connected = False
+                self.reconnects += 1
+                self.metrics.count( f'{self.name}_reconnects' )
+                wait = random.uniform( 0, min( self.CAP, self.BACKOFF * 2 ** attempt ) )
+                attempt += 1
+                print( f'{str(dt.datetime.now())} {self.name} lost its connection ({e!r}), reconnect in {wait:.2f}s', flush=True )
+                await asyncio.sleep( wait )
+            finally:
+                self.connected = False
+
+    async def receive( self, socket, ready ):
+        while True:
+            response = await socket.recv()
+            self.last = received = time.perf_counter_ns()
+            if 'data' not in response:
+                # python-binance reports a lost connection or its overflowing queue as message
+                raise ConnectionError( f'{response.get( "type" )} {response.get( "m" )}' )
+            if self.accept( response[ 'data' ] ):
+                await self.queue.put( ( received, response ) )
+                ready.set()
+
+    def accept( self, data ):
+        ''' Account a trade, False if we already have it
+        '''
+        received = time.time() * 1000
+        self.lag.record( ( received - data[ 'E' ] ) * 1000 )
+        self.trade_to_receive.record( ( received - data[ 'T' ] ) * 1000 )
+        symbol, id = data[ 's' ], data[ 't' ]
+        last = self.ids.get( symbol )
+        if last is not None:
+            if id <= last:
+                self.duplicates += 1
+                self.metrics.count( f'{self.name}_duplicates' )
+                return False
+            if id > last + 1:
+                self.gaps += 1
+                self.missed += id - last - 1
+                self.metrics.count( f'{self.name}_gaps' )
+                self.metrics.count( f'{self.name}_missed', id - last - 1 )
+        self.ids[ symbol ] = id
+        self.received += 1
+        return True
+
+    def stats( self ):
+        return { 'streams' : len( self.streams ), 'connected' : self.connected, 'received' : self.received, 'queue' : self.queue.qsize(),
+            'gaps' : self.gaps, 'missed' : self.missed, 'duplicates' : self.duplicates, 'reconnects' : self.reconnects }
+
+
+class TradeStream:
+    ''' Trade streams of many symbols, sharded over several websocket connections and written by one decoupled writer
+
+    Binance limits the streams per connection (1024) and a single connection which falls behind overflows its
+    client queue and drops, so the streams are split into shards of shard streams, each with its own connection
+    and bounded queue (see Shard). A stalled or reconnecting shard does not hold up the others.
+
+    The writer drains the shard queues round robin into the TickWriter and the TickBuffer. The Database transaction
+    runs in a worker thread, the event loop keeps receiving meanwhile. If the Database falls behind by more than
+    BACKLOG batches the writer stops draining until the transaction is done, the queues fill up and push back.
+    A failed transaction is logged and its batch kept and retried with backoff, the writer pushes back meanwhile as well.
+
+        stream = TradeStream( streams, writer, ticks, metrics, shard=200 )
+        await stream.run( bsm )     # until cancelled
+        stream.close()              # drain and write everything on shutdown
+
+    Metrics per shard: shard<n>_lag (event -> receive in us), shard<n>_queue_depth (messages, not us), the counters
+    shard<n>_reconnects, _gaps, _missed and _duplicates, trade_to_receive of all shards and the counter commit_failures.
+
+    :param streams  -> type:List: <symbol>@trade streams
+    :param writer   -> utils.TickWriter
+    :param ticks    -> tickbuffer.TickBuffer: (optional) recent ticks for CryptoTrader
+    :param metrics  -> Metrics: (optional)
+    :param shard    -> type:int: streams per connection
+    :param size     -> type:int: capacity of every shard queue in messages
+    :param timeout  -> type:float: seconds without a message after which a shard reconnects
+    '''
+    # messages taken from one shard per round, so a busy shard cannot starve the others
+    QUOTA = 1000
+    # batches the TickWriter may buffer while a transaction is running
+    BACKLOG = 4
+    # retry backoff of a failed transaction in seconds, doubled per failure up to CAP
+    BACKOFF = 0.5
+    CAP = 30.0
+
+    def __init__( self, streams, writer, ticks=None, metrics=None, shard=200, size=10000, timeout=60 ):
+        self.writer = writer
+        self.ticks = ticks
+        self.metrics = Metrics( 'TradeStream' ) if metrics is None else metrics
+        self.shards = [ Shard( i, streams[ start:start + shard ], size, timeout, self.metrics ) for i, start in enumerate( range( 0, len( streams ), shard ) ) ]
+        self.ready = asyncio.Event()
+        # the running transaction, one at a time
+        self.executor = concurrent.futures.ThreadPoolExecutor( max_workers=1, thread_name_prefix='TickWriter' )
+        self.pending = None
+        # the batch of the running transaction, or of the failed one until its retry succeeds
+        self.batch = None
+        self.failures = 0
+        self.retry = 0.0
+
+    async def run( self, bsm ):
+        ''' Receive and write until cancelled
+
+        :param bsm -> binance.BinanceSocketManager
+        '''
+        tasks = [ asyncio.ensure_future( shard.run( bsm, self.ready ) ) for shard in self.shards ]
+        tasks.append( asyncio.ensure_future( self.write() ) )
+        try:
+            await asyncio.gather( *tasks )
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def write( self ):
+        writer = self.writer
+        while True:
+            self.ready.clear()
+            if self.pending is not None and self.pending.done():
+                self.finish()
+            if self.pending is None and self.batch is not None and time.monotonic() >= self.retry:
+                # the failed batch again, the following ticks wait in the TickWriter
+                self.pending = self.executor.submit( writer.commit, self.batch )
+            if self.batch is not None and len( writer.buffer ) >= writer.size * self.BACKLOG:
+                # the Database is behind, leave the messages in the queues until the transaction is done
+                if self.pending is not None:
+                    try:
+                        await asyncio.wrap_future( self.pending )
+                    except Exception:
+                        # finish() handles a failed transaction
+                        pass
+                else:
+                    await asyncio.sleep( self.retry - time.monotonic() )
+                continue
+            n = self.drain()
+            if self.batch is None and writer.due():
+                self.batch = writer.take()
+                if self.batch is not None:
+                    self.pending = self.executor.submit( writer.commit, self.batch )
+            if n:
+                # let the shards receive
+                await asyncio.sleep( 0 )
+                continue
+            try:
+                await asyncio.wait_for( self.ready.wait(), timeout=0.1 )
+            except asyncio.TimeoutError:
+                pass
+
+    def drain( self ):
+        ''' Move up to QUOTA messages of every shard into the TickWriter and the TickBuffer
+
+        :return int: number of messages
+        '''
+        writer, ticks = self.writer, self.ticks
+        n = 0
+        for shard in self.shards:
+            queue = shard.queue
+            depth = queue.qsize()
+            shard.depth.record( depth )
+            for _ in range( min( depth, self.QUOTA ) ):
+                received, response = queue.get_nowait()
+                writer.add( response, isMultiStream=True, received=received, flush=False )
+                if ticks is not None:
+                    data = response[ 'data' ]
+                    ticks.append( data[ 's' ], data[ 'E' ], float( data[ 'p' ] ) )
+            n += min( depth, self.QUOTA )
+        return n
+
+    def finish( self ):
+        ''' Collect the running transaction, if it failed keep its batch for a retry
+        '''
+        pending, self.pending = self.pending, None
+        try:
+            start, end = pending.result()
+        except Exception as e:
+            wait = min( self.CAP, self.BACKOFF * 2 ** self.failures )
+            self.failures += 1
+            self.retry = time.monotonic() + wait
+            self.metrics.count( 'commit_failures' )
+            print( f'{str(dt.datetime.now())} commit of {len( self.batch[0] )} ticks failed ({e!r}), retry in {wait:.2f}s', flush=True )
+            return
+        self.writer.measure( self.batch, start, end )
+        self.batch = None
+        self.failures = 0
+
+    def close( self ):
+        ''' Wait for the running transaction, then write a failed batch and everything still queued or buffered
+
+        Raises if the Database still fails.
+        '''
+        if self.pending is not None:
+            self.finish()
+        if self.batch is not None:
+            self.writer.measure( self.batch, *self.writer.commit( self.batch ) )
+            self.batch = None
+        while self.drain():
+            pass
+        self.writer.flush()
+        self.executor.shutdown()
+
+    def stats( self ):
+        return [ shard.stats() for shard in self.shards ]
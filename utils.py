@@ -8,14 +8,23 @@
 import os
 import ta
 import time
+import json
+import fcntl
+import random
+import asyncio
+import threading
+import collections
 
+import aiohttp
+import requests
+
+import numpy as np
 import pandas as pd
 import datetime as dt
 
-from binance import Client
-from binance.exceptions import BinanceAPIException
-
-from decimal import Decimal, ROUND_DOWN
+from binance import Client, AsyncClient, BinanceSocketManager
+from binance.exceptions import BinanceAPIException, BinanceRequestException
+from sqlalchemy import create_engine, event
 
 class Credentials:
     """ Load key and secret from file.
@@ -34,35 +43,435 @@ class Credentials:
             self.secret = fd.readline().strip()
 
 
+class Exchange:
+    ''' Builds the REST and websocket clients of the entry points
+
+    By default these are the binance clients with the credentials of key/binance.key. Exchange.use() injects
+    another exchange, e.g. the local mockexchange.MockExchange, so the whole pipeline runs offline:
+
+        Exchange.configure( Config )
+        client = Exchange.client()
+        asyncClient = await Exchange.async_client()
+        bsm = Exchange.socket_manager( asyncClient )
+    '''
+    instance = None
+
+    def use( exchange ):
+        ''' Build all clients from exchange, None switches back to binance
+        '''
+        Exchange.instance = exchange
+
+    def configure( config ):
+        ''' Use the exchange selected by config.Exchange: binance | mock
+        '''
+        if getattr( config, 'Exchange', 'binance' ) == 'mock':
+            from mockexchange import MockExchange
+            Exchange.use( MockExchange.from_Config( config ) )
+
+    def client( keyfile='key/binance.key' ):
+        if Exchange.instance is not None:
+            return Exchange.instance.client()
+        credentials = Credentials( keyfile )
+        return Client( credentials.key, credentials.secret )
+
+    async def async_client():
+        if Exchange.instance is not None:
+            return Exchange.instance.async_client()
+        return await AsyncClient.create()
+
+    def socket_manager( client ):
+        if Exchange.instance is not None:
+            return Exchange.instance.socket_manager( client )
+        return BinanceSocketManager( client )
+
+
 class IPC:
+    ''' Signals between CryptoBot, CryptoStream and CryptoTrader based on advisory file locks (flock)
 
+    A signal is set as long as a process holds the lock on ipc/<signal>. acquire() is atomic, so there is
+    no check-then-set race, and the kernel drops the lock if the holder dies, so no stale flags remain.
+    wait() blocks in the kernel and returns the moment the holder releases the signal, no polling involved.
+    '''
     isRunning = 'isRunning'
     isPaused = 'isPaused'
 
-    def get( signal ):
+    # signal -> fd of the locks held by this process
+    held = {}
+
+    def path( signal ):
         #TODO make it a global config
-        path = getPath() + '/ipc/' + signal
-        if os.path.isfile( path ):
+        directory = getPath() + '/ipc'
+        os.makedirs( directory, exist_ok=True )
+        return directory + '/' + signal
+
+    def acquire( signal, blocking=False ):
+        ''' Atomically take the signal
+
+        :param signal   -> type:str: e.g. IPC.isRunning
+        :param blocking -> type:bool: wait until the signal is released by its current holder
+        :return bool: True if we hold the signal now
+        '''
+        if signal in IPC.held:
             return True
-        else:
-            return False    
+        fd = os.open( IPC.path( signal ), os.O_RDWR | os.O_CREAT, 0o644 )
+        try:
+            fcntl.flock( fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB )
+        except BlockingIOError:
+            os.close( fd )
+            return False
+        IPC.held[ signal ] = fd
+        return True
+
+    def release( signal ):
+        ''' Release the signal, processes waiting for it wake up immediately
+        '''
+        fd = IPC.held.pop( signal, None )
+        if fd is not None:
+            fcntl.flock( fd, fcntl.LOCK_UN )
+            os.close( fd )
 
-    def set( signal, remove=False ):
-        #TODO make it a global config
-        path = getPath() + '/ipc/' + signal
-        with open( path, 'a+' ) as fd:
-            fd.close()
-        if remove:
-            os.remove( path )    
+    def get( signal ):
+        ''' True if any process holds the signal
+        '''
+        if signal in IPC.held:
+            return True
+        fd = os.open( IPC.path( signal ), os.O_RDWR | os.O_CREAT, 0o644 )
+        try:
+            fcntl.flock( fd, fcntl.LOCK_SH | fcntl.LOCK_NB )
+            return False
+        except BlockingIOError:
+            return True
+        finally:
+            os.close( fd )
 
+    def wait( signal ):
+        ''' Block until the signal is not held anymore
+        '''
+        fd = os.open( IPC.path( signal ), os.O_RDWR | os.O_CREAT, 0o644 )
+        try:
+            fcntl.flock( fd, fcntl.LOCK_SH )
+        finally:
+            os.close( fd )
 
-class Tools:
+    def wait_async( signal ):
+        ''' Awaitable version of wait()
+
+        The blocking flock runs in a daemon thread, so a pending wait never holds up the shutdown of the event loop.
+        '''
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        def waiter():
+            IPC.wait( signal )
+            loop.call_soon_threadsafe( lambda: future.done() or future.set_result( None ) )
+        threading.Thread( target=waiter, daemon=True ).start()
+        return future
 
-    def round_crypto( amount ):
-        return Decimal( amount ).quantize(Decimal('.00000001'), rounding=ROUND_DOWN)
 
-    def round_fiat( amount ):
-        return Decimal( amount ).quantize(Decimal('.01'), rounding=ROUND_DOWN)
+class ExchangeInfo:
+    ''' Exchange metadata cache
+
+    get_exchange_info() is fetched once, persisted to a local JSON file and served from memory until it is older
+    than the TTL. Symbol filters are indexed by filterType instead of their position within the filters List.
+    An unknown symbol triggers one refetch (maybe a new listing), if it is still unknown it is remembered
+    as missing until the next refresh and raises KeyError without another request.
+    There is one instance per process, configure it once with ExchangeInfo.get( client, path, ttl ).
+
+    :param client   -> binance.Client object
+    :param path     -> type:str: (optional) JSON file the exchange info is persisted to
+    :param ttl      -> type:int: seconds until the cached exchange info is fetched again
+    '''
+    instance = None
+
+    def get( client, path=None, ttl=None ):
+        ''' Return the cache of this process
+        '''
+        if ExchangeInfo.instance is None:
+            ExchangeInfo.instance = ExchangeInfo( client, path, 3600 if ttl is None else ttl )
+        elif path is not None or ttl is not None:
+            ExchangeInfo.instance.configure( path, ttl )
+        return ExchangeInfo.instance
+
+    def __init__( self, client, path=None, ttl=3600 ):
+        self.client = client
+        self.path = path
+        self.ttl = ttl
+        self.data = None
+        self.symbols = {}
+        self.filters = {}
+        # symbols which were not listed at the last refresh
+        self.missing = set()
+        self.timestamp = 0
+        self.load()
+
+    def configure( self, path=None, ttl=None ):
+        if path is not None and path != self.path:
+            self.path = path
+            self.save()
+        if ttl is not None:
+            self.ttl = ttl
+
+    def load( self, refresh=False ):
+        ''' Load from the local file if it is fresh enough, otherwise from REST
+        '''
+        if not refresh and self.path is not None and os.path.isfile( self.path ):
+            with open( self.path, 'r' ) as fd:
+                cache = json.load( fd )
+            if time.time() - cache[ 'timestamp' ] < self.ttl:
+                return self.index( cache[ 'data' ], cache[ 'timestamp' ] )
+        self.index( RequestScheduler.get().call( self.client.get_exchange_info ), time.time() )
+        self.save()
+
+    def save( self ):
+        if self.path is None or self.data is None:
+            return
+        # write to a temp file and rename, so other processes never read a half written cache
+        tmp = f'{self.path}.{os.getpid()}'
+        with open( tmp, 'w' ) as fd:
+            json.dump( { 'timestamp' : self.timestamp, 'data' : self.data }, fd )
+        os.replace( tmp, self.path )
+
+    def index( self, data, timestamp ):
+        self.data = data
+        self.timestamp = timestamp
+        self.symbols = { info[ 'symbol' ] : info for info in data[ 'symbols' ] }
+        self.filters = { symbol : { f[ 'filterType' ] : f for f in info[ 'filters' ] } for symbol, info in self.symbols.items() }
+        self.missing = set()
+
+    def stale( self, symbols=() ):
+        ''' True if the cache is older than the TTL or one of symbols is neither listed nor known to be missing
+        '''
+        return time.time() - self.timestamp >= self.ttl or any( symbol not in self.symbols and symbol not in self.missing for symbol in symbols )
+
+    async def refresh_async( self, symbols=() ):
+        ''' Refresh in a worker thread if stale( symbols ), so the REST call and its backoff do not block the event loop
+
+        Afterwards symbol() of any of symbols is served from memory.
+        '''
+        if not self.stale( symbols ):
+            return
+        await asyncio.get_running_loop().run_in_executor( None, self.load, True )
+        self.missing |= { symbol for symbol in symbols if symbol not in self.symbols }
+
+    def symbol( self, symbol ):
+        ''' Symbol info, same as client.get_symbol_info( symbol )
+        '''
+        if time.time() - self.timestamp >= self.ttl:
+            self.load( refresh=True )
+        if symbol not in self.symbols and symbol not in self.missing:
+            # maybe a new listing
+            self.load( refresh=True )
+            if symbol not in self.symbols:
+                self.missing.add( symbol )
+        if symbol in self.missing:
+            raise KeyError( symbol )
+        return self.symbols[ symbol ]
+
+    def filter( self, symbol, filterType ):
+        ''' A filter of a symbol e.g. filter( 'BTCUSDT', 'LOT_SIZE' )[ 'stepSize' ]
+        '''
+        self.symbol( symbol )
+        return self.filters[ symbol ][ filterType ]
+
+
+
+class RequestScheduler:
+    ''' Paces all REST calls of a process under the request weight limit of the exchange
+
+    Every call is charged its weight (WEIGHTS by method name) in a sliding window of one minute. A call which
+    would exceed the limit waits until enough weight has expired instead of running into a 429, concurrent
+    callers are queued by the same window. The used weight reported by the exchange in the response headers
+    corrects our own count, so calls we do not see (other processes on the same IP) are accounted for too.
+
+    Failed calls are retried with jittered exponential backoff depending on the kind of error:
+        429/418 (rate limit, ban)   -> wait Retry-After, the whole scheduler pauses
+        5xx, timeouts, disconnects  -> backoff and retry
+        anything else (bad symbol, filter failure, insufficient balance) -> raised immediately
+
+    Orders (ORDERS) are only retried after 429/418, which the exchange rejects before processing. After a timeout,
+    a 5xx or a network error the status of the order is unknown, a retry could place it twice, so it is raised.
+
+    There is one instance per process, configure it once with RequestScheduler.get( limit, retries, backoff, cap ).
+
+        klines = RequestScheduler.get().call( client.get_historical_klines, 'BTCUSDT', '1m', '60 minutes ago UTC' )
+        klines = await RequestScheduler.get().call_async( asyncClient.get_historical_klines, 'BTCUSDT', '1m', '60 minutes ago UTC' )
+
+    :param limit    -> type:int: request weight per minute, we keep a small reserve below it
+    :param retries  -> type:int: attempts after the first one
+    :param backoff  -> type:float: seconds of the first backoff, doubled on every attempt
+    :param cap      -> type:float: maximum seconds of a single backoff
+    '''
+    instance = None
+
+    # https://binance-docs.github.io/apidocs/spot/en/#limits, unknown methods weigh 1
+    WEIGHTS = {
+        'get_historical_klines' : 2, # one request for the earliest timestamp, one for the klines
+        'get_klines' : 1,
+        'get_symbol_ticker' : 1,
+        'get_orderbook_ticker' : 1,
+        'get_order_book' : 5,
+        'get_exchange_info' : 10,
+        'get_symbol_info' : 10,
+        'get_account' : 10,
+        'get_asset_balance' : 10,
+        'get_open_orders' : 3,
+        'get_order' : 2,
+        'create_order' : 1,
+        'cancel_order' : 1,
+    }
+    WINDOW = 60
+    # rate limited or banned, the response tells us how long
+    LIMITED = { 418, 429 }
+    # UNKNOWN, DISCONNECTED, TOO_MANY_REQUESTS, UNEXPECTED_RESP, TIMEOUT, INVALID_TIMESTAMP
+    TRANSIENT = { -1000, -1001, -1003, -1006, -1007, -1021 }
+    # not idempotent, only retried while rate limited
+    ORDERS = { 'create_order', 'order_market', 'order_market_buy', 'order_market_sell', 'order_limit', 'order_limit_buy', 'order_limit_sell', 'create_oco_order' }
+    NETWORK = ( BinanceRequestException, requests.exceptions.RequestException, aiohttp.ClientError, asyncio.TimeoutError, ConnectionError )
+
+    def get( limit=None, retries=None, backoff=None, cap=None ):
+        ''' Return the scheduler of this process
+        '''
+        if RequestScheduler.instance is None:
+            RequestScheduler.instance = RequestScheduler()
+        RequestScheduler.instance.configure( limit, retries, backoff, cap )
+        return RequestScheduler.instance
+
+    def __init__( self, limit=1200, retries=5, backoff=0.5, cap=10.0 ):
+        self.limit = limit
+        self.retries = retries
+        self.backoff = backoff
+        self.cap = cap
+        # ( monotonic time, weight ) of every call within the window
+        self.calls = collections.deque()
+        self.used = 0
+        self.paused = 0.0
+        self.lock = threading.Lock()
+
+    def configure( self, limit=None, retries=None, backoff=None, cap=None ):
+        for key, value in ( ( 'limit', limit ), ( 'retries', retries ), ( 'backoff', backoff ), ( 'cap', cap ) ):
+            if value is not None:
+                setattr( self, key, value )
+
+    def weight( fn, weight=None ):
+        if weight is not None:
+            return weight
+        return RequestScheduler.WEIGHTS.get( getattr( fn, '__name__', '' ), 1 )
+
+    def reserve( self, weight ):
+        ''' Charge weight to the window if it fits, otherwise return the seconds until it will
+        '''
+        with self.lock:
+            now = time.monotonic()
+            if now < self.paused:
+                return self.paused - now
+            while self.calls and self.calls[0][0] <= now - self.WINDOW:
+                self.used -= self.calls.popleft()[1]
+            # keep 5% in reserve for what we do not know about
+            budget = self.limit * 0.95
+            if self.used + weight <= budget or not self.calls:
+                self.calls.append( ( now, weight ) )
+                self.used += weight
+                return 0.0
+            # walk the window until enough weight has expired
+            expired = self.used + weight - budget
+            for ts, w in self.calls:
+                expired -= w
+                if expired <= 0:
+                    return ts + self.WINDOW - now
+            return self.calls[-1][0] + self.WINDOW - now
+
+    def sync( self, fn ):
+        ''' Correct our count with the used weight the exchange reported for the last response of the client
+        '''
+        response = getattr( getattr( fn, '__self__', None ), 'response', None )
+        headers = getattr( response, 'headers', None )
+        if not headers:
+            return
+        reported = headers.get( 'x-mbx-used-weight-1m' ) or headers.get( 'X-MBX-USED-WEIGHT-1M' )
+        if reported is None:
+            return
+        with self.lock:
+            missing = int( reported ) - self.used
+            if missing > 0:
+                self.calls.append( ( time.monotonic(), missing ) )
+                self.used += missing
+
+    def delay( self, error, attempt, fn=None ):
+        ''' Seconds to wait before the next attempt after error, None if it must not be retried
+        '''
+        if attempt >= self.retries:
+            return None
+        # full jitter, so concurrent callers do not retry in lockstep
+        backoff = random.uniform( 0, min( self.cap, self.backoff * 2 ** attempt ) )
+        if isinstance( error, BinanceAPIException ):
+            if error.status_code in self.LIMITED:
+                headers = getattr( error.response, 'headers', None ) or {}
+                retry = float( headers.get( 'Retry-After', 0 ) or 0 )
+                wait = retry if retry > 0 else max( backoff, self.backoff )
+                # nobody gets through until the exchange lets us again
+                with self.lock:
+                    self.paused = max( self.paused, time.monotonic() + wait )
+                return wait
+        if getattr( fn, '__name__', '' ) in self.ORDERS:
+            # the order may have been placed
+            return None
+        if isinstance( error, BinanceAPIException ):
+            if error.status_code >= 500 or error.code in self.TRANSIENT:
+                return backoff
+            return None
+        if isinstance( error, self.NETWORK ):
+            return backoff
+        return None
+
+    def call( self, fn, *args, weight=None, **kwargs ):
+        ''' Call a method of a binance.Client within the rate limit, retrying transient errors
+
+        :param fn       -> bound method of binance.Client e.g. client.get_account
+        :param weight   -> type:int: (optional) request weight, default from WEIGHTS
+        :return the result of fn
+        '''
+        weight = RequestScheduler.weight( fn, weight )
+        attempt = 0
+        while True:
+            wait = self.reserve( weight )
+            if wait > 0:
+                time.sleep( wait )
+                continue
+            try:
+                result = fn( *args, **kwargs )
+            except Exception as e:
+                wait = self.delay( e, attempt, fn )
+                if wait is None:
+                    raise
+                print( f'{getattr( fn, "__name__", fn )} failed ({e}), retry {attempt + 1}/{self.retries} in {wait:.2f}s' )
+                attempt += 1
+                time.sleep( wait )
+                continue
+            self.sync( fn )
+            return result
+
+    async def call_async( self, fn, *args, weight=None, **kwargs ):
+        ''' Same as call() for a method of a binance.AsyncClient, waiting does not block the event loop
+        '''
+        weight = RequestScheduler.weight( fn, weight )
+        attempt = 0
+        while True:
+            wait = self.reserve( weight )
+            if wait > 0:
+                await asyncio.sleep( wait )
+                continue
+            try:
+                result = await fn( *args, **kwargs )
+            except Exception as e:
+                wait = self.delay( e, attempt, fn )
+                if wait is None:
+                    raise
+                print( f'{getattr( fn, "__name__", fn )} failed ({e}), retry {attempt + 1}/{self.retries} in {wait:.2f}s' )
+                attempt += 1
+                await asyncio.sleep( wait )
+                continue
+            self.sync( fn )
+            return result
+
 
 #import os
 import signal
@@ -84,6 +493,14 @@ class Processing:
     def stop( pid:int ):
         os.kill( pid, signal.SIGTERM )
 
+    def wait( pid:int ):
+        ''' Block until a process we started exits
+        '''
+        try:
+            os.waitpid( pid, 0 )
+        except ChildProcessError:
+            pass
+
 
 
 
@@ -122,7 +539,7 @@ def fetch_NonLeveragedTradePairs( client, quoteAsset='USDT' ):
     :param quoteAsset   -> type:str: Symbol of quote Asset
     :return List
     '''
-    data = client.get_exchange_info()
+    data = ExchangeInfo.get( client ).data
     symbols = [ x['symbol'] for x in data['symbols'] ]
     # leveraged tokens contain UP/DOWN BULL/BEAR in name
     # Was ist mit FIAT paaren -> EUR/USDT, AUD, BIDR, BRL, GBP, RUB, TRY, TUSD, USDC, DAI. IDTZ, UAH, NGN, VAI, USDP 'EUR', 'GBP', 'USD', 'AUD', 'JPY', 'RUB'
@@ -144,21 +561,24 @@ def fetch_OHLCV( client, symbol, interval='1d', start_date='1 day ago UTC', end_
     :param end      -> type:str|int: (optional) - end date string in UTC format or timestamp in milliseconds (default will fetch everything up to now)
     :return DataFrame['Date','Open','High','Low','Close','Volume'] | None
     '''
-    if end_date is not None:
-        try:
-            data = client.get_historical_klines( symbol, interval, start_date, end_date ) 
-        except BinanceAPIException as e:
-            print(e)
-            time.sleep(60)
-            data = client.get_historical_klines( symbol, interval, start_date, end_date )    
-    else:     
-        try:
-            data = client.get_historical_klines( symbol, interval, start_date ) 
-        except BinanceAPIException as e:
-            print(e)
-            time.sleep(60)
-            data = client.get_historical_klines( symbol, interval, start_date )   
+    # paced and retried by the scheduler, a transient error costs seconds instead of a minute
+    data = RequestScheduler.get().call( client.get_historical_klines, symbol, interval, start_date, end_date )
+    return build_OHLCV( data )
+
+
+async def fetch_OHLCV_async( client, symbol, interval='1d', start_date='1 day ago UTC', end_date=None ):
+    ''' Same as fetch_OHLCV() on a binance.AsyncClient, so several symbols can be fetched concurrently
+
+    :param client   -> binance.AsyncClient object
+    :return DataFrame['Date','Open','High','Low','Close','Volume'] | None
+    '''
+    data = await RequestScheduler.get().call_async( client.get_historical_klines, symbol, interval, start_date, end_date )
+    return build_OHLCV( data )
+
 
+def build_OHLCV( data ):
+    ''' Kline data as returned by get_historical_klines() to an OHLCV DataFrame
+    '''
     # convert result to DataFrame
     df = pd.DataFrame( data )
     # We fetched more data than we need, we just need the first six columns
@@ -181,9 +601,10 @@ def fetch_Portfolio( client ):
     :return Dict | None
     '''
     try:
-        assets = client.get_account()['balances']
+        assets = RequestScheduler.get().call( client.get_account )['balances']
     except BinanceAPIException as e:
         print(e)
+        return None
     portfolio = {}
     for asset in assets:
         if float( asset['free'] ) > 0.00000000:
@@ -192,25 +613,60 @@ def fetch_Portfolio( client ):
 
 
 def fetch_Balance( client ):
-    assets = client.get_account()['balances']
+    assets = RequestScheduler.get().call( client.get_account )['balances']
     for asset in assets:
         if asset['asset'] == 'USDT':
             return float( asset['free'] )
 
 
-def applyIndicators( df ):
-    ''' Apply Technical Indicators to given DataFrame
+''' Technical Indicators
 
-    We expect the following OHLCV columns within the given DataFrame
-    ['Time','Open','High','Low','Close','Volume']
+Every indicator is registered in Indicators together with the columns it needs and produces and its parameters.
+applyIndicators() only computes what is asked for, intermediates which are shared between indicators (EMAs, SMAs)
+are computed once per call and cached.
+
+Basic reading https://www.investopedia.com/terms/t/technical-analysis-of-stocks-and-trends.asp
+'''
+Indicators = {}
 
-    Basic reading https://www.investopedia.com/terms/t/technical-analysis-of-stocks-and-trends.asp
+def indicator( name, inputs, columns, **params ):
+    ''' Register an indicator function
+
+    :param name     -> type:str: name used to select the indicator
+    :param inputs   -> type:List: OHLCV columns the indicator reads
+    :param columns  -> type:List: columns the indicator adds to the DataFrame
+    :param params   -> parameters handed over to the indicator function
     '''
+    def register( fn ):
+        Indicators[ name ] = { 'fn' : fn, 'inputs' : inputs, 'columns' : columns, 'params' : params }
+        return fn
+    return register
 
-    ## Momentum Indicators
-    # https://www.investopedia.com/investing/momentum-and-relative-strength-index/
-    ##
 
+def _ema( df, cache, window ):
+    ''' Cached EMA of Close, same as ta.trend.ema_indicator( fillna=True )
+    '''
+    key = ( 'EMA', window )
+    if key not in cache:
+        cache[ key ] = df.Close.ewm( span=window, min_periods=0, adjust=False ).mean()
+    return cache[ key ]
+
+
+def _sma( df, cache, window ):
+    ''' Cached SMA of Close, same as ta.trend.sma_indicator( fillna=True )
+    '''
+    key = ( 'SMA', window )
+    if key not in cache:
+        cache[ key ] = df.Close.rolling( window=window, min_periods=0 ).mean()
+    return cache[ key ]
+
+
+## Momentum Indicators
+# https://www.investopedia.com/investing/momentum-and-relative-strength-index/
+##
+
+@indicator( 'RSI', inputs=[ 'Close' ], columns=[ 'RSI' ], window=14 )
+def _rsi( df, cache, window ):
     '''
     Relative Strength Index (RSI)
 
@@ -220,9 +676,11 @@ def applyIndicators( df ):
     https://www.investopedia.com/terms/r/rsi.asp
     https://technical-analysis-library-in-python.readthedocs.io/en/latest/ta.html#ta.momentum.rsi
     '''
-    df[ 'RSI' ] = ta.momentum.rsi( df.Close, window=14, fillna=True )
+    df[ 'RSI' ] = ta.momentum.rsi( df.Close, window=window, fillna=True )
 
 
+@indicator( 'MACD', inputs=[ 'Close' ], columns=[ 'MACD', 'MACD_Diff', 'MACD_Signal' ], window_fast=12, window_slow=26, window_sign=9 )
+def _macd( df, cache, window_fast, window_slow, window_sign ):
     '''
     Moving Average Convergence Divergence (MACD)
 
@@ -232,12 +690,15 @@ def applyIndicators( df ):
     https://www.investopedia.com/terms/m/macd.asp
     https://technical-analysis-library-in-python.readthedocs.io/en/latest/ta.html#ta.trend.MACD
     '''
-    macd = ta.trend.MACD( df.Close, window_fast=12, window_slow=26, window_sign=9, fillna=True )
-    df[ 'MACD' ] = macd.macd()
-    df[ 'MACD_Diff' ] = macd.macd_diff()
-    df[ 'MACD_Signal' ] = macd.macd_signal()
+    macd = _ema( df, cache, window_fast ) - _ema( df, cache, window_slow )
+    signal = macd.ewm( span=window_sign, min_periods=0, adjust=False ).mean()
+    df[ 'MACD' ] = macd
+    df[ 'MACD_Diff' ] = macd - signal
+    df[ 'MACD_Signal' ] = signal
 
 
+@indicator( 'SMA', inputs=[ 'Close' ], columns=[ 'SMA7', 'SMA25', 'SMA60', 'SMA12', 'SMA26', 'SMA50', 'SMA200' ], windows=[ 7, 25, 60, 12, 26, 50, 200 ] )
+def _smas( df, cache, windows ):
     '''
     Simple Moving Average (SMA)
     
@@ -248,17 +709,13 @@ def applyIndicators( df ):
     https://www.investopedia.com/terms/s/sma.asp
     https://technical-analysis-library-in-python.readthedocs.io/en/latest/ta.html#ta.trend.sma_indicator
     '''
-    # SMAs according to Binance
-    df[ 'SMA7' ] = ta.trend.sma_indicator( df.Close, window=7, fillna=True )
-    df[ 'SMA25' ] = ta.trend.sma_indicator( df.Close, window=25, fillna=True )
-    df[ 'SMA60' ] = ta.trend.sma_indicator( df.Close, window=60, fillna=True )
-    # Commonly used SMAs
-    df[ 'SMA12' ] = ta.trend.sma_indicator( df.Close, window=12, fillna=True )
-    df[ 'SMA26' ] = ta.trend.sma_indicator( df.Close, window=26, fillna=True )
-    df[ 'SMA50' ] = ta.trend.sma_indicator( df.Close, window=50, fillna=True )
-    df[ 'SMA200' ] = ta.trend.sma_indicator( df.Close, window=200, fillna=True )
+    # SMAs according to Binance 7, 25, 60 | Commonly used SMAs 12, 26, 50, 200
+    for window in windows:
+        df[ f'SMA{window}' ] = _sma( df, cache, window )
 
 
+@indicator( 'PSAR', inputs=[ 'High', 'Low', 'Close' ], columns=[ 'PSAR', 'PSAR_down', 'PSAR_down_ind', 'PSAR_up', 'PSAR_up_ind' ], step=0.02, max_step=2 )
+def _psar( df, cache, step, max_step ):
     '''
     Parabolic Stop and Reverse (Parabolic SAR)
 
@@ -268,7 +725,7 @@ def applyIndicators( df ):
     https://www.investopedia.com/terms/p/parabolicindicator.asp
     https://technical-analysis-library-in-python.readthedocs.io/en/latest/ta.html#ta.trend.PSARIndicator
     '''
-    psar = ta.trend.PSARIndicator( high=df.High, low=df.Low, close=df.Close, step=0.02, max_step=2, fillna=True )
+    psar = ta.trend.PSARIndicator( high=df.High, low=df.Low, close=df.Close, step=step, max_step=max_step, fillna=True )
     df[ 'PSAR' ] = psar.psar()
     df[ 'PSAR_down' ] = psar.psar_down()
     df[ 'PSAR_down_ind' ] = psar.psar_down_indicator()
@@ -276,6 +733,8 @@ def applyIndicators( df ):
     df[ 'PSAR_up_ind' ] = psar.psar_up_indicator()
 
 
+@indicator( 'BB', inputs=[ 'Close' ], columns=[ 'bb_avg', 'bb_high', 'bb_low' ], window=20, window_dev=2 )
+def _bollinger( df, cache, window, window_dev ):
     '''
     Bollinger Bands
 
@@ -287,12 +746,15 @@ def applyIndicators( df ):
     https://www.investopedia.com/terms/b/bollingerbands.asp
     https://technical-analysis-library-in-python.readthedocs.io/en/latest/ta.html#ta.volatility.BollingerBands
     '''
-    bb = ta.volatility.BollingerBands( close=df.Close, window=20, window_dev=2, fillna=True )
-    df[ 'bb_avg' ] = bb.bollinger_mavg()
-    df[ 'bb_high' ] = bb.bollinger_hband()
-    df[ 'bb_low' ] = bb.bollinger_lband()
+    mavg = _sma( df, cache, window )
+    mstd = df.Close.rolling( window=window, min_periods=0 ).std( ddof=0 )
+    df[ 'bb_avg' ] = mavg
+    df[ 'bb_high' ] = mavg + window_dev * mstd
+    df[ 'bb_low' ] = mavg - window_dev * mstd
 
 
+@indicator( 'ATR', inputs=[ 'High', 'Low', 'Close' ], columns=[ 'ATR' ], window=14 )
+def _atr( df, cache, window ):
     '''
     Average True Range (ATR)
     
@@ -306,9 +768,11 @@ def applyIndicators( df ):
     https://www.investopedia.com/terms/a/atr.asp
     https://technical-analysis-library-in-python.readthedocs.io/en/latest/ta.html#ta.volatility.AverageTrueRange
     '''
-    df[ 'ATR' ] = ta.volatility.AverageTrueRange( high=df.High, low=df.Low, close=df.Close, window=14, fillna=True ).average_true_range()
+    df[ 'ATR' ] = ta.volatility.AverageTrueRange( high=df.High, low=df.Low, close=df.Close, window=window, fillna=True ).average_true_range()
 
 
+@indicator( 'OBV', inputs=[ 'Close', 'Volume' ], columns=[ 'OBV' ] )
+def _obv( df, cache ):
     '''
     On-balance volume (OBV)
 
@@ -326,6 +790,8 @@ def applyIndicators( df ):
     df[ 'OBV' ] = ta.volume.OnBalanceVolumeIndicator( close=df.Close, volume=df.Volume, fillna=True).on_balance_volume()
 
 
+@indicator( 'ROC', inputs=[ 'Close' ], columns=[ 'ROC' ], window=3 )
+def _roc( df, cache, window ):
     '''
     Rate of Change (ROC)
 
@@ -340,13 +806,37 @@ def applyIndicators( df ):
     https://www.investopedia.com/terms/p/pricerateofchange.asp
     https://technical-analysis-library-in-python.readthedocs.io/en/latest/ta.html#ta.momentum.ROCIndicator
     '''
-    df[ 'ROC' ] = ta.momentum.ROCIndicator( close=df.Close, window=3, fillna=True ).roc()
+    df[ 'ROC' ] = ta.momentum.ROCIndicator( close=df.Close, window=window, fillna=True ).roc()
 
 
+def applyIndicators( df, indicators=None ):
+    ''' Apply Technical Indicators to given DataFrame
 
+    We expect the following OHLCV columns within the given DataFrame
+    ['Time','Open','High','Low','Close','Volume']
+
+    :param df           -> DataFrame
+    :param indicators   -> type:List: (optional) names of registered indicators or of the columns they produce
+                           e.g. [ 'ROC', 'RSI', 'SMA7' ], everything else is skipped. Default: all indicators
+    :return DataFrame: the given DataFrame augmented with the indicator columns
     '''
-    return the augmented DataFrame
-    '''
+    if indicators is None:
+        selected = list( Indicators )
+    else:
+        selected = []
+        for column in indicators:
+            name = column if column in Indicators else next( ( key for key, ind in Indicators.items() if column in ind[ 'columns' ] ), None )
+            if name is None:
+                raise ValueError( f'Unknown indicator {column}' )
+            if name not in selected:
+                selected.append( name )
+
+    # intermediates shared between indicators
+    cache = {}
+    for name in selected:
+        ind = Indicators[ name ]
+        ind[ 'fn' ]( df, cache, **ind[ 'params' ] )
+
     return df
 
 
@@ -389,83 +879,320 @@ def build_Frame( msg, isMultiStream=None ):
     return df
 
 
+class TickWriter:
+    ''' Buffered bulk writer for Websocket trade ticks
+
+    Instead of a one-row DataFrame + to_sql() per trade, the decoded ticks are collected in memory
+    and written with executemany inside a single transaction once either threshold is hit.
+    flush() must be called on shutdown, otherwise the buffered ticks are lost.
+
+    Trades are also aggregated into 1m klines per symbol (by trade time, like Binance does). Every flush writes
+    what changed since the last one as part of a bar and merges it into the stored bar within the same transaction
+    (high/low extended, volume added, latest close), so a restarted writer extends the bar of the minute it
+    started in instead of replacing it.
+
+    The writer also records its session, the event time of its first and latest tick, see queryKlines().
+
+    :param engine   -> SQLalchemy Engine Object (see connectDB)
+    :param size     -> type:int: flush after this many buffered ticks
+    :param interval -> type:float: flush after this many seconds since the last flush
+    :param metrics  -> Metrics: (optional) record receive_to_commit per tick and the duration of every commit
+    '''
+    def __init__( self, engine, size=500, interval=1.0, metrics=None ):
+        self.engine = engine
+        self.size = size
+        self.interval = interval
+        self.metrics = metrics
+        # perf_counter_ns() of every buffered tick, only with metrics
+        self.received = []
+        self.buffer = []
+        self.symbols = set()
+        # symbol -> [ time, open, high, low, close, volume ] of the ticks of the current 1m bar since the last take()
+        self.klines = {}
+        self.changed = set()
+        self.closed = []
+        self.last = time.monotonic()
+        # event time in ms of the first committed tick
+        self.start = None
+
+    def add( self, msg, isMultiStream=None, received=None, flush=True ):
+        ''' Decode a Websocket response and buffer it, flushes if a threshold is hit
+
+        :param msg              -> type:dict: Websocket response
+        :param isMultiStream    -> type:bool: True if message comes from a Websocket Multistream
+        :param received         -> type:int: (optional) perf_counter_ns() the message was received, default now
+        :param flush            -> type:bool: False to only buffer, the caller commits with take() and commit()
+        '''
+        if isMultiStream is not None:
+            msg = msg[ 'data' ]
+        symbol = msg[ 's' ]
+        price = float( msg[ 'p' ] )
+        self.buffer.append( ( symbol, msg[ 'E' ], msg[ 't' ], price ) )
+        if self.metrics is not None:
+            self.received.append( time.perf_counter_ns() if received is None else received )
+
+        minute = msg[ 'T' ] - msg[ 'T' ] % 60000
+        bar = self.klines.get( symbol )
+        if bar is None or minute != bar[0]:
+            if bar is not None:
+                # the part of the previous bar still needs to be written
+                self.closed.append( ( symbol, *bar ) )
+            self.klines[ symbol ] = [ minute, price, price, price, price, float( msg[ 'q' ] ) ]
+        else:
+            if price > bar[2]:
+                bar[2] = price
+            if price < bar[3]:
+                bar[3] = price
+            bar[4] = price
+            bar[5] += float( msg[ 'q' ] )
+        self.changed.add( symbol )
+        if flush:
+            self.poll()
+
+    def due( self ):
+        ''' True if either the size or the time threshold is reached
+        '''
+        return len( self.buffer ) >= self.size or time.monotonic() - self.last >= self.interval
+
+    def poll( self ):
+        ''' Flush if either the size or the time threshold is reached
+        '''
+        if self.due():
+            self.flush()
+
+    def flush( self ):
+        ''' Write all buffered ticks and changed klines within one transaction
+        '''
+        batch = self.take()
+        if batch is not None:
+            self.measure( batch, *self.commit( batch ) )
+
+    def take( self ):
+        ''' Hand over everything buffered, the next ticks go to a new buffer
+
+        Together with commit() and measure() this is flush() in three steps, so the transaction can run in a worker thread
+        while the event loop keeps buffering. At most one commit() may run at a time.
+
+        :return Tuple( ticks, klines, received ), None if there is nothing to write
+        '''
+        self.last = time.monotonic()
+        if not self.buffer and not self.changed:
+            return None
+        ticks, self.buffer = self.buffer, []
+        received, self.received = self.received, []
+        klines, self.closed = self.closed, []
+        # the next tick of a bar starts a new part of it
+        klines += [ ( symbol, *self.klines.pop( symbol ) ) for symbol in self.changed ]
+        self.changed = set()
+        return ticks, klines, received
+
+    def commit( self, batch ):
+        ''' Write a batch of take() within one transaction
+
+        :return Tuple( int, int ): perf_counter_ns() at the start and the end of the transaction
+        '''
+        ticks, klines, _ = batch
+        symbols = { row[0] for row in ticks } - self.symbols
+        session = ( self.start or min( row[1] for row in ticks ), max( row[1] for row in ticks ) ) if ticks else None
+        start = time.perf_counter_ns()
+        with self.engine.begin() as conn:
+            if symbols:
+                conn.exec_driver_sql( 'INSERT OR IGNORE INTO symbols ( symbol ) VALUES ( ? )', [ ( symbol, ) for symbol in symbols ] )
+            # OR IGNORE: a tick which was already stored (same symbol, time and trade id) is simply skipped
+            conn.exec_driver_sql( 'INSERT OR IGNORE INTO ticks ( symbol, time, id, price ) VALUES ( ?, ?, ?, ? )', ticks )
+            # the parts are merged, the open of the first part stays
+            conn.exec_driver_sql( '''INSERT INTO klines ( symbol, time, open, high, low, close, volume ) VALUES ( ?, ?, ?, ?, ?, ?, ? )
+                ON CONFLICT ( symbol, time ) DO UPDATE SET high = max( high, excluded.high ), low = min( low, excluded.low ),
+                close = excluded.close, volume = volume + excluded.volume''', klines )
+            if session is not None:
+                conn.exec_driver_sql( 'INSERT INTO sessions ( start, last ) VALUES ( ?, ? ) ON CONFLICT ( start ) DO UPDATE SET last = max( last, excluded.last )', session )
+        # only once they are stored, a failed transaction is retried with the same batch
+        self.symbols |= symbols
+        if session is not None:
+            self.start = session[0]
+        return start, time.perf_counter_ns()
+
+    def measure( self, batch, start, end ):
+        ''' Record the commit of a batch in the metrics, on the thread which owns them
+        '''
+        if self.metrics is None:
+            return
+        self.metrics.record( 'commit', ( end - start ) // 1000 )
+        latency = self.metrics.histogram( 'receive_to_commit' )
+        for ns in batch[2]:
+            latency.record( ( end - ns ) // 1000 )
+
+
 def fetch_Lotsize( client, symbol ):
-    info = client.get_symbol_info( symbol )
-    return float( info['filters'][2]['minQty'] ) 
+    return float( ExchangeInfo.get( client ).filter( symbol, 'LOT_SIZE' )['minQty'] )
 
 
 def fetch_AssetMetadata( client, symbol ):
     ''' Fetch Metadata needed for placing Orders
     '''
-    info = client.get_symbol_info( symbol )    
+    info = ExchangeInfo.get( client ).symbol( symbol )
     precision = info['baseAssetPrecision']
-    lotsize = info['filters'][2]['minQty']
+    lotsize = ExchangeInfo.get( client ).filter( symbol, 'LOT_SIZE' )['minQty']
 
     return { 'lotsize' : float(lotsize), 'precision' : precision   }
 
 
+def connectDB( path ):
+    ''' Create the SQLalchemy Engine for the tick Database and make sure the schema exists
+
+    All ticks live in one table, clustered by ( symbol, time, id ) so a lookback query for one symbol
+    is an index range scan. The Database runs in WAL mode, so CryptoTrader can read while CryptoStream writes.
+
+    :param path -> type:str: path to sqlite3 file
+    :return SQLalchemy Engine Object
+    '''
+    engine = create_engine( f'sqlite:///{path}', connect_args={ 'timeout' : 30 } )
+
+    @event.listens_for( engine, 'connect' )
+    def pragma( dbapi_connection, connection_record ):
+        cursor = dbapi_connection.cursor()
+        cursor.execute( 'PRAGMA journal_mode=WAL' )
+        cursor.execute( 'PRAGMA synchronous=NORMAL' )
+        cursor.close()
+
+    with engine.begin() as conn:
+        # time: event time in ms | id: trade id
+        conn.exec_driver_sql( '''CREATE TABLE IF NOT EXISTS ticks (
+            symbol TEXT NOT NULL,
+            time INTEGER NOT NULL,
+            id INTEGER NOT NULL,
+            price REAL NOT NULL,
+            PRIMARY KEY ( symbol, time, id )
+        ) WITHOUT ROWID''' )
+        conn.exec_driver_sql( 'CREATE TABLE IF NOT EXISTS symbols ( symbol TEXT PRIMARY KEY ) WITHOUT ROWID' )
+        # 1m klines built by CryptoStream, time: open time in ms
+        conn.exec_driver_sql( '''CREATE TABLE IF NOT EXISTS klines (
+            symbol TEXT NOT NULL,
+            time INTEGER NOT NULL,
+            open REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            close REAL NOT NULL,
+            volume REAL NOT NULL,
+            PRIMARY KEY ( symbol, time )
+        ) WITHOUT ROWID''' )
+        # one row per TickWriter, event time in ms of its first and its latest tick: the stream ran in between
+        conn.exec_driver_sql( 'CREATE TABLE IF NOT EXISTS sessions ( start INTEGER PRIMARY KEY, last INTEGER NOT NULL )' )
+    return engine
+
+
+def querySymbols( engine ):
+    ''' Return a List of all symbols which are stored in the Database
+
+    :param engine -> SQLalchemy Engine Object
+    :return List
+    '''
+    with engine.connect() as conn:
+        return [ row[0] for row in conn.exec_driver_sql( 'SELECT symbol FROM symbols' ) ]
+
+
 def queryDB( engine, symbol, lookback:int ):
-    ''' Query Crypto.db 
+    ''' Query the ticks of one symbol within the lookback window
 
     :param engine -> SQLalchemy Engine Object
     :param symbol
-    :param lookback
-    '''
-    lookback = lookback * 60 #minute to second conversion
-    now = dt.datetime.now() - dt.timedelta( hours=1 ) #binance server are 1hour ahead
-    before = now - dt.timedelta( seconds=lookback)
-    #before = now - dt.timedelta( minutes=lookback )
-    querystr = f"SELECT * FROM '{symbol}' WHERE TIME >= '{before}'"
-    return pd.read_sql( querystr, engine )
-
-
-
-# we need a function to create a pseudo order response for testing
-def pseudoMarketOrder( side, symbol, qty, price, precision ):
-
-    #'origQty': '12.30000000' '0.00020000' '0.01210000'
-    origQTY = qty
-    quoteQTY = Decimal( qty*price )
-    halfedQTY = Decimal( origQTY/2 )
-    batch1QTY = Decimal( halfedQTY + (halfedQTY/2) )
-    batch1Fee = float( round( ( batch1QTY / 100 ) * 0.1, precision ) )
-    batch2QTY = float( halfedQTY/2 )
-    batch2Fee = float( round( ( batch2QTY / 100 ) * 0.1, precision ) )
-
-    order = {
-        'symbol': symbol, 
-        'orderId': 22107854, 
-        'orderListId': -1, 
-        'clientOrderId': 'DkGnomuTY9lz4kkALHQ87f', 
-        'transactTime': 1637194823283, 
-        'price': '0.00000000', 
-        'origQty': origQTY, 
-        'executedQty': origQTY, 
-        'cummulativeQuoteQty': quoteQTY, 
-        'status': 'FILLED', 
-        'timeInForce': 'GTC', 
-        'type': 'MARKET', 
-        'side': side, 
-        'fills': [
-            {
-            'price': price, 
-            'qty': batch1QTY, 
-            'commission': batch1Fee, 
-            'commissionAsset': symbol, 
-            'tradeId': 2498963
-            }, 
-            {
-            'price': price, 
-            'qty': batch2QTY, 
-            'commission': batch2Fee, 
-            'commissionAsset': symbol, 
-            'tradeId': 2498964
-            }
-        ]
-    }
+    :param lookback -> type:int: minutes
+    :return DataFrame[ 'Time', 'Symbol', 'Price' ]
+    '''
+    # event times are UTC epoch ms, so no timezone fiddling needed
+    since = int( time.time() * 1000 ) - lookback * 60 * 1000
+    querystr = 'SELECT time AS Time, symbol AS Symbol, price AS Price FROM ticks WHERE symbol = ? AND time >= ? ORDER BY time'
+    df = pd.read_sql( querystr, engine, params=( symbol, since ) )
+    df.Time = pd.to_datetime( df.Time, unit='ms' )
+    return df
+
+
+
+def queryKlines( engine, symbol, lookback:int ):
+    ''' Query the 1m klines CryptoStream built from the trade stream
+
+    Same shape as fetch_OHLCV( interval='1m', start_date=f'{lookback} minutes ago UTC' ): lookback bars,
+    the last one is the still forming bar. Minutes without trades are filled like Binance does,
+    with the previous close and zero volume.
+
+    Only a window which one running CryptoStream session covers completely is served: the session started
+    before the window and its latest tick is at most a minute old. A window which crosses a restart or an outage
+    would otherwise be filled with flat bars, instead the caller falls back to REST.
+
+    :param engine   -> SQLalchemy Engine Object
+    :param symbol
+    :param lookback -> type:int: minutes
+    :return DataFrame['Date','Open','High','Low','Close','Volume'] | None if the local history does not cover the lookback
+    '''
+    now = int( time.time() * 1000 )
+    current = now - now % 60000
+    since = current - ( lookback - 1 ) * 60000
+    # we need one bar of the session at or before the window start, otherwise the stream did not run long enough
+    querystr = '''WITH session AS ( SELECT MAX( start ) AS start FROM sessions WHERE start <= :since AND last >= :recent )
+        SELECT time AS Date, open AS Open, high AS High, low AS Low, close AS Close, volume AS Volume FROM klines
+        WHERE symbol = :symbol AND time >= ( SELECT MAX( time ) FROM klines, session WHERE symbol = :symbol AND time <= :since
+            AND time >= session.start - session.start % 60000 ) ORDER BY time'''
+    df = pd.read_sql( querystr, engine, params={ 'symbol' : symbol, 'since' : since, 'recent' : now - 60000 } )
+    if df.empty:
+        return None
+    return fill_Klines( df.set_index( 'Date' ), since, current )
+
+
+def fill_Klines( df, since, current ):
+    ''' Fill the minutes without trades of 1m klines and cut them to the window [ since, current ]
+
+    :param df       -> DataFrame['Open','High','Low','Close','Volume'] indexed by the open time in ms, sorted
+    :param since    -> type:int: open time in ms of the first bar
+    :param current  -> type:int: open time in ms of the last (forming) bar
+    :return DataFrame['Date','Open','High','Low','Close','Volume'] with a DatetimeIndex
+    '''
+    df = df.reindex( range( int( df.index[0] ), current + 60000, 60000 ) )
+    df.Close = df.Close.ffill()
+    for column in [ 'Open', 'High', 'Low' ]:
+        df[ column ] = df[ column ].fillna( df.Close )
+    df.Volume = df.Volume.fillna( 0.0 )
+    df = df.loc[ since: ]
+    df.index = pd.to_datetime( df.index, unit='ms' )
+    df.index.name = 'Date'
+    return df.astype( float )
 
-    return order
 
+def rank_Momentum( engine, lookback:int, ticks=None, top=None, now=None ):
+    ''' Rank all symbols by their cumulative return within the lookback window
+
+    Replaces the per symbol queryDB() loop. ( pct_change() + 1 ).prod() - 1 is simply last / first - 1,
+    so we only need the first and the latest price of every symbol. With a TickBuffer this is one vectorized
+    pass over shared memory, otherwise one grouped query which does two index seeks per symbol.
+
+    :param engine   -> SQLalchemy Engine Object
+    :param lookback -> type:int: minutes
+    :param ticks    -> type:TickBuffer: (optional) read from the ring buffer instead of the Database
+    :param top      -> type:int: (optional) only return the K best symbols
+    :param now      -> type:int: (optional) end of the window in ms, default the current time
+    :return Series: cumulative return indexed by symbol, sorted descending
+    '''
+    now = int( time.time() * 1000 ) if now is None else now
+    since = now - lookback * 60 * 1000
+    if ticks is not None:
+        symbols = np.asarray( ticks.symbols )
+        cumret = ticks.returns( since )
+    else:
+        querystr = '''SELECT s.symbol,
+            ( SELECT price FROM ticks t WHERE t.symbol = s.symbol AND t.time >= :since AND t.time <= :now ORDER BY t.time ASC LIMIT 1 ) AS first,
+            ( SELECT price FROM ticks t WHERE t.symbol = s.symbol AND t.time >= :since AND t.time <= :now ORDER BY t.time DESC LIMIT 1 ) AS last
+            FROM symbols s'''
+        df = pd.read_sql( querystr, engine, params={ 'since' : since, 'now' : now } )
+        symbols = df.symbol.to_numpy()
+        cumret = ( df['last'] / df['first'] - 1 ).to_numpy( dtype=float )
+    # symbols without ticks can not be ranked
+    valid = ~np.isnan( cumret )
+    symbols, cumret = symbols[valid], cumret[valid]
+    if top is not None and top < len( cumret ):
+        # partial sort, we only need the K best
+        idx = np.argpartition( -cumret, top - 1 )[:top]
+        symbols, cumret = symbols[idx], cumret[idx]
+    order = np.argsort( -cumret, kind='stable' )
+    return pd.Series( cumret[order], index=symbols[order], name='cumret' )
 
 
 def pseudoBalance( balance=None ):